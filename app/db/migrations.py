@@ -0,0 +1,29 @@
+"""
+Schema changes create_all can't make: it only creates missing tables, never columns of existing ones.
+Run on startup after create_all, every step is skipped once applied.
+"""
+
+# (table, column, sql type) added after the first release
+COLUMNS = [
+    ("documents", "content_hash", "VARCHAR"),
+    ("chunks", "content_hash", "VARCHAR"),
+    ("chunks", "minhash", "BLOB"),
+    ("chunks", "canonical_id", "INTEGER"),
+    ("ingestion_jobs", "replace_existing", "BOOLEAN"),
+]
+
+INDEXES = [
+    ("ix_documents_content_hash", "documents", "content_hash"),
+    ("ix_documents_filename", "documents", "filename"),
+    ("ix_chunks_canonical_id", "chunks", "canonical_id"),
+]
+
+def add_missing_columns(connection):
+    for table, column, sql_type in COLUMNS:
+        existing = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+            print(f"Added column {table}.{column}")
+
+    for name, table, column in INDEXES:
+        connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, Boolean, ForeignKey, DateTime, func, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -6,8 +6,9 @@ class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String, nullable=False)
+    filename = Column(String, nullable=False, index=True)
     total_chunks = Column(Integer, nullable=False) 
+    content_hash = Column(String, index=True)    # sha256 of the file + chunking params, finds exact re-uploads
 
     chunks = relationship("Chunk", back_populates="document")
 
@@ -19,6 +20,9 @@ class Chunk(Base):
     chunk_index = Column(Integer)
     text = Column(Text)
     vector_id = Column(String)    # Qdrant id for chunk
+    content_hash = Column(String)    # sha256 of the text, unchanged chunks keep their vector on re-ingestion
+    minhash = Column(LargeBinary)    # near_dup.py signature
+    canonical_id = Column(Integer, index=True)    # set on a near duplicate: the chunk whose vector it shares
 
     document = relationship("Document", back_populates="chunks")
 
@@ -36,4 +40,34 @@ class Booking(Base):
 
     __table_args__ = (
         UniqueConstraint('email', 'phone_number', 'date', 'time', name='unique_booking'),
-    )
\ No newline at end of file
+    )
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)    # uuid hex
+    filename = Column(String, nullable=False)
+    saved_path = Column(String, nullable=False)
+    chunk_strategy = Column(String, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    replace_existing = Column(Boolean, default=False)    # update the latest document with the same filename in place
+
+    status = Column(String, nullable=False, default="queued")    # queued / running / done / failed
+    stage = Column(String, nullable=False, default="queued")     # what a running job is doing right now
+    worker = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    total_pages = Column(Integer)
+    pages_done = Column(Integer, nullable=False, default=0)
+    chunks_done = Column(Integer, nullable=False, default=0)
+    document_id = Column(Integer)
+    error = Column(Text)
+
+    # naive utc
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)    # bumped on every progress update, a stale one means the worker died
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_created", "status", "created_at"),
+    )
@@ -1,3 +1,14 @@
+import os
+import re
+from collections import deque
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from app.services.shared.token_counter import TokenCounter
+
+load_dotenv()
+
 def chunk_fixed(text: str, chunk_size: int = 500) -> list[str]:
     return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
 
@@ -22,3 +33,217 @@ def chunk_semantic(text: str, chunk_size: int = 500) -> list[str]:
     if current_chunk:
         chunks.append(current_chunk)
     return chunks
+
+# streaming versions, text arrives in pieces (pages) and chunks come out as soon as they are complete
+# both give exactly the same chunks as above for "".join(pieces)
+
+def iter_chunks_fixed(pieces: Iterable[str], chunk_size: int = 500) -> Iterator[str]:
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        full = len(buffer) - len(buffer) % chunk_size
+        for i in range(0, full, chunk_size):
+            yield buffer[i:i+chunk_size]
+        buffer = buffer[full:]
+    if buffer:
+        yield buffer
+
+def iter_chunks_semantic(pieces: Iterable[str], chunk_size: int = 500) -> Iterator[str]:
+    """
+    - paragraphs can span pieces, only the unfinished one is kept in memory
+    - a paragraph longer than chunk_size is sliced anyway, its slices are emitted while it's still being read
+      so text without blank lines (common in pdf extraction) doesn't pile up
+    """
+    current_chunk = ""
+    pending = ""          # unfinished paragraph
+    long_tail = False     # pending is the rest of a paragraph already known to be longer than chunk_size
+
+    def add_paragraph(para: str) -> Iterator[str]:
+        nonlocal current_chunk
+        if len(current_chunk) + len(para) + 1 <= chunk_size:
+            current_chunk += (" " if current_chunk else "") + para
+            return
+        if current_chunk:
+            yield current_chunk
+        if len(para) > chunk_size:
+            for i in range(0, len(para), chunk_size):
+                yield para[i:i+chunk_size]
+            current_chunk = ""
+        else:
+            current_chunk = para
+
+    def finish_long(tail: str) -> Iterator[str]:
+        tail = tail.rstrip()
+        for i in range(0, len(tail), chunk_size):
+            yield tail[i:i+chunk_size]
+
+    for piece in pieces:
+        parts = (pending + piece).split('\n\n')
+        pending = parts.pop()
+        for part in parts:
+            if long_tail:
+                yield from finish_long(part)
+                long_tail = False
+            elif part.strip():
+                yield from add_paragraph(part.strip())
+
+        head = pending if long_tail else pending.lstrip()
+        body = head.rstrip()    # the final paragraph starts with this whatever comes next
+        if len(body) > chunk_size or (long_tail and len(body) >= chunk_size):
+            if not long_tail and current_chunk:
+                yield current_chunk
+                current_chunk = ""
+            full = len(body) - len(body) % chunk_size
+            for i in range(0, full, chunk_size):
+                yield head[i:i+chunk_size]
+            pending = head[full:]
+            long_tail = True
+
+    if long_tail:
+        yield from finish_long(pending)
+    elif pending.strip():
+        yield from add_paragraph(pending.strip())
+
+    if current_chunk:
+        yield current_chunk
+
+# token aware chunking: the budget is in tokens of the embedding model, not characters
+
+# all-MiniLM-L6-v2 reads 256 tokens (embeddings.MAX_SEQ_LENGTH) with [CLS] & [SEP], anything after is cut off
+CHUNK_MAX_TOKENS = 254
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+TOKEN_COUNT_BATCH = 256    # segments per encode_batch call
+MAX_SEGMENT_CHARS = 64 * 1024    # text without any sentence / paragraph end is cut at a space after this much
+
+# a paragraph break, or the whitespace after a sentence end
+_BOUNDARY = re.compile(r"\n\s*\n|(?<=[.!?])\s+")
+
+def _load_embedding_tokenizer():
+    # imported here: app.helper is also loaded by extraction worker processes
+    from app.services.shared.embeddings import load_tokenizer
+    return load_tokenizer()
+
+# the tokenizer the embedding model encodes with, so chunks fit its window exactly
+_embedding_tokens = TokenCounter("embedding model tokenizer", loader=_load_embedding_tokenizer)
+
+def _cut(text: str) -> Iterator[str]:
+    """ text over MAX_SEGMENT_CHARS in pieces, cut at the last space before the limit """
+    while len(text) > MAX_SEGMENT_CHARS:
+        cut = text.rfind(" ", 0, MAX_SEGMENT_CHARS)
+        cut = cut if cut > 0 else MAX_SEGMENT_CHARS
+        yield text[:cut]
+        text = text[cut:].lstrip()
+    if text:
+        yield text
+
+def _segments(pieces: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    - (separator, text) of every sentence / paragraph, in one scan of the text
+    - separator is what goes before it in a chunk: "\\n\\n" after a paragraph break, " " after a sentence
+    - only the unfinished sentence is kept between pieces
+    """
+    separator = ""
+    tail = ""
+    for piece in pieces:
+        buffer = tail + piece
+        start = 0
+        for match in _BOUNDARY.finditer(buffer):
+            if match.end() == len(buffer):
+                break    # the whitespace may go on in the next piece
+            for text in _cut(buffer[start:match.start()].strip()):
+                yield separator, text
+                separator = " "
+            if separator and match.group().count("\n") >= 2:
+                separator = "\n\n"
+            start = match.end()
+        tail = buffer[start:].lstrip()
+
+        # no boundary in sight, the part that would be cut anyway doesn't wait for one
+        if len(tail) > MAX_SEGMENT_CHARS:
+            *done, tail = _cut(tail)
+            for text in done:
+                yield separator, text
+                separator = " "
+
+    for text in _cut(tail.strip()):
+        yield separator, text
+        separator = " "
+
+def _split_long(separator: str, text: str, max_tokens: int, count_tokens) -> Iterator[Tuple[str, str, int]]:
+    """ a segment over max_tokens as word runs that fit, a single word that doesn't fit is sliced """
+    words = text.split()
+    run, run_tokens = [], 0
+    for word, tokens in zip(words, count_tokens(words)):
+        if run and (run_tokens + tokens > max_tokens or tokens > max_tokens):
+            yield separator, " ".join(run), run_tokens
+            separator, run, run_tokens = " ", [], 0
+        if tokens > max_tokens:
+            # a wordpiece token covers at least one character
+            slices = [word[i:i + max_tokens] for i in range(0, len(word), max_tokens)]
+            for i, (part, part_tokens) in enumerate(zip(slices, count_tokens(slices))):
+                yield (separator if i == 0 else ""), part, part_tokens
+            separator = " "
+            continue
+        run.append(word)
+        run_tokens += tokens
+    if run:
+        yield separator, " ".join(run), run_tokens
+
+def _counted_segments(segments: Iterator[Tuple[str, str]], max_tokens: int, count_tokens) -> Iterator[Tuple[str, str, int]]:
+    while batch := list(islice(segments, TOKEN_COUNT_BATCH)):
+        for (separator, text), tokens in zip(batch, count_tokens([text for _, text in batch])):
+            if tokens > max_tokens:
+                yield from _split_long(separator, text, max_tokens, count_tokens)
+            else:
+                yield separator, text, tokens
+
+def iter_chunks_token(
+        pieces: Iterable[str],
+        chunk_tokens: int = CHUNK_MAX_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        count_tokens: Optional[Callable[[List[str]], List[int]]] = None
+) -> Iterator[str]:
+    """
+    - chunks of whole sentences / paragraphs up to chunk_tokens tokens of the embedding tokenizer (capped at
+      CHUNK_MAX_TOKENS, the model cuts off the rest), the next chunk repeats the last ones up to overlap_tokens
+    - linear: every segment is tokenized once (TOKEN_COUNT_BATCH at a time) and enters & leaves the window once,
+      wordpiece counts add up over whitespace so a chunk's count is the sum of its segments'
+    - a sentence over the budget is split between words
+    - same chunks for "".join(pieces) as for the pieces
+    """
+    if count_tokens is None:
+        count_tokens = _embedding_tokens.count_batch
+        if _embedding_tokens.estimated:
+            print(f"⚠️ Token chunks are sized by a chars / 4 estimate, not the embedding tokenizer (pip install tokenizers), "
+                  f"chunks may be longer than the {CHUNK_MAX_TOKENS} tokens the model reads")
+    chunk_tokens = max(1, min(chunk_tokens, CHUNK_MAX_TOKENS))
+    overlap_tokens = max(0, min(overlap_tokens, chunk_tokens // 2))
+
+    window: deque = deque()    # (separator, text, tokens) of the chunk being filled
+    total = 0
+    for separator, text, tokens in _counted_segments(_segments(pieces), chunk_tokens, count_tokens):
+        if window and total + tokens > chunk_tokens:
+            yield _join(window)
+            # the overlap is the tail of the chunk that fits in overlap_tokens and leaves room for this segment
+            while window and (total > overlap_tokens or total + tokens > chunk_tokens):
+                total -= window.popleft()[2]
+        window.append((separator, text, tokens))
+        total += tokens
+
+    if window:
+        yield _join(window)
+
+def _join(window: deque) -> str:
+    parts = [window[0][1]]
+    for separator, text, _ in islice(window, 1, None):
+        parts.append(separator)
+        parts.append(text)
+    return "".join(parts)
+
+def chunk_token(
+        text: str,
+        chunk_tokens: int = CHUNK_MAX_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        count_tokens: Optional[Callable[[List[str]], List[int]]] = None
+) -> list[str]:
+    return list(iter_chunks_token([text], chunk_tokens, overlap_tokens, count_tokens))
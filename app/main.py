@@ -1,8 +1,20 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from app.routes import custom_rag, ingestion
-from app.db.database import engine, Base
-from app.db.models import Document, Chunk
+from app.db.database import engine, Base, AsyncSessionLocal
+from app.db.models import Document, Chunk, IngestionJob
+from app.services.shared.embeddings import batcher, cache, shutdown_embedding_workers
+from app.services.shared.vector_store import close_vector_store
+from app.db.migrations import add_missing_columns
+from app.services.shared.keyword_index import ensure_fts_index
+from app.services.rag.llm_services import get_llm_service, close_llm_service
+from app.services.rag.answer_cache import get_answer_cache
+from app.services.rag.session_store import get_session_store, close_session_store
+from app.services.rag.context_budget import get_token_counter
+from app.services.ingestion.jobs import start_ingestion_workers, stop_ingestion_workers
+from app.services.ingestion.extraction import shutdown_extraction_workers, cache_stats as extraction_cache_stats
+from app.services.ingestion.near_dup import ensure_band_index, stats as near_dup_stats
 from contextlib import asynccontextmanager
 
 # for auto creation of db table on startup
@@ -10,16 +22,44 @@ from contextlib import asynccontextmanager
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(ensure_fts_index)
+        await conn.run_sync(ensure_band_index)
 
     print("Database tables created.")
+    # the first query would otherwise download & parse the tokenizer on the event loop
+    await asyncio.to_thread(get_token_counter().load)
+    start_ingestion_workers()
     yield 
     print("🔻 Shutting down...")
+    # running jobs go back to the queue
+    await stop_ingestion_workers()
+    shutdown_embedding_workers()
+    shutdown_extraction_workers()
+    await close_vector_store()
+    await close_llm_service()
+    await close_session_store()
 
 app = FastAPI(title = 'Palm APIs', lifespan=lifespan)
 
 app.include_router(ingestion.router, prefix='/ingestion', tags=["Document Ingestion"])
 app.include_router(custom_rag.router, prefix='/rag', tags=["Custom RAG"])
 
+@app.get("/stats")
+async def stats():
+    """ Runtime metrics for tuning """
+    async with AsyncSessionLocal() as session:
+        near_dup = await near_dup_stats(session)
+    return {
+        "embeddings": batcher.stats(),
+        "embedding_cache": cache.stats() if cache else None,
+        "llm": get_llm_service().stats(),
+        "answer_cache": get_answer_cache().stats() if get_answer_cache() else None,
+        "session_store": get_session_store().stats(),
+        "extraction_cache": await asyncio.to_thread(extraction_cache_stats),
+        "near_dup": near_dup,
+    }
+
 @app.get("/", response_class=HTMLResponse)
 def root():
     html_content = """
@@ -1,7 +1,9 @@
+import json
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
-from app.services.rag.rag_pipeline import RAGPipeline
+from typing import List, Optional, Dict, Literal
+from app.services.rag.rag_pipeline import RAGPipeline, BATCH_MAX_QUERIES
 from app.services.rag.booking_service import BookingService
 from app.db.models import Booking
 from app.db.database import get_session
@@ -16,11 +18,13 @@ class QueryRequest(BaseModel):
     query: str = Field(..., description="User's Question")
     session_id: str = Field(..., description="Users unique identifier")
     top_k: int = Field(5, description="Top 5 relvant chunk")
+    retrieval_mode: Optional[Literal["dense", "hybrid"]] = Field(None, description="dense or hybrid (vector + keyword), default from RETRIEVAL_MODE env")
 
 class QueryRespond(BaseModel):
     answer: str
     sources: List[Dict]
     session_id: str
+    prompt_tokens: int = Field(0, description="Tokens sent to the LLM, 0 when answered from cache")
 
 @router.post('/query', response_model=QueryRespond)
 async def query_document(request: QueryRequest):
@@ -31,25 +35,89 @@ async def query_document(request: QueryRequest):
     """
 
     try:
-        answer, source = await rag_pipeline.query(
+        answer, source, prompt_tokens = await rag_pipeline.query(
             user_query= request.query,
             session_id= request.session_id,
-            top_k= request.top_k
+            top_k= request.top_k,
+            retrieval_mode= request.retrieval_mode
         )
 
         return QueryRespond(
             answer=answer,
             sources=source,
-            session_id=request.session_id
+            session_id=request.session_id,
+            prompt_tokens=prompt_tokens
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query Failed: {str(e)}")
     
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post('/query-stream')
+async def query_document_stream(request: QueryRequest):
+    """
+    Same as /query but streams Server-Sent Events:
+    - event: sources -> retrieved chunks, sent before the LLM starts
+    - event: token -> answer text as the LLM generates it
+    - event: done -> includes prompt_tokens
+    - event: error
+    """
+
+    async def event_stream():
+        try:
+            async for event, data in rag_pipeline.query_stream(
+                user_query= request.query,
+                session_id= request.session_id,
+                top_k= request.top_k,
+                retrieval_mode= request.retrieval_mode
+            ):
+                yield _sse(event, data)
+        except Exception as e:
+            print(f"Streaming error: {type(e).__name__}: {e}")
+            yield _sse("error", {"detail": f"Query Failed: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES, description="Questions, answered independently without chat history")
+    top_k: int = Field(5, description="Top 5 relvant chunk")
+    retrieval_mode: Optional[Literal["dense", "hybrid"]] = Field(None, description="dense or hybrid (vector + keyword), default from RETRIEVAL_MODE env")
+    concurrency: Optional[int] = Field(None, ge=1, description="LLM calls in flight, default from BATCH_LLM_CONCURRENCY env")
+
+@router.post('/query-batch')
+async def query_document_batch(request: BatchQueryRequest):
+    """
+    Many queries in one call, streamed back as NDJSON (one JSON object per line) as each answer completes:
+    - {"index", "query", "answer", "sources", "prompt_tokens"}
+    - {"index", "query", "error"} when a single query failed
+    - {"error"} when the whole batch failed
+    """
+
+    async def result_stream():
+        try:
+            async for result in rag_pipeline.query_batch(
+                user_queries= request.queries,
+                top_k= request.top_k,
+                retrieval_mode= request.retrieval_mode,
+                concurrency= request.concurrency
+            ):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"Batch query error: {type(e).__name__}: {e}")
+            yield json.dumps({"error": f"Batch Query Failed: {str(e)}"}) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @router.delete("/session/{session_id}")
 async def clear_session(session_id: str):
     """ Clear the chat history for a session. """
     try:
-        await rag_pipeline.redis_service.clear_session(session_id)
+        await rag_pipeline.session_store.clear_session(session_id)
         return {"message": f"Session {session_id} deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,12 +1,16 @@
 import os
+import json
 import uuid
+import shutil
+import asyncio
 from pathlib import Path
-from typing import Literal
-from PyPDF2 import PdfReader
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel, Field
 from fastapi.responses import JSONResponse
 from fastapi import APIRouter, UploadFile, File, HTTPException, status
+from app.services.ingestion.extraction import extract_text as extract_file_text
+from app.services.ingestion.extractors import supported_suffixes
 
 router = APIRouter()
 
@@ -14,7 +18,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOADED_DIR = BASE_DIR / "uploads"
 UPLOADED_DIR.mkdir(parents=True, exist_ok=True)
 
-allowed_file_ext = {'.pdf', '.txt'}
+allowed_file_ext = supported_suffixes()    # every installed extractor, see services/ingestion/extractors.py
 max_file_size = 25 * 1024 * 1024    # 25MB
 
 def _is_allowed(filename: str) -> bool:
@@ -26,10 +30,11 @@ class UploadResponse(BaseModel):
     content_type: str
     byte_size: int
 
-async def _save_uploaded_file(uploaded_file: UploadFile, destination: Path) -> int:
+async def _save_uploaded_file(uploaded_file: UploadFile, destination: Path, max_size: int = max_file_size) -> int:
     """
     - to save the uploaded file in small chunks
     - reading in small chunks helps to avoid memory crash
+    - stops once max_size is passed, caller checks the returned size
     """
     with destination.open('wb') as buffer:
         size = 0
@@ -39,7 +44,7 @@ async def _save_uploaded_file(uploaded_file: UploadFile, destination: Path) -> i
                 break
             buffer.write(chunk)
             size += len(chunk)
-            if size > max_file_size:
+            if size > max_size:
                 break
     
     return size
@@ -109,20 +114,15 @@ async def extract_text(saved_filename: str):
             content= {'error': 'File not found at {file_path}.'}
         )
     
-    suffix = file_path.suffix.lower()
+    if not _is_allowed(file_path.name):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content= {'error': "Unsupported file type."}
+        )
 
     try:
-        if suffix == '.txt':
-            text = file_path.read_text(encoding='utf-8')
-        elif suffix == '.pdf':
-            reader = PdfReader(str(file_path))
-            text = "\n".join([page.extract_text() or '' for page in reader.pages])
-        else:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content= {'error': "Unsupported file type."}
-            )
-        
+        text = await extract_file_text(file_path)
+
         preview = text[:EXTRACT_MAX_PREVIEW]
         return {
             "saved_filename": saved_filename,
@@ -137,11 +137,11 @@ async def extract_text(saved_filename: str):
         )
     
 # Chunking
-from app.helper import chunk_fixed, chunk_semantic
+from app.helper import chunk_fixed, chunk_semantic, chunk_token
 
 class ChunkRequest(BaseModel):
     saved_filename: str = Field(..., description= "Filename returned from upload"),
-    chunk_strat: Literal["fixed", "semantic"] = Field("fixed", description= "Chunking Strategy"),
+    chunk_strat: Literal["fixed", "semantic", "token"] = Field("fixed", description= "Chunking Strategy, token: chunk_size is in embedding model tokens"),
     chunk_size: int = Field(500, description="Chunk Size"),
 
 @router.post('/chunks')
@@ -153,18 +153,14 @@ async def chunk_document(request: ChunkRequest):
             detail= f"File not found: {request.saved_filename}"
         )
     
-    suffix = file_path.suffix.lower()
+    if not _is_allowed(file_path.name):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content= {'error': "Unsupported file type."}
+        )
+
     try:
-        if suffix == '.txt':
-            text = file_path.read_text(encoding='utf-8')
-        elif suffix == '.pdf':
-            reader = PdfReader(str(file_path))
-            text = "\n".join([page.extract_text() or '' for page in reader.pages])
-        else:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content= {'error': "Unsupported file type."}
-            )
+        text = await extract_file_text(file_path)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -172,6 +168,8 @@ async def chunk_document(request: ChunkRequest):
     
     if request.chunk_strat == "fixed":
         chunks = chunk_fixed(text, chunk_size= request.chunk_size)
+    elif request.chunk_strat == "token":
+        chunks = await asyncio.to_thread(chunk_token, text, request.chunk_size)
     else:
         chunks = chunk_semantic(text, chunk_size= request.chunk_size)
 
@@ -183,33 +181,103 @@ async def chunk_document(request: ChunkRequest):
         "chunks": chunks,
     }
 
-from app.services.ingestion.ingestion_services import ingestion_pipeline
+from fastapi.responses import StreamingResponse
+from app.services.ingestion.ingestion_services import ingestion_pipeline, ingestion_pipeline_streaming, UPLOADED_DIR as INGEST_DIR
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.database import get_session
+from app.db.database import get_session, AsyncSessionLocal
 from fastapi import Depends
 
+# streaming ingestion keeps memory flat, so it takes much larger files
+max_stream_file_size = int(os.getenv("INGEST_STREAM_MAX_FILE_SIZE", 500 * 1024 * 1024))    # 500MB
+
+async def _save_for_streaming(file: UploadFile) -> Path:
+    """ upload straight to disk in 1MB pieces, never held in memory as a whole """
+    saved_path = INGEST_DIR / f"{uuid.uuid4().hex}{Path(file.filename).suffix.lower()}"
+    size = await _save_uploaded_file(file, saved_path, max_size=max_stream_file_size)
+    if size > max_stream_file_size:
+        saved_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f'File too large. Max: {max_stream_file_size} bytes'
+        )
+    return saved_path
+
 class IngestionResponse(BaseModel):
     document_id: int
     filename: str
     total_chunks: int
     message: str
+    status: str = "created"    # created / duplicate (already ingested, nothing done) / updated (new version, changed chunks only)
+    embedded_chunks: int = 0
+    removed_chunks: int = 0
+    near_duplicate_chunks: int = 0    # NEAR_DUP_ENABLED: stored without a vector, sharing a nearly identical chunk's
+
+INGESTION_MESSAGES = {
+    "created": "Document ingested successfully",
+    "duplicate": "Document already ingested, nothing to do",
+    "updated": "Document updated, only changed chunks were embedded",
+}
+
+def _ingestion_response(doc_id: int, filename: str, total_chunks: int, stats: dict) -> IngestionResponse:
+    return IngestionResponse(
+        document_id=doc_id,
+        filename=filename,
+        total_chunks=total_chunks,
+        message=INGESTION_MESSAGES[stats["status"]],
+        status=stats["status"],
+        embedded_chunks=stats["embedded"],
+        removed_chunks=stats["removed"],
+        near_duplicate_chunks=stats["near_duplicates"]
+    )
 
 @router.post("/ingest", response_model= IngestionResponse, status_code=status.HTTP_201_CREATED)
 async def ingest_document(
     file: UploadFile = File(...),
     chunk_strategy: str = "fixed",
     chunk_size: int = 500,
+    mode: Literal["buffered", "streaming"] = "buffered",
+    replace: bool = False,
     session: AsyncSession = Depends(get_session)
 ):
     """
     Complete document ingestion pipeline:
     Upload → Extract → Chunk → Embed → Store in Qdrant → Save to DB
+    - buffered: whole file in memory, everything is written at the end
+    - streaming: page by page in batches, flat memory, for large files (up to INGEST_STREAM_MAX_FILE_SIZE)
+    - a file already ingested is skipped (status duplicate)
+    - replace=true: the latest document with the same filename is updated in place, re-embedding only
+      changed chunks (status updated); without it the upload is always a new document
     """
     if not _is_allowed(file.filename):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Unsupported file extension. Allowed: {', '.join(allowed_file_ext)}"
         )
+
+    stats = {}
+    if mode == "streaming":
+        saved_path = await _save_for_streaming(file)
+        try:
+            doc_id, filename, total_chunks = await ingestion_pipeline_streaming(
+                file_path=saved_path,
+                filename=file.filename,
+                chunk_strategy=chunk_strategy,
+                chunk_size=chunk_size,
+                session=session,
+                stats=stats,
+                replace=replace
+            )
+        except ValueError as e:
+            saved_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            saved_path.unlink(missing_ok=True)
+            print(f"Exception: {type(e).__name__}: {e}")
+            raise HTTPException(status_code=500, detail=f"Ingestion failed: {str(e)}")
+
+        if stats["status"] == "duplicate":
+            saved_path.unlink(missing_ok=True)
+        return _ingestion_response(doc_id, filename, total_chunks, stats)
     
     content = await file.read()
     if len(content) > max_file_size:
@@ -224,15 +292,12 @@ async def ingest_document(
             filename=file.filename,
             chunk_strategy=chunk_strategy,
             chunk_size=chunk_size,
-            session=session
+            session=session,
+            stats=stats,
+            replace=replace
         )
         
-        return IngestionResponse(
-            document_id=doc_id,
-            filename=filename,
-            total_chunks=total_chunks,
-            message="Document ingested successfully"
-        )
+        return _ingestion_response(doc_id, filename, total_chunks, stats)
         
     except ValueError as e:
         print(f"ValueError: {e}") 
@@ -241,4 +306,185 @@ async def ingest_document(
         print(f"Exception: {type(e).__name__}: {e}")  
         import traceback
         traceback.print_exc() 
-        raise HTTPException(status_code=500, detail=f"Ingestion failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Ingestion failed: {str(e)}")
+
+# ingestions keep running when the progress stream's client goes away
+_background_ingestions = set()
+# progress events waiting for a slow client, older ones are dropped, a later event has the newer counts
+PROGRESS_QUEUE_SIZE = 64
+
+@router.post("/ingest-stream")
+async def ingest_document_stream(
+    file: UploadFile = File(...),
+    chunk_strategy: str = "fixed",
+    chunk_size: int = 500,
+    replace: bool = False
+):
+    """
+    Streaming ingestion that reports progress as NDJSON, one line per stored batch:
+    - {"event": "progress", "doc_id", "pages_done", "total_pages", "chunks_done", "batches_done"}
+    - {"event": "done", "document_id", "filename", "total_chunks", "status"} or {"event": "error", "detail"}
+    """
+    if not _is_allowed(file.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported file extension. Allowed: {', '.join(allowed_file_ext)}"
+        )
+
+    saved_path = await _save_for_streaming(file)
+    filename = file.filename
+    events: asyncio.Queue = asyncio.Queue(maxsize=PROGRESS_QUEUE_SIZE)
+    listening = [True]    # False once the client is gone, nothing is queued any more
+
+    def publish(event: dict):
+        if not listening[0]:
+            return
+        if events.full():
+            events.get_nowait()    # the oldest one, always a progress event
+        events.put_nowait(event)
+
+    async def run():
+        stats = {}
+        async def on_progress(progress: dict):
+            publish({"event": "progress", **progress})
+        try:
+            # own session, request dependencies are closed before a streamed body is sent
+            async with AsyncSessionLocal() as session:
+                doc_id, _, total_chunks = await ingestion_pipeline_streaming(
+                    file_path=saved_path,
+                    filename=filename,
+                    chunk_strategy=chunk_strategy,
+                    chunk_size=chunk_size,
+                    session=session,
+                    on_progress=on_progress,
+                    stats=stats,
+                    replace=replace
+                )
+            if stats["status"] == "duplicate":
+                saved_path.unlink(missing_ok=True)
+            publish({
+                "event": "done", "document_id": doc_id, "filename": filename, "total_chunks": total_chunks, "status": stats["status"]
+            })
+        except Exception as e:
+            saved_path.unlink(missing_ok=True)
+            print(f"Streaming ingestion error: {type(e).__name__}: {e}")
+            publish({"event": "error", "detail": f"Ingestion failed: {str(e)}"})
+
+    task = asyncio.create_task(run())
+    _background_ingestions.add(task)
+    task.add_done_callback(_background_ingestions.discard)
+
+    async def event_stream():
+        try:
+            while True:
+                event = await events.get()
+                yield json.dumps(event) + "\n"
+                if event["event"] in ("done", "error"):
+                    break
+        finally:
+            listening[0] = False
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+# Background jobs
+from app.services.ingestion.jobs import enqueue_job, get_job, list_jobs, job_to_dict
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_ingestion_job(
+    file: UploadFile = File(...),
+    chunk_strategy: Literal["fixed", "semantic", "token"] = "fixed",
+    chunk_size: int = 500,
+    replace: bool = False
+):
+    """
+    Queue a document for background ingestion, returns 202 with the job id right after the upload is saved
+    Poll /ingestion/jobs/{job_id} for stage, progress & timing
+    replace=true updates the latest document with the same filename in place, like /ingest
+    """
+    if not _is_allowed(file.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported file extension. Allowed: {', '.join(allowed_file_ext)}"
+        )
+
+    saved_path = await _save_for_streaming(file)
+    try:
+        job = await enqueue_job(saved_path, file.filename, chunk_strategy, chunk_size, replace)
+    except Exception as e:
+        saved_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Failed to queue ingestion: {str(e)}")
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/ingestion/jobs/{job.id}"
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """ stage, progress & timing of one ingestion job """
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_to_dict(job)
+
+@router.get("/jobs")
+async def list_ingestion_jobs(job_status: Optional[Literal["queued", "running", "done", "failed"]] = None, limit: int = 50):
+    """ most recent jobs first """
+    return [job_to_dict(job) for job in await list_jobs(job_status, limit)]
+
+# Bulk ingestion
+from app.services.ingestion.bulk import bulk_ingest, unpack_archive, is_archive
+
+@router.post("/ingest-bulk", status_code=status.HTTP_201_CREATED)
+async def ingest_documents_bulk(
+    files: List[UploadFile] = File(...),
+    chunk_strategy: Literal["fixed", "semantic", "token"] = "fixed",
+    chunk_size: int = 500,
+    replace: bool = False,
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Ingest many documents in one call: several files, zip / tar archives of them, or both
+    - extraction runs in a process pool, chunks of all documents are embedded & stored in shared batches
+    - unsupported files inside archives are skipped, files that fail are listed under "failed"
+    - returns the run report with docs_per_min; for very large corpora use `python bulk_ingest.py <dir>`
+    """
+    for file in files:
+        if not (_is_allowed(file.filename) or is_archive(file.filename)):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported file: {file.filename}. Allowed: {', '.join(allowed_file_ext)} or zip / tar archives"
+            )
+
+    bulk_dir = INGEST_DIR / f"bulk_{uuid.uuid4().hex}"
+    bulk_dir.mkdir(parents=True)
+    try:
+        documents = []
+        for file in files:
+            saved_path = await _save_for_streaming(file)
+            if is_archive(file.filename):
+                try:
+                    documents.extend(await asyncio.to_thread(unpack_archive, saved_path, bulk_dir, max_stream_file_size))
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"Could not read archive {file.filename}: {e}")
+                finally:
+                    saved_path.unlink(missing_ok=True)
+            else:
+                documents.append((saved_path.rename(bulk_dir / saved_path.name), file.filename))
+
+        if not documents:
+            raise HTTPException(status_code=400, detail="No supported documents in the upload")
+
+        return await bulk_ingest(documents, chunk_strategy, chunk_size, session, replace=replace)
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Bulk ingestion error: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=500, detail=f"Bulk ingestion failed: {str(e)}")
+    finally:
+        # the text is in the db now, the bulk upload itself isn't kept
+        shutil.rmtree(bulk_dir, ignore_errors=True)
@@ -0,0 +1,284 @@
+"""
+Bulk ingestion of many documents at once (multi-file upload, zip / tar archive or a directory).
+
+- text extraction & chunking run in a process pool, one file per task, so pdf parsing uses every core
+- chunks of all documents share one buffer, embedded / upserted / inserted BULK_EMBED_BATCH_SIZE at a time,
+  one ensure_collection for the whole run and one commit per batch instead of two per document
+- a document is searchable once its last batch is committed, a failed file is reported and skipped
+- with INGEST_DEDUP files already ingested (or repeated in the run) are reported as duplicates and skipped
+- with replace a new version of a stored file updates that document in place (DocumentUpdate), only new text
+  is embedded; without it every file is a document of its own
+- with NEAR_DUP_ENABLED boilerplate chunks repeated across the corpus are embedded & indexed once
+"""
+
+import os
+import time
+import asyncio
+import tarfile
+import zipfile
+import shutil
+import multiprocessing
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Optional
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from app.db.models import Document
+from app.services.shared.vector_store import get_vector_store
+from app.services.ingestion.extraction import extract_chunks, file_sha256
+from app.services.ingestion.extractors import supported_suffixes
+from app.services.ingestion.ingestion_services import (
+    COLLECTION_NAME, VECTOR_SIZE, INGEST_DEDUP,
+    chunk_hash, document_hash, content_vector_ids, find_duplicate, previous_version, invalidate_answers,
+    _store_chunks, _discard_document, DocumentUpdate
+)
+
+load_dotenv()
+
+BULK_EXTRACT_WORKERS = int(os.getenv("BULK_EXTRACT_WORKERS", 0))    # 0 = cpu count
+BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", 512))    # chunks per embed / upsert / insert batch
+
+SUPPORTED_SUFFIXES = supported_suffixes()
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+def _is_supported(filename: str) -> bool:
+    return Path(filename).suffix.lower() in SUPPORTED_SUFFIXES
+
+def unpack_archive(archive_path: Path, destination: Path, max_member_size: int) -> List[Tuple[Path, str]]:
+    """
+    - supported files of a zip / tar archive, as (path on disk, name inside the archive)
+    - members are written under generated names, so paths like ../../x can't escape destination
+    - other files, links & members over max_member_size are skipped
+    """
+    files = []
+
+    def _copy(source, name: str):
+        target = destination / f"{len(files):05d}{Path(name).suffix.lower()}"
+        with target.open('wb') as out:
+            shutil.copyfileobj(source, out, 1024 * 1024)
+        files.append((target, name))
+
+    if archive_path.name.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not _is_supported(member.filename) or member.file_size > max_member_size:
+                    continue
+                with archive.open(member) as source:
+                    _copy(source, member.filename)
+    else:
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                if not member.isfile() or not _is_supported(member.name) or member.size > max_member_size:
+                    continue
+                with archive.extractfile(member) as source:
+                    _copy(source, member.name)
+
+    print(f"📦 Unpacked {len(files)} documents from {archive_path.name}")
+    return files
+
+def collect_directory(directory: Path) -> List[Tuple[Path, str]]:
+    """ supported files under a directory (recursive), named by their path relative to it """
+    return [
+        (path, str(path.relative_to(directory)))
+        for path in sorted(directory.rglob('*'))
+        if path.is_file() and _is_supported(path.name)
+    ]
+
+async def bulk_ingest(
+        files: List[Tuple[Path, str]],
+        chunk_strategy: str,
+        chunk_size: int,
+        session: AsyncSession,
+        workers: int = BULK_EXTRACT_WORKERS,
+        batch_size: int = BULK_EMBED_BATCH_SIZE,
+        replace: bool = False
+)   -> dict:
+    """
+    - files: (path on disk, filename to store) pairs
+    - Returns a report: ingested documents, duplicates, failed files, chunk count, elapsed time & docs/min
+    """
+    if chunk_strategy not in ("fixed", "semantic", "token"):
+        raise ValueError(f"Unknown chunking strategy: {chunk_strategy}")
+
+    start_time = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(files)))
+    await get_vector_store().ensure_collection(COLLECTION_NAME, VECTOR_SIZE)
+
+    buffer: List[Tuple[int, int, str]] = []    # (doc_id, chunk_index, text) waiting for the next batch
+    documents: Dict[int, dict] = {}            # doc_id -> filename, total_chunks, content_hash, to_store, stored, vector_ids, seen, update
+    ingested: List[dict] = []
+    duplicates: List[dict] = []
+    failed: List[dict] = []
+    run_hashes: Dict[str, int] = {}            # content_hash -> doc_id of documents in this run
+    near_duplicates = [0]                      # chunks stored without a vector of their own
+
+    async def store_batch(size: int):
+        batch = buffer[:size]
+        del buffer[:size]
+
+        hashes = [chunk_hash(text) for _, _, text in batch]
+        vector_ids = []
+        for (doc_id, _, _), h in zip(batch, hashes):
+            doc = documents[doc_id]
+            if doc["update"] is not None:
+                vector_ids.extend(doc["update"].vector_ids([h]))
+            else:
+                vector_ids.extend(content_vector_ids(doc_id, [h], doc["seen"]))
+                doc["vector_ids"].append(vector_ids[-1])
+
+        # one embed, upsert & executemany for chunks of every document in the batch
+        written = await _store_chunks(session, batch, hashes, vector_ids)
+        near_duplicates[0] += len(batch) - len(written)
+
+        in_batch = Counter(doc_id for doc_id, _, _ in batch)
+        completed = [
+            doc_id for doc_id, n in in_batch.items()
+            if documents[doc_id]["stored"] + n == documents[doc_id]["to_store"]
+        ]
+        await complete(completed)
+        for doc_id, n in in_batch.items():
+            documents[doc_id]["stored"] += n
+        print(f"  📦 bulk: {len(batch)} chunks stored, {len(ingested)}/{len(files)} documents done")
+
+    async def complete(doc_ids: List[int]):
+        """ commits the current batch with the last changes of documents whose chunks are all in it """
+        for doc_id in doc_ids:
+            doc = documents[doc_id]
+            if doc["update"] is not None:
+                doc["removed"] = await doc["update"].finish(session, doc["total_chunks"], doc["content_hash"])
+            else:
+                # only once complete, a partial document is never a duplicate
+                await session.execute(
+                    update(Document).where(Document.id == doc_id).values(content_hash=doc["content_hash"])
+                )
+        await session.commit()
+
+        for doc_id in doc_ids:
+            doc = documents[doc_id]
+            doc["done"] = True
+            result = {"document_id": doc_id, "filename": doc["filename"], "total_chunks": doc["total_chunks"], "status": "created"}
+            if doc["update"] is not None:
+                await doc["update"].delete_unused()
+                result.update(status="updated", reused=doc["update"].reused, removed=doc["removed"])
+            ingested.append(result)
+
+    async def add_document(path: Path, filename: str, chunks: List[str]):
+        if not chunks:
+            failed.append({"filename": filename, "error": "No Chunks were generated from the document."})
+            return
+
+        content_hash = document_hash(await asyncio.to_thread(file_sha256, path), chunk_strategy, chunk_size)
+        if INGEST_DEDUP:
+            existing_id = run_hashes.get(content_hash)
+            if existing_id is None:
+                existing = await find_duplicate(session, content_hash)
+                existing_id = existing.id if existing is not None else None
+            if existing_id is not None:
+                duplicates.append({"filename": filename, "document_id": existing_id})
+                return
+
+        previous = await previous_version(session, filename) if replace else None
+        if previous is not None and previous.id in documents:
+            previous = None    # the same filename twice in one run, the second is a document of its own
+        if previous is not None:
+            doc_update = await DocumentUpdate.load(session, previous)
+            doc_id = previous.id
+            new = doc_update.match(0, [chunk_hash(chunk) for chunk in chunks])
+        else:
+            doc_update = None
+            doc = Document(filename=filename, total_chunks=len(chunks))
+            session.add(doc)
+            await session.flush()    # id now, committed with the batch that holds its first chunks
+            doc_id = doc.id
+            new = range(len(chunks))
+
+        run_hashes[content_hash] = doc_id
+        documents[doc_id] = {
+            "filename": filename, "total_chunks": len(chunks), "content_hash": content_hash,
+            "to_store": len(new), "stored": 0, "vector_ids": [], "seen": {}, "update": doc_update, "done": False
+        }
+        if not new:
+            # only moved / removed chunks, nothing to embed
+            await complete([doc_id])
+        buffer.extend((doc_id, i, chunks[i]) for i in new)
+
+        while len(buffer) >= batch_size:
+            await store_batch(batch_size)
+
+    # spawn so workers don't inherit the event loop, db engine & model from this process
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    pending: Dict[asyncio.Future, Tuple[Path, str]] = {}
+    queued = iter(files)
+    max_pending = workers * 2    # finished files wait here while batches are stored, this bounds memory
+
+    def submit():
+        while len(pending) < max_pending:
+            item = next(queued, None)
+            if item is None:
+                return
+            path, filename = item
+            pending[loop.run_in_executor(executor, extract_chunks, str(path), chunk_strategy, chunk_size)] = (path, filename)
+
+    print(f"🚚 Bulk ingestion of {len(files)} files, {workers} extraction workers, batches of {batch_size} chunks")
+    try:
+        submit()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                path, filename = pending.pop(future)
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    print(f"❌ bulk: {filename}: {type(e).__name__}: {e}")
+                    failed.append({"filename": filename, "error": f"{type(e).__name__}: {e}"})
+                    continue
+                await add_document(path, filename, chunks)
+            submit()
+
+        if buffer:
+            await store_batch(len(buffer))
+
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        # documents already complete stay, partly written ones are removed, partly updated ones left as they were
+        for doc_id, doc in documents.items():
+            if doc["done"]:
+                continue
+            if doc["update"] is not None:
+                await doc["update"].undo(session)
+            else:
+                await _discard_document(session, doc_id, doc["vector_ids"])
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    await invalidate_answers(session, [doc["filename"] for doc in ingested])
+
+    elapsed = time.perf_counter() - start_time
+    total_chunks = sum(doc["total_chunks"] for doc in ingested)
+    report = {
+        "documents": len(ingested),
+        "updated": sum(doc["status"] == "updated" for doc in ingested),
+        "duplicates": duplicates,
+        "failed": failed,
+        "total_chunks": total_chunks,
+        "near_duplicate_chunks": near_duplicates[0],
+        "elapsed_s": round(elapsed, 3),
+        "docs_per_min": round(len(ingested) / elapsed * 60, 1) if elapsed else 0,
+        "chunks_per_s": round(total_chunks / elapsed, 1) if elapsed else 0,
+        "results": ingested,
+    }
+    print(
+        f"✅ Bulk ingestion: {len(ingested)} documents ({len(duplicates)} duplicates, {len(failed)} failed), {total_chunks} chunks "
+        f"in {elapsed:.1f}s → {report['docs_per_min']} docs/min"
+    )
+    return report
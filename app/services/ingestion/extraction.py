@@ -0,0 +1,286 @@
+"""
+Text extraction & chunking of files on disk, with the backend picked by extractors.get_extractor.
+
+- extracted pdf pages are cached on disk as jsonl (one json string per page), keyed by the sha256
+  of the file & the backend, so extracting / chunking / ingesting the same file again skips the parsing
+- large pdfs not in the cache are split into page ranges parsed in parallel by a process pool
+- the sync functions hold no app state (db, vector store, model), so they run as well in a
+  thread as in a spawned worker process; the async ones never parse on the event loop
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+from dotenv import load_dotenv
+
+from app.helper import iter_chunks_fixed, iter_chunks_semantic, iter_chunks_token
+from app.services.ingestion.extractors import Extractor, get_extractor, get_backend
+
+load_dotenv()
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_DIR = Path(os.getenv("EXTRACTION_CACHE_DIR", "extraction_cache"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", 1024 * 1024 * 1024))    # 1GB
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", 0))    # page range processes, 0 = cpu count
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", 16))
+EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv("EXTRACT_PARALLEL_MIN_PAGES", 32))    # smaller pdfs are parsed in a thread
+HASH_READ_SIZE = 1024 * 1024
+
+# Extraction cache
+
+def file_sha256(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with file_path.open('rb') as f:
+        while block := f.read(HASH_READ_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_key(file_path: Path, extractor: Extractor) -> str:
+    # backends extract slightly different text, each has its own entry
+    return f"{file_sha256(file_path)}.{extractor.name}"
+
+def _cache_path(digest: str) -> Path:
+    return EXTRACTION_CACHE_DIR / f"{digest}.jsonl"
+
+def _cached_pages(digest: str) -> Optional[Iterator[str]]:
+    """ pages of a cached file one at a time, None on a miss """
+    path = _cache_path(digest)
+    try:
+        f = path.open('r', encoding='utf-8')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)    # mtime is the last use, the oldest entries are pruned first
+    except OSError:
+        pass    # pruned by another process meanwhile, the open file still reads fine
+
+    def pages():
+        with f:
+            for line in f:
+                yield json.loads(line)
+    return pages()
+
+def _read_cached(digest: str) -> Optional[List[str]]:
+    pages = _cached_pages(digest)
+    return list(pages) if pages is not None else None
+
+def _cache_warning(e: OSError):
+    print(f"⚠️ extraction cache: {e}, continuing without it")
+
+class _CacheWriter:
+    """
+    - pages are written to a temp file as they come, it only becomes the cache entry once complete
+    - a failing cache (full disk, permissions) only loses the entry, the extraction goes on
+    """
+    def __init__(self, digest: str):
+        self.path = _cache_path(digest)
+        self.tmp_path = EXTRACTION_CACHE_DIR / f".{digest}.{uuid.uuid4().hex}.tmp"
+        self.f = None
+        try:
+            EXTRACTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            self.f = self.tmp_path.open('w', encoding='utf-8')
+        except OSError as e:
+            _cache_warning(e)
+
+    def write(self, page: str):
+        if self.f is None:
+            return
+        try:
+            self.f.write(json.dumps(page) + "\n")
+        except OSError as e:
+            _cache_warning(e)
+            self.abort()
+
+    def commit(self):
+        if self.f is None:
+            return
+        try:
+            self.f.close()
+            self.f = None
+            # atomic, concurrent writers of the same file just replace each other's identical entry
+            os.replace(self.tmp_path, self.path)
+        except OSError as e:
+            _cache_warning(e)
+            self.abort()
+            return
+        _prune_cache()
+
+    def abort(self):
+        try:
+            if self.f is not None:
+                self.f.close()
+            self.tmp_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+        self.f = None
+
+def _cache_entries() -> list:
+    """ (stat, path) of every entry, skipping the ones another process removes meanwhile """
+    entries = []
+    for path in EXTRACTION_CACHE_DIR.glob("*.jsonl"):
+        try:
+            entries.append((path.stat(), path))
+        except FileNotFoundError:
+            continue
+    return entries
+
+def _prune_cache():
+    try:
+        entries = _cache_entries()
+        total = sum(stat.st_size for stat, _ in entries)
+        for stat, path in sorted(entries, key=lambda e: e[0].st_mtime):
+            if total <= EXTRACTION_CACHE_MAX_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+    except OSError as e:
+        _cache_warning(e)
+
+def _store_pages(digest: str, pages: List[str]):
+    writer = _CacheWriter(digest)
+    try:
+        for page in pages:
+            writer.write(page)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit()
+
+def cache_stats() -> dict:
+    entries = _cache_entries()
+    return {
+        "enabled": EXTRACTION_CACHE_ENABLED,
+        "entries": len(entries),
+        "bytes": sum(stat.st_size for stat, _ in entries),
+        "max_bytes": EXTRACTION_CACHE_MAX_BYTES,
+    }
+
+# Paged (pdf) parsing
+
+def _extract_page_range(file_path: str, backend: str, start: int, end: int) -> List[str]:
+    """ text of pages [start, end), the unit of work of the page range process pool """
+    return list(get_backend(backend).iter_pages(Path(file_path), start, end))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def _extract_workers() -> int:
+    return EXTRACT_WORKERS or os.cpu_count() or 1
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn so workers don't inherit the event loop, db engine & model from the api process
+        _process_pool = ProcessPoolExecutor(
+            max_workers=_extract_workers(),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+def shutdown_extraction_workers():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+async def _parse_pages(file_path: Path, extractor: Extractor) -> List[str]:
+    total_pages = await asyncio.to_thread(extractor.page_count, file_path)
+    if total_pages < EXTRACT_PARALLEL_MIN_PAGES or _extract_workers() <= 1:
+        return await asyncio.to_thread(_extract_page_range, str(file_path), extractor.name, 0, total_pages)
+
+    # every task opens the file itself, only (path, range) and the page texts cross the process boundary
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    ranges = [(start, min(start + EXTRACT_PAGES_PER_TASK, total_pages)) for start in range(0, total_pages, EXTRACT_PAGES_PER_TASK)]
+    parts = await asyncio.gather(*[
+        loop.run_in_executor(pool, _extract_page_range, str(file_path), extractor.name, start, end) for start, end in ranges
+    ])
+    print(f"📄 Parsed {total_pages} pages of {file_path.name} in {len(ranges)} ranges with {extractor.name}")
+    return [page for part in parts for page in part]
+
+async def extract_pages(file_path: Path, extractor: Extractor) -> List[str]:
+    """ text of every page of a paged file, from the cache or parsed in parallel & cached """
+    if not EXTRACTION_CACHE_ENABLED:
+        return await _parse_pages(file_path, extractor)
+
+    digest = await asyncio.to_thread(_cache_key, file_path, extractor)
+    cached = await asyncio.to_thread(_read_cached, digest)
+    if cached is not None:
+        return cached
+
+    pages = await _parse_pages(file_path, extractor)
+    await asyncio.to_thread(_store_pages, digest, pages)
+    return pages
+
+async def extract_text(file_path: Path) -> str:
+    """
+    Extract text from any supported file
+    """
+    extractor = get_extractor(file_path)
+    if extractor.paged:
+        return "\n".join(await extract_pages(file_path, extractor))
+    return await asyncio.to_thread(lambda: "".join(extractor.iter_pieces(file_path)))
+
+# Streaming
+
+def _iter_pages(file_path: Path, extractor: Extractor, progress: dict) -> Iterator[str]:
+    progress["total_pages"] = extractor.page_count(file_path)
+    yield from extractor.iter_pages(file_path)
+
+def _iter_pages_cached(file_path: Path, extractor: Extractor, progress: dict) -> Iterator[str]:
+    """ pages from the cache, or parsed one at a time & written to the cache on the way """
+    digest = _cache_key(file_path, extractor)
+    cached = _cached_pages(digest)
+    if cached is not None:
+        yield from cached
+        return
+
+    writer = _CacheWriter(digest)
+    try:
+        for page in _iter_pages(file_path, extractor, progress):
+            writer.write(page)
+            yield page
+    except BaseException:
+        # also when the consumer stops early, a partial entry must never be cached
+        writer.abort()
+        raise
+    writer.commit()
+
+def iter_text_pieces(file_path: Path, progress: dict) -> Iterator[str]:
+    """
+    - text of a pdf page by page (or other files in pieces) without loading the whole file
+    - pieces joined give the same text as extract_text
+    - progress gets total_pages / pages_done as it goes (total_pages stays None on a cache hit)
+    """
+    extractor = get_extractor(file_path)
+    if not extractor.paged:
+        yield from extractor.iter_pieces(file_path)
+        return
+
+    if EXTRACTION_CACHE_ENABLED:
+        pages = _iter_pages_cached(file_path, extractor, progress)
+    else:
+        pages = _iter_pages(file_path, extractor, progress)
+    for i, page in enumerate(pages):
+        yield ("\n" if i else "") + page
+        progress["pages_done"] = i + 1
+
+def iter_chunks(file_path: Path, strategy: str, chunk_size: int, progress: dict) -> Iterator[str]:
+    pieces = iter_text_pieces(file_path, progress)
+    if strategy == "fixed":
+        return iter_chunks_fixed(pieces, chunk_size=chunk_size)
+    elif strategy == "semantic":
+        return iter_chunks_semantic(pieces, chunk_size=chunk_size)
+    elif strategy == "token":
+        return iter_chunks_token(pieces, chunk_tokens=chunk_size)
+    else:
+        raise ValueError(f"Unknown chunking strategy: {strategy}")
+
+def extract_chunks(file_path: str, strategy: str, chunk_size: int) -> List[str]:
+    """ all chunks of one file, the unit of work of the bulk ingestion process pool """
+    return list(iter_chunks(Path(file_path), strategy, chunk_size, {}))
@@ -0,0 +1,247 @@
+"""
+Text extraction backends, picked by file type and configuration.
+
+- pdf: pypdf2 (default, always installed), pypdfium2 & pymupdf (optional, much faster, C libraries)
+  PDF_EXTRACTOR=pypdf2 / pypdfium2 / pymupdf / auto (fastest installed), compare them with bench_extractors.py
+- txt & md as they are, html (stdlib parser, scripts & styles dropped), docx (document xml straight from the zip)
+- paged backends give pages, joined with "\\n" into the text, so page ranges can be parsed in parallel & cached;
+  the others give pieces of the text, joined as they are
+- optional libraries are imported on first use, a backend that isn't installed is just unavailable
+"""
+
+import os
+import re
+import zipfile
+import threading
+import importlib.util
+from pathlib import Path
+from html.parser import HTMLParser
+from xml.etree.ElementTree import iterparse
+from typing import Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PDF_EXTRACTOR = os.getenv("PDF_EXTRACTOR", "pypdf2")    # pypdf2 / pypdfium2 / pymupdf / auto
+TEXT_READ_SIZE = 64 * 1024    # characters per piece of a .txt / .md file
+
+class Extractor:
+    name: str = ""
+    suffixes: tuple = ()
+    paged: bool = False
+    requires: Optional[str] = None    # module of an optional dependency
+
+    def available(self) -> bool:
+        return self.requires is None or importlib.util.find_spec(self.requires) is not None
+
+    def page_count(self, file_path: Path) -> int:
+        """ paged backends only """
+        raise NotImplementedError()
+
+    def iter_pages(self, file_path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """ text of pages [start, end), paged backends only """
+        raise NotImplementedError()
+
+    def iter_pieces(self, file_path: Path) -> Iterator[str]:
+        """ the whole text in pieces, without holding all of it """
+        for i, page in enumerate(self.iter_pages(file_path)):
+            yield ("\n" if i else "") + page
+
+# PDF
+
+class PyPDF2Extractor(Extractor):
+    name = "pypdf2"
+    suffixes = ('.pdf',)
+    paged = True
+
+    def page_count(self, file_path):
+        from PyPDF2 import PdfReader
+        with file_path.open('rb') as f:
+            return len(PdfReader(f).pages)
+
+    def iter_pages(self, file_path, start=0, end=None):
+        from PyPDF2 import PdfReader
+        # an open file object, a path makes PdfReader read the whole file into memory
+        with file_path.open('rb') as f:
+            reader = PdfReader(f)
+            for i in range(start, len(reader.pages) if end is None else end):
+                yield reader.pages[i].extract_text() or ''
+
+# pdfium isn't thread safe, every call into it in this process goes through the lock
+# (held per call, never across a yield, so concurrent extractions interleave page by page)
+_pdfium_lock = threading.Lock()
+
+class PdfiumExtractor(Extractor):
+    name = "pypdfium2"
+    suffixes = ('.pdf',)
+    paged = True
+    requires = "pypdfium2"
+
+    def page_count(self, file_path):
+        import pypdfium2
+        with _pdfium_lock:
+            pdf = pypdfium2.PdfDocument(str(file_path))
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+
+    def iter_pages(self, file_path, start=0, end=None):
+        import pypdfium2
+        with _pdfium_lock:
+            pdf = pypdfium2.PdfDocument(str(file_path))
+            count = len(pdf)
+        try:
+            for i in range(start, count if end is None else end):
+                with _pdfium_lock:
+                    page = pdf[i]
+                    text_page = page.get_textpage()
+                    text = text_page.get_text_range()
+                    text_page.close()
+                    page.close()
+                # pdfium ends lines with \r\n, the other backends with \n
+                yield text.replace('\r\n', '\n')
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+
+class PyMuPDFExtractor(Extractor):
+    name = "pymupdf"
+    suffixes = ('.pdf',)
+    paged = True
+    requires = "pymupdf"
+
+    def page_count(self, file_path):
+        import pymupdf
+        with pymupdf.open(str(file_path)) as doc:
+            return doc.page_count
+
+    def iter_pages(self, file_path, start=0, end=None):
+        import pymupdf
+        with pymupdf.open(str(file_path)) as doc:
+            for i in range(start, doc.page_count if end is None else end):
+                yield doc[i].get_text()
+
+# Text formats
+
+class TextExtractor(Extractor):
+    name = "text"
+    suffixes = ('.txt', '.md', '.markdown')
+
+    def iter_pieces(self, file_path):
+        with file_path.open('r', encoding='utf-8') as f:
+            while piece := f.read(TEXT_READ_SIZE):
+                yield piece
+
+class _HTMLText(HTMLParser):
+    SKIP = {'script', 'style', 'head', 'noscript', 'template'}
+    BLOCKS = {'p', 'div', 'section', 'article', 'li', 'tr', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'table'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+    def take(self) -> str:
+        text, self.parts = "".join(self.parts), []
+        return text
+
+class HTMLExtractor(Extractor):
+    """ block elements become blank lines, so the semantic chunker sees them as paragraphs """
+    name = "html"
+    suffixes = ('.html', '.htm')
+
+    def iter_pieces(self, file_path):
+        parser = _HTMLText()
+        with file_path.open('r', encoding='utf-8', errors='replace') as f:
+            while piece := f.read(TEXT_READ_SIZE):
+                parser.feed(piece)
+                yield _collapse(parser.take())
+        parser.close()
+        yield _collapse(parser.take())
+
+def _collapse(text: str) -> str:
+    # whitespace runs from markup indentation, at most one blank line between blocks
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    return re.sub(r"\s*\n\s*\n\s*", "\n\n", text)
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+class DocxExtractor(Extractor):
+    """ paragraphs of word/document.xml, parsed incrementally, separated by blank lines """
+    name = "docx"
+    suffixes = ('.docx',)
+
+    def iter_pieces(self, file_path):
+        with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+            first = True
+            parts: List[str] = []
+            for _, element in iterparse(xml):    # "end" events, a paragraph is complete when it ends
+                if element.tag == f"{W}t":
+                    parts.append(element.text or "")
+                elif element.tag == f"{W}tab":
+                    parts.append("\t")
+                elif element.tag in (f"{W}br", f"{W}cr"):
+                    parts.append("\n")
+                elif element.tag == f"{W}p":
+                    paragraph = "".join(parts)
+                    parts = []
+                    if paragraph.strip():
+                        yield ("" if first else "\n\n") + paragraph
+                        first = False
+                    element.clear()    # keeps memory flat for large documents
+
+# Registry
+
+_BACKENDS: Dict[str, Extractor] = {}
+PDF_BACKENDS = ("pymupdf", "pypdfium2", "pypdf2")    # fastest first, for auto
+
+def register_extractor(extractor: Extractor):
+    _BACKENDS[extractor.name] = extractor
+
+for _extractor in (PyPDF2Extractor(), PdfiumExtractor(), PyMuPDFExtractor(), TextExtractor(), HTMLExtractor(), DocxExtractor()):
+    register_extractor(_extractor)
+
+def get_backend(name: str) -> Extractor:
+    extractor = _BACKENDS.get(name)
+    if extractor is None:
+        raise ValueError(f"Unknown extractor: {name}, expected one of {sorted(_BACKENDS)}")
+    if not extractor.available():
+        raise ValueError(f"Extractor {name} is not installed (pip install {extractor.requires})")
+    return extractor
+
+def backends_for(suffix: str) -> List[Extractor]:
+    """ every installed backend that reads this file type """
+    return [e for e in _BACKENDS.values() if suffix.lower() in e.suffixes and e.available()]
+
+def supported_suffixes() -> set:
+    return {suffix for e in _BACKENDS.values() if e.available() for suffix in e.suffixes}
+
+def get_extractor(file_path: Path, pdf_backend: str = PDF_EXTRACTOR) -> Extractor:
+    """ backend for a file, by its suffix and PDF_EXTRACTOR """
+    suffix = file_path.suffix.lower()
+    if suffix == '.pdf':
+        if pdf_backend == "auto":
+            return next(_BACKENDS[name] for name in PDF_BACKENDS if _BACKENDS[name].available())
+        return get_backend(pdf_backend)
+
+    candidates = backends_for(suffix)
+    if not candidates:
+        raise ValueError(f"Unsupported file type: {suffix}")
+    return candidates[0]
@@ -1,23 +1,42 @@
+import os
 import uuid
+import hashlib
 from pathlib import Path
-from typing import Tuple, List
-from PyPDF2 import PdfReader
+import asyncio
+from itertools import islice
+from typing import Tuple, List, Dict, Set, Optional, Callable, Awaitable
+import numpy as np
+from sqlalchemy import delete, select, insert, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models import Document, Chunk
-from app.services.shared.embeddings import get_embeddings
-from app.services.shared.vector_store import QdrantStore
-from app.helper import chunk_fixed, chunk_semantic
+from app.services.shared.embeddings import get_embeddings, EMBEDDING_DIM
+from app.services.shared.vector_store import get_vector_store
+from app.services.shared.keyword_index import index_chunks, unindex_chunks
+from app.services.rag.answer_cache import get_answer_cache
+from app.helper import chunk_fixed, chunk_semantic, chunk_token
+from app.services.ingestion.extraction import iter_chunks, extract_text, file_sha256
+from app.services.ingestion.near_dup import (
+    NEAR_DUP_ENABLED, NEAR_DUP_MAX_SOURCES, minhash, find_near_duplicates, remember, forget
+)
 
 UPLOADED_DIR = Path('uploads')
 UPLOADED_DIR.mkdir(parents=True, exist_ok=True)
 
 COLLECTION_NAME = "documents"
-VECTOR_SIZE = 384    # all-MiniLM-L6-v2 produces 384-dim vectors
+VECTOR_SIZE = EMBEDDING_DIM
+
+# streaming ingestion: chunks per embed / upsert / insert batch, and batches buffered between stages
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 2))
+
+# skip exact re-uploads (same file & chunking params)
+# a new version of a file is only updated in place when the caller asks for it (replace), see previous_version
+INGEST_DEDUP = os.getenv("INGEST_DEDUP", "true").lower() == "true"
 
 # so with vector_store we can switch between different vector db
-# like a langchain
-vector_store = QdrantStore(url="http://localhost:6333")
+# like a langchain, picked with VECTOR_STORE env
+# looked up on every use, not kept in a global, close_vector_store() replaces the shared one
 
 async def save_file(file_content: bytes, filename: str) -> Tuple[Path, str]:
     """
@@ -34,17 +53,9 @@ async def save_file(file_content: bytes, filename: str) -> Tuple[Path, str]:
 
 async def extract_text_from_file(file_path: Path) -> str:
     """
-    Extract text from pdf or txt files
+    Extract text from pdf or txt files, cached & parsed off the event loop by the extraction service
     """
-    suffix = file_path.suffix.lower()
-
-    if suffix == '.txt':
-        return file_path.read_text(encoding='utf-8')
-    elif suffix == '.pdf':
-        reader = PdfReader(str(file_path))
-        return "\n".join([page.extract_text() or '' for page in reader.pages])
-    else:
-        raise ValueError(f"Unsupported file type: {suffix}")
+    return await extract_text(file_path)
     
 async def chunk_text(text: str, strategy: str, chunk_size: int) -> List[str]:
     """
@@ -54,20 +65,429 @@ async def chunk_text(text: str, strategy: str, chunk_size: int) -> List[str]:
         return chunk_fixed(text, chunk_size=chunk_size)
     elif strategy == "semantic":
         return chunk_semantic(text, chunk_size=chunk_size)
+    elif strategy == "token":
+        # tokenizing is cpu bound, off the event loop
+        return await asyncio.to_thread(chunk_token, text, chunk_size)
     else:
         raise ValueError(f"Unknown chunking strategy: {strategy}")
     
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def document_hash(file_digest: str, chunk_strategy: str, chunk_size: int) -> str:
+    """ file sha256 + chunking params, the same file chunked differently is a different document """
+    return hashlib.sha256(f"{file_digest}:{chunk_strategy}:{chunk_size}".encode()).hexdigest()
+
+def content_vector_ids(doc_id: int, hashes: List[str], seen: Dict[str, int], taken: frozenset = frozenset()) -> List[str]:
+    """
+    - vector ids from the chunk text, not its position, so an unchanged chunk keeps its id when chunks move
+    - seen counts repeats of a text within the document (_1, _2 ...), pass the same dict for every batch
+    - taken: ids already used by the document's existing chunks
+    """
+    ids = []
+    for h in hashes:
+        while True:
+            n = seen.get(h, 0)
+            seen[h] = n + 1
+            vector_id = f"doc{doc_id}_{h[:16]}" + (f"_{n}" if n else "")
+            if vector_id not in taken:
+                break
+        ids.append(vector_id)
+    return ids
+
+async def find_duplicate(session: AsyncSession, content_hash: str) -> Optional[Document]:
+    return (await session.execute(
+        select(Document).where(Document.content_hash == content_hash).limit(1)
+    )).scalar_one_or_none()
+
+async def _insert_chunks(session: AsyncSession, rows: List[dict]) -> List[int]:
+    """ one executemany for all rows instead of an ORM object per chunk, ids in row order """
+    if not rows:
+        return []
+    result = await session.execute(insert(Chunk).returning(Chunk.id, sort_by_parameter_order=True), rows)
+    return list(result.scalars())
+
+async def _store_chunks(
+        session: AsyncSession,
+        items: List[Tuple[int, int, str]],
+        hashes: List[str],
+        vector_ids: List[str],
+        embeddings: Optional[np.ndarray] = None
+)   -> List[str]:
+    """
+    - vectors, chunk rows & keyword index for chunks of one or more documents, items are (doc_id, chunk_index, text)
+    - embeddings: computed here when not given, only for the chunks that get a vector
+    - with NEAR_DUP_ENABLED a chunk nearly identical to a stored one (or an earlier one in items) gets
+      no vector & no keyword index entry, its row points to that chunk & the chunk's payload lists it as a source
+    - rows & index are flushed, not committed, the caller decides the transaction
+    - Returns the vector ids written, to delete them if the transaction fails
+    """
+    signatures: List[Optional[bytes]] = [None] * len(items)
+    matches: List[Optional[dict]] = [None] * len(items)
+    if NEAR_DUP_ENABLED:
+        signatures = await asyncio.to_thread(lambda: [minhash(text) for _, _, text in items])
+        matches = await find_near_duplicates(session, signatures)
+
+    canonical = [k for k, match in enumerate(matches) if match is None]
+
+    # Store Embedding in Qdrant
+    if canonical:
+        if embeddings is None:
+            embeddings = await get_embeddings([items[k][2] for k in canonical])
+        elif len(canonical) < len(items):
+            embeddings = embeddings[canonical]
+        await get_vector_store().upsert_vectors(
+            namespace=COLLECTION_NAME,
+            ids=[vector_ids[k] for k in canonical],
+            vectors=embeddings,
+            metadatas=[
+                {
+                    "doc_id": items[k][0],
+                    "chunk_index": items[k][1],
+                    "text": items[k][2][:500]    # preview
+                } for k in canonical
+            ]
+        )
+
+    # Save Chunk in db
+    chunk_ids = await _insert_chunks(session, [
+        {
+            "doc_id": items[k][0],
+            "chunk_index": items[k][1],
+            "text": items[k][2],
+            "vector_id": vector_ids[k],
+            "content_hash": hashes[k],
+            "minhash": signatures[k]
+        } for k in canonical
+    ])
+    id_of = dict(zip(canonical, chunk_ids))
+
+    # Keep keyword index in sync, same transaction as the chunk rows
+    await index_chunks(session, None, chunk_ids=chunk_ids)
+
+    duplicates = []
+    for k, match in enumerate(matches):
+        if match is None:
+            continue
+        if "position" in match:
+            canonical_id, vector_id = id_of[match["position"]], vector_ids[match["position"]]
+        else:
+            canonical_id, vector_id = match["chunk_id"], match["vector_id"]
+        doc_id, i, text = items[k]
+        duplicates.append({
+            "doc_id": doc_id, "chunk_index": i, "text": text, "vector_id": vector_id,
+            "content_hash": hashes[k], "minhash": signatures[k], "canonical_id": canonical_id
+        })
+
+    if NEAR_DUP_ENABLED:
+        await remember(session, [(id_of[k], signatures[k]) for k in canonical])
+    if duplicates:
+        await _insert_chunks(session, duplicates)
+        await _refresh_sources(session, {row["canonical_id"] for row in duplicates})
+        print(f"  🧬 {len(duplicates)} of {len(items)} chunks are near duplicates, stored without a vector")
+
+    return [vector_ids[k] for k in canonical]
+
+async def _refresh_sources(session: AsyncSession, canonical_ids: Set[int], exclude: Set[int] = frozenset()):
+    """
+    - payload "sources" of canonical chunks: doc_id & chunk_index of the near duplicates sharing their vector
+      (first NEAR_DUP_MAX_SOURCES), "source_count" all of them
+    - exclude: chunk ids about to be deleted
+    """
+    ids = sorted(canonical_ids - exclude)
+    if not ids:
+        return
+    vector_id_of = dict((await session.execute(
+        select(Chunk.id, Chunk.vector_id).where(Chunk.id.in_(ids), Chunk.canonical_id.is_(None))
+    )).all())
+    sources: Dict[int, List[dict]] = {chunk_id: [] for chunk_id in vector_id_of}
+    rows = await session.execute(
+        select(Chunk.id, Chunk.canonical_id, Chunk.doc_id, Chunk.chunk_index)
+        .where(Chunk.canonical_id.in_(list(vector_id_of)))
+        .order_by(Chunk.id)
+    )
+    for chunk_id, canonical_id, doc_id, chunk_index in rows:
+        if chunk_id not in exclude:
+            sources[canonical_id].append({"doc_id": doc_id, "chunk_index": chunk_index})
+
+    if sources:
+        await get_vector_store().set_payloads(
+            COLLECTION_NAME,
+            [vector_id_of[chunk_id] for chunk_id in sources],
+            [{"sources": refs[:NEAR_DUP_MAX_SOURCES], "source_count": len(refs)} for refs in sources.values()]
+        )
+
+async def _release_chunks(session: AsyncSession, removed: List[Chunk]) -> Set[str]:
+    """
+    - call before deleting chunk rows: near duplicates of a removed canonical chunk get the first remaining
+      one of them as their new canonical chunk, it takes over the vector (payload moved to it) & keyword index
+    - canonical chunks of removed near duplicates get their sources refreshed
+    - Returns vector ids that are still used, the caller must not delete them
+    """
+    removed_ids = {row.id for row in removed}
+    removed_canonical = [row.id for row in removed if row.canonical_id is None]
+    await forget(session, removed_canonical)
+
+    survivors: Dict[int, List[Chunk]] = {}
+    for start in range(0, len(removed_canonical), 500):
+        rows = (await session.execute(
+            select(Chunk).where(Chunk.canonical_id.in_(removed_canonical[start:start + 500])).order_by(Chunk.id)
+        )).scalars().all()
+        for row in rows:
+            if row.id not in removed_ids:
+                survivors.setdefault(row.canonical_id, []).append(row)
+
+    promoted = []
+    for same_text in survivors.values():
+        head = same_text[0]
+        head.canonical_id = None
+        for row in same_text[1:]:
+            row.canonical_id = head.id
+        promoted.append(head)
+
+    if promoted:
+        await session.flush()
+        await index_chunks(session, None, chunk_ids=[row.id for row in promoted])
+        await get_vector_store().set_payloads(
+            COLLECTION_NAME,
+            [row.vector_id for row in promoted],
+            [{"doc_id": row.doc_id, "chunk_index": row.chunk_index, "text": (row.text or "")[:500]} for row in promoted]
+        )
+        await remember(session, [(row.id, row.minhash) for row in promoted])
+        print(f"  🧬 {len(promoted)} near duplicates took over the vector of a removed chunk")
+
+    touched = {row.canonical_id for row in removed if row.canonical_id is not None} | {row.id for row in promoted}
+    await _refresh_sources(session, touched, exclude=removed_ids)
+    return {row.vector_id for row in promoted}
+
+class DocumentUpdate:
+    """
+    A new version of a stored document (same filename) applied in place, only chunks with new text are embedded
+    - match() the new version's chunk hashes in chunk order, batch by batch: unchanged chunks keep their row & vector,
+      the positions returned have new text, store them under the document's id with vector_ids() (never one of the
+      stored version's ids)
+    - until finish() is committed the stored version stays searchable, finish() moves chunk_index of unchanged chunks,
+      removes the chunks that are gone (row & keyword index, vector in delete_unused() after the commit)
+    - undo() after any failure: removes what the update wrote, committed or not, the stored version is left as it was
+    """
+
+    def __init__(self, doc: Document, rows: List[tuple], rehashed: Dict[int, str]):
+        # plain values, not the orm object: undo() runs after a rollback expired it
+        self.doc_id = doc.id
+        self.filename = doc.filename
+        self.rehashed = rehashed    # chunk id -> hash of stored rows from before content hashes
+        self.max_old_id = max((row[0] for row in rows), default=0)
+        self.taken = frozenset(row[4] for row in rows)
+
+        # (id, chunk_index, canonical_id, vector_id) by text, earliest last so pop() takes it first
+        self.old: Dict[str, List[tuple]] = {}
+        for chunk_id, chunk_index, h, canonical_id, vector_id in rows:
+            self.old.setdefault(h, []).append((chunk_id, chunk_index, canonical_id, vector_id))
+        for same_text in self.old.values():
+            same_text.reverse()
+
+        self.moved: List[tuple] = []    # (id, new chunk_index, canonical_id, vector_id)
+        self.reused = 0
+        self.written: List[str] = []    # vector ids handed out, deleted by undo()
+        self.unused: List[str] = []
+        self._seen: Dict[str, int] = {}
+        self._finishing = False
+
+    @classmethod
+    async def load(cls, session: AsyncSession, doc: Document) -> "DocumentUpdate":
+        """ only ids, hashes & vector ids of the stored chunks, texts stay in the db """
+        rows = (await session.execute(
+            select(Chunk.id, Chunk.chunk_index, Chunk.content_hash, Chunk.canonical_id, Chunk.vector_id)
+            .where(Chunk.doc_id == doc.id)
+            .order_by(Chunk.chunk_index, Chunk.id)
+        )).all()
+        rehashed = {}
+        unhashed = [row[0] for row in rows if row[2] is None]
+        for start in range(0, len(unhashed), 500):
+            texts = await session.execute(select(Chunk.id, Chunk.text).where(Chunk.id.in_(unhashed[start:start + 500])))
+            rehashed.update((chunk_id, chunk_hash(text or "")) for chunk_id, text in texts)
+        rows = [(row[0], row[1], row[2] or rehashed[row[0]], row[3], row[4]) for row in rows]
+        return cls(doc, rows, rehashed)
+
+    def match(self, start: int, hashes: List[str]) -> List[int]:
+        """ positions in hashes of chunks with new text, start: chunk_index of hashes[0] """
+        new = []
+        for k, h in enumerate(hashes):
+            same_text = self.old.get(h)
+            if same_text:
+                chunk_id, chunk_index, canonical_id, vector_id = same_text.pop()
+                self.reused += 1
+                if chunk_index != start + k:
+                    self.moved.append((chunk_id, start + k, canonical_id, vector_id))
+            else:
+                new.append(k)
+        return new
+
+    def vector_ids(self, hashes: List[str]) -> List[str]:
+        ids = content_vector_ids(self.doc_id, hashes, self._seen, taken=self.taken)
+        self.written.extend(ids)
+        return ids
+
+    def _removed(self) -> List[tuple]:
+        return [row for same_text in self.old.values() for row in same_text]
+
+    async def finish(self, session: AsyncSession, total_chunks: int, content_hash: str) -> int:
+        """ in the caller's transaction, commit it then call delete_unused(); Returns the removed chunk count """
+        self._finishing = True
+        if self.rehashed:
+            await session.execute(update(Chunk), [{"id": i, "content_hash": h} for i, h in self.rehashed.items()])
+        if self.moved:
+            await session.execute(update(Chunk), [{"id": row[0], "chunk_index": row[1]} for row in self.moved])
+            # a moved near duplicate only shows up in its canonical chunk's sources
+            moved_canonical = [row for row in self.moved if row[2] is None]
+            if moved_canonical:
+                await get_vector_store().set_payloads(
+                    COLLECTION_NAME, [row[3] for row in moved_canonical], [{"chunk_index": row[1]} for row in moved_canonical]
+                )
+            await _refresh_sources(session, {row[2] for row in self.moved if row[2] is not None})
+
+        removed_ids = [row[0] for row in self._removed()]
+        rows = []
+        for start in range(0, len(removed_ids), 500):
+            rows.extend((await session.execute(select(Chunk).where(Chunk.id.in_(removed_ids[start:start + 500])))).scalars())
+        # all at once: a removed chunk must not be promoted in place of another removed one
+        still_used = await _release_chunks(session, rows) if rows else set()
+        await unindex_chunks(session, self.doc_id, chunk_ids=removed_ids)
+        for start in range(0, len(removed_ids), 500):
+            await session.execute(delete(Chunk).where(Chunk.id.in_(removed_ids[start:start + 500])))
+
+        await session.execute(
+            update(Document).where(Document.id == self.doc_id).values(total_chunks=total_chunks, content_hash=content_hash)
+        )
+        # near duplicates have no vector of their own
+        self.unused = [row[3] for row in self._removed() if row[2] is None and row[3] not in still_used]
+        return len(removed_ids)
+
+    async def delete_unused(self):
+        """ vectors of removed chunks, only after the commit: until then the old version stays searchable """
+        if self.unused:
+            await get_vector_store().delete_vectors(COLLECTION_NAME, self.unused)
+
+    async def undo(self, session: AsyncSession):
+        await session.rollback()
+        # chunks of this update committed so far (streaming & bulk commit batch by batch), newer than every stored one
+        rows = (await session.execute(
+            select(Chunk).where(Chunk.doc_id == self.doc_id, Chunk.id > self.max_old_id)
+        )).scalars().all()
+        still_used = await _release_chunks(session, rows) if rows else set()
+        ids = [row.id for row in rows]
+        await unindex_chunks(session, self.doc_id, chunk_ids=ids)
+        for start in range(0, len(ids), 500):
+            await session.execute(delete(Chunk).where(Chunk.id.in_(ids[start:start + 500])))
+        await session.commit()
+
+        unused = [vector_id for vector_id in self.written if vector_id not in still_used]
+        if unused:
+            await get_vector_store().delete_vectors(COLLECTION_NAME, unused)
+        if self._finishing:
+            # finish() rewrote payloads of moved & removed chunks' vectors before it failed
+            await _restore_payloads(session, {row[3] for row in self.moved} | {row[3] for row in self._removed()})
+
+async def _restore_payloads(session: AsyncSession, vector_ids: Set[str]):
+    """ payloads of these vectors rewritten from their committed canonical rows, after a rolled back update """
+    ids = sorted(vector_ids)
+    canonical: Set[int] = set()
+    for start in range(0, len(ids), 500):
+        rows = (await session.execute(
+            select(Chunk).where(Chunk.vector_id.in_(ids[start:start + 500]), Chunk.canonical_id.is_(None))
+        )).scalars().all()
+        if rows:
+            await get_vector_store().set_payloads(
+                COLLECTION_NAME,
+                [row.vector_id for row in rows],
+                [{"doc_id": row.doc_id, "chunk_index": row.chunk_index, "text": (row.text or "")[:500]} for row in rows]
+            )
+        canonical.update(row.id for row in rows)
+    await _refresh_sources(session, canonical)
+
+async def invalidate_answers(session: AsyncSession, filenames: List[str]):
+    """
+    - cached answers built on any stored version of these files are stale now: every document with the same
+      filename, the one just written included (without replace older versions stay documents of their own)
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is None or not filenames:
+        return
+    doc_ids = []
+    for start in range(0, len(filenames), 500):
+        doc_ids.extend((await session.execute(
+            select(Document.id).where(Document.filename.in_(filenames[start:start + 500]))
+        )).scalars())
+    await answer_cache.invalidate_documents(doc_ids)
+
+async def previous_version(session: AsyncSession, filename: str) -> Optional[Document]:
+    """
+    - latest stored document with this filename, an upload with replace=True is ingested as a DocumentUpdate of it
+    - only on request: two unrelated files can share a name, by default each upload is a document of its own
+    """
+    return (await session.execute(
+        select(Document).where(Document.filename == filename).order_by(Document.id.desc()).limit(1)
+    )).scalar_one_or_none()
+
+async def _update_document(
+        session: AsyncSession,
+        doc: Document,
+        chunks: List[str],
+        hashes: List[str],
+        content_hash: str,
+        stats: dict
+):
+    """
+    - re-ingest a new version of doc in place, see DocumentUpdate
+    - one transaction, a failure leaves the stored version (rows, vectors & payloads) as it was
+    """
+    doc_update = await DocumentUpdate.load(session, doc)
+    new = doc_update.match(0, hashes)
+    try:
+        embedded = []
+        if new:
+            new_hashes = [hashes[i] for i in new]
+            embedded = await _store_chunks(
+                session, [(doc_update.doc_id, i, chunks[i]) for i in new], new_hashes, doc_update.vector_ids(new_hashes)
+            )
+        removed = await doc_update.finish(session, len(chunks), content_hash)
+        await session.commit()
+    except BaseException:
+        await doc_update.undo(session)
+        raise
+    await doc_update.delete_unused()
+
+    stats.update(status="updated", embedded=len(embedded), reused=doc_update.reused, removed=removed,
+                 near_duplicates=len(new) - len(embedded))
+    print(f"🔁 Updated document {doc_update.doc_id} ({doc_update.filename}): {len(embedded)} chunks embedded, "
+          f"{doc_update.reused} reused, {removed} removed")
+
 async def ingestion_pipeline(
         file_content:str,
         filename:str,
         chunk_strategy:str,
         chunk_size:int,
-        session: AsyncSession
+        session: AsyncSession,
+        stats: Optional[dict] = None,
+        replace: bool = False
 )   -> Tuple[int, str, int]:
     """
     - Complete Ingestion Pipeline
+    - with INGEST_DEDUP an exact re-upload returns the existing document without any work
+    - replace: a changed file under an existing filename updates that document incrementally,
+      otherwise it becomes a new document
+    - stats gets status (created / duplicate / updated) & embedded / reused / removed / near_duplicates chunk counts
     - Returns (document_id, filename, total_chunks)
     """
+    stats = {} if stats is None else stats
+    content_hash = document_hash(hashlib.sha256(file_content).hexdigest(), chunk_strategy, chunk_size)
+
+    if INGEST_DEDUP:
+        existing = await find_duplicate(session, content_hash)
+        if existing is not None:
+            stats.update(status="duplicate", embedded=0, reused=existing.total_chunks, removed=0, near_duplicates=0)
+            print(f"♻️ {filename} is already ingested as document {existing.id}")
+            return existing.id, existing.filename, existing.total_chunks
 
     saved_path, saved_name = await save_file(file_content, filename)
 
@@ -81,54 +501,198 @@ async def ingestion_pipeline(
         if not chunks:
             raise ValueError("No Chunks were generated from the document.")
 
-        # Embedding Chunk
-        embeddings = await get_embeddings(chunks)
+        hashes = [chunk_hash(chunk) for chunk in chunks]
 
         # Ensure Qdrant Collection
-        await vector_store.ensure_collection(COLLECTION_NAME, VECTOR_SIZE)
+        await get_vector_store().ensure_collection(COLLECTION_NAME, VECTOR_SIZE)
 
-        # Create doc in db
-        doc = Document(
-            filename = filename,
-            total_chunks = len(chunks)
-        )
+        previous = await previous_version(session, filename) if replace else None
+
+        if previous is not None:
+            await _update_document(session, previous, chunks, hashes, content_hash, stats)
+            doc_id = previous.id
+        else:
+            # Create doc in db
+            doc = Document(
+                filename = filename,
+                total_chunks = len(chunks),
+                content_hash = content_hash
+            )
+            session.add(doc)
+            await session.commit()
+            await session.refresh(doc)
+            doc_id = doc.id
+
+            # Embedding Chunk (near duplicates of stored chunks aren't embedded) & store
+            vector_ids = content_vector_ids(doc_id, hashes, {})
+            try:
+                written = await _store_chunks(session, [(doc_id, i, chunk) for i, chunk in enumerate(chunks)], hashes, vector_ids)
+                await session.commit()
+            except BaseException:
+                await _discard_document(session, doc_id, vector_ids)
+                raise
+            stats.update(status="created", embedded=len(written), reused=0, removed=0, near_duplicates=len(chunks) - len(written))
+
+        await invalidate_answers(session, [filename])
+
+        return doc_id, filename, len(chunks)
+    
+    except Exception as e:
+        saved_path.unlink(missing_ok=True)
+        raise e
+
+async def _discard_document(session: AsyncSession, doc_id: int, vector_ids: List[str]):
+    """
+    - undo a partly written document: vectors, keyword index, chunk rows & the document row
+    - vector_ids: vectors written for it, committed or not
+    """
+    await session.rollback()
+    rows = (await session.execute(select(Chunk).where(Chunk.doc_id == doc_id))).scalars().all()
+    # near duplicates in other documents may already point at its committed chunks
+    still_used = await _release_chunks(session, rows) if rows else set()
+    await unindex_chunks(session, doc_id)
+    await session.execute(delete(Chunk).where(Chunk.doc_id == doc_id))
+    await session.execute(delete(Document).where(Document.id == doc_id))
+    await session.commit()
+    unused = [vector_id for vector_id in vector_ids if vector_id not in still_used]
+    if unused:
+        await get_vector_store().delete_vectors(COLLECTION_NAME, unused)
+
+async def ingestion_pipeline_streaming(
+        file_path: Path,
+        filename: str,
+        chunk_strategy: str,
+        chunk_size: int,
+        session: AsyncSession,
+        on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+        stats: Optional[dict] = None,
+        replace: bool = False
+)   -> Tuple[int, str, int]:
+    """
+    - Same result as ingestion_pipeline for a file already saved to disk, with flat memory
+    - extract → chunk → embed → store run as stages connected by bounded queues,
+      each batch of INGEST_BATCH_SIZE chunks is searchable as soon as it's committed
+    - on_progress is awaited after every stored batch
+    - a failure removes everything written so far
+    - with INGEST_DEDUP an exact re-upload returns the existing document
+    - replace: a new version of a file updates the stored one (DocumentUpdate), chunks are matched batch by batch,
+      only new text is embedded
+    - stats gets status (created / duplicate / updated) & chunk counts like ingestion_pipeline
+    - Returns (document_id, filename, total_chunks)
+    """
+    stats = {} if stats is None else stats
+    file_digest = await asyncio.to_thread(file_sha256, file_path)
+    content_hash = document_hash(file_digest, chunk_strategy, chunk_size)
+    if INGEST_DEDUP:
+        existing = await find_duplicate(session, content_hash)
+        if existing is not None:
+            stats.update(status="duplicate", embedded=0, reused=existing.total_chunks, removed=0, near_duplicates=0)
+            print(f"♻️ {filename} is already ingested as document {existing.id}")
+            return existing.id, existing.filename, existing.total_chunks
+
+    await get_vector_store().ensure_collection(COLLECTION_NAME, VECTOR_SIZE)
+
+    previous = await previous_version(session, filename) if replace else None
+    doc_update = None
+    if previous is not None:
+        doc_update = await DocumentUpdate.load(session, previous)
+        doc_id = previous.id
+    else:
+        doc = Document(filename = filename, total_chunks = 0)
         session.add(doc)
         await session.commit()
         await session.refresh(doc)
+        doc_id = doc.id
 
-        # Prepare Metadata
-        metadatas = [
-            {
-                "doc_id": doc.id,
-                "chunk_index": i,
-                "text": chunk[:500]    # preview
-            } for i, chunk in enumerate(chunks)
-        ]
+    progress = {"doc_id": doc_id, "total_pages": None, "pages_done": 0, "chunks_done": 0, "batches_done": 0, "embedded": 0}
+    chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    written_ids: List[str] = []
+    seen_hashes: Dict[str, int] = {}
+    new_chunks = [0]
+    loop = asyncio.get_running_loop()
 
-        vector_ids = [f"doc{doc.id}_chunk{i}" for i in range(len(chunks))]
+    async def extract():
+        # pdf parsing & chunking are blocking, every batch is pulled in the thread pool
+        chunks = iter_chunks(file_path, chunk_strategy, chunk_size, progress)
+        start = 0
+        while True:
+            batch = await loop.run_in_executor(None, lambda: list(islice(chunks, INGEST_BATCH_SIZE)))
+            if not batch:
+                break
+            await chunk_queue.put((start, batch))
+            start += len(batch)
+        await chunk_queue.put(None)
 
-        # Store Embedding in Qdrant
-        await vector_store.upsert_vectors(
-            namespace=COLLECTION_NAME,
-            ids=vector_ids,
-            vectors=embeddings,
-            metadatas=metadatas
-        )
+    async def embed():
+        while (item := await chunk_queue.get()) is not None:
+            start, batch = item
+            hashes = [chunk_hash(chunk) for chunk in batch]
+            # in chunk order, an update only stores chunks with new text
+            new = doc_update.match(start, hashes) if doc_update is not None else range(len(batch))
+            items = [(doc_id, start + k, batch[k]) for k in new]
+            new_hashes = [hashes[k] for k in new]
+            embeddings = await get_embeddings([text for _, _, text in items]) if items else None
+            await embed_queue.put((start + len(batch), items, new_hashes, embeddings))
+        await embed_queue.put(None)
+
+    async def store():
+        while (item := await embed_queue.get()) is not None:
+            end, items, hashes, embeddings = item
+            if items:
+                if doc_update is not None:
+                    vector_ids = doc_update.vector_ids(hashes)
+                else:
+                    vector_ids = content_vector_ids(doc_id, hashes, seen_hashes)
+                    # upserted before the commit, so a failure in between still removes them
+                    written_ids.extend(vector_ids)
+                written = await _store_chunks(session, items, hashes, vector_ids, embeddings)
+                progress["embedded"] += len(written)
+                new_chunks[0] += len(items)
+                await session.commit()
 
-        # Save Chunk in db
-        for i, chunk_content in enumerate(chunks):
-            chunk_obj = Chunk(
-                doc_id = doc.id,
-                chunk_index = i,
-                text = chunk_content,
-                vector_id=vector_ids[i]
+            progress["chunks_done"] = end
+            progress["batches_done"] += 1
+            print(
+                f"  📦 doc {doc_id}: {progress['chunks_done']} chunks stored, "
+                f"page {progress['pages_done']}/{progress['total_pages'] or '?'}"
             )
-            session.add(chunk_obj)
-        
+            if on_progress is not None:
+                await on_progress(dict(progress))
+
+    tasks = [asyncio.create_task(stage()) for stage in (extract, embed, store)]
+    removed = 0
+    try:
+        await asyncio.gather(*tasks)
+
+        if progress["chunks_done"] == 0:
+            raise ValueError("No Chunks were generated from the document.")
+
+        if doc_update is not None:
+            removed = await doc_update.finish(session, progress["chunks_done"], content_hash)
+        else:
+            doc.total_chunks = progress["chunks_done"]
+            doc.content_hash = content_hash    # only once complete, a partial document is never a duplicate
         await session.commit()
 
-        return doc.id, filename, len(chunks)
-    
-    except Exception as e:
-        saved_path.unlink(missing_ok=True)
-        raise e
\ No newline at end of file
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if doc_update is not None:
+            await doc_update.undo(session)
+        else:
+            await _discard_document(session, doc_id, written_ids)
+        raise
+
+    if doc_update is not None:
+        await doc_update.delete_unused()
+        print(f"🔁 Updated document {doc_id} ({filename}): {progress['embedded']} chunks embedded, "
+              f"{doc_update.reused} reused, {removed} removed")
+
+    await invalidate_answers(session, [filename])
+
+    stats.update(status="updated" if doc_update is not None else "created", embedded=progress["embedded"],
+                 reused=doc_update.reused if doc_update is not None else 0, removed=removed,
+                 near_duplicates=new_chunks[0] - progress["embedded"])
+    return doc_id, filename, progress["chunks_done"]
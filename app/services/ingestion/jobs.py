@@ -0,0 +1,337 @@
+"""
+Background ingestion jobs.
+
+- POST /ingestion/jobs saves the upload, adds a queued row to ingestion_jobs and returns right away
+- workers claim queued jobs with one atomic UPDATE, so any number of workers in any number of
+  processes (the API's own, or `python ingest_worker.py`) can share the sqlite queue
+- a running job bumps heartbeat_at every HEARTBEAT_INTERVAL seconds, jobs whose worker died are
+  re-queued once the heartbeat is INGEST_JOB_STALE_SECONDS old (up to INGEST_JOB_MAX_ATTEMPTS),
+  after the document the lost run created is removed
+- a run only writes to its job while it owns it (same worker & attempt), one that lost its job stops
+"""
+
+import os
+import uuid
+import time
+import socket
+import asyncio
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List
+
+from sqlalchemy import select, update, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from app.db.database import AsyncSessionLocal
+from app.db.models import IngestionJob, Document, Chunk
+from app.services.ingestion.ingestion_services import ingestion_pipeline_streaming, _discard_document
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))    # in the API process, 0 = only separate worker processes
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 1.0))    # seconds between polls when idle
+INGEST_JOB_STALE_SECONDS = int(os.getenv("INGEST_JOB_STALE_SECONDS", 300))
+INGEST_JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", 3))
+STALE_CHECK_INTERVAL = 30    # seconds, how often a pool looks for stale jobs
+HEARTBEAT_INTERVAL = max(1.0, INGEST_JOB_STALE_SECONDS / 10)    # seconds, well within the stale limit
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def job_to_dict(job: IngestionJob) -> dict:
+    end = job.finished_at or _now()
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": {
+            "pages_done": job.pages_done,
+            "total_pages": job.total_pages,
+            "chunks_done": job.chunks_done,
+        },
+        "document_id": job.document_id,
+        "error": job.error,
+        "attempts": job.attempts,
+        "worker": job.worker,
+        "timing": {
+            "created_at": job.created_at.isoformat() + "Z",
+            "started_at": job.started_at.isoformat() + "Z" if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() + "Z" if job.finished_at else None,
+            "queue_wait_s": ((job.started_at or end) - job.created_at).total_seconds(),
+            "run_s": (end - job.started_at).total_seconds() if job.started_at else None,
+        },
+    }
+
+async def enqueue_job(saved_path: Path, filename: str, chunk_strategy: str, chunk_size: int, replace: bool = False) -> IngestionJob:
+    job = IngestionJob(
+        id=uuid.uuid4().hex,
+        filename=filename,
+        saved_path=str(saved_path),
+        chunk_strategy=chunk_strategy,
+        chunk_size=chunk_size,
+        replace_existing=replace,
+        status="queued",
+        stage="queued",
+        attempts=0,
+        pages_done=0,
+        chunks_done=0,
+        created_at=_now()
+    )
+    async with AsyncSessionLocal() as session:
+        session.add(job)
+        await session.commit()
+
+    # wake up local workers instead of waiting for their next poll
+    if _worker_pool is not None:
+        _worker_pool.notify()
+    return job
+
+async def get_job(job_id: str) -> Optional[IngestionJob]:
+    async with AsyncSessionLocal() as session:
+        return await session.get(IngestionJob, job_id)
+
+async def list_jobs(status: Optional[str] = None, limit: int = 50) -> List[IngestionJob]:
+    query = select(IngestionJob).order_by(IngestionJob.created_at.desc()).limit(limit)
+    if status:
+        query = query.where(IngestionJob.status == status)
+    async with AsyncSessionLocal() as session:
+        return list((await session.execute(query)).scalars().all())
+
+async def _update_job(job_id: str, owner: Optional[IngestionJob] = None, **fields) -> bool:
+    """ owner: only while that run still holds the job (not re-queued since), Returns False if nothing was updated """
+    query = update(IngestionJob).where(IngestionJob.id == job_id)
+    if owner is not None:
+        query = query.where(
+            IngestionJob.status == "running", IngestionJob.worker == owner.worker, IngestionJob.attempts == owner.attempts
+        )
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(query.values(**fields))
+        await session.commit()
+    return result.rowcount > 0
+
+async def _claim_job(worker_name: str) -> Optional[IngestionJob]:
+    """ oldest queued job, marked running in the same statement so two workers never get the same one """
+    now = _now()
+    async with AsyncSessionLocal() as session:
+        oldest = (
+            select(IngestionJob.id)
+            .where(IngestionJob.status == "queued")
+            .order_by(IngestionJob.created_at)
+            .limit(1)
+            .scalar_subquery()
+        )
+        job_id = (await session.execute(
+            update(IngestionJob)
+            .where(and_(IngestionJob.id == oldest, IngestionJob.status == "queued"))
+            .values(
+                status="running",
+                stage="starting",
+                worker=worker_name,
+                attempts=IngestionJob.attempts + 1,
+                started_at=now,
+                heartbeat_at=now
+            )
+            .returning(IngestionJob.id)
+        )).scalar_one_or_none()
+        await session.commit()
+
+        if job_id is None:
+            return None
+        return await session.get(IngestionJob, job_id)
+
+async def _discard_partial_document(session: AsyncSession, doc_id: int):
+    """
+    - the document a lost run created, a re-run would store it a second time
+    - complete documents stay (the re-run finds a duplicate), and so does a stored version the lost run was
+      updating: it keeps its content hash until the update commits, the re-run's update picks up its new chunks
+    - vectors upserted for a batch that was never committed can't be found from the db and stay
+    """
+    doc = await session.get(Document, doc_id)
+    if doc is None or doc.content_hash is not None:
+        return
+    vector_ids = list((await session.execute(
+        select(Chunk.vector_id).where(Chunk.doc_id == doc_id, Chunk.canonical_id.is_(None))
+    )).scalars())
+    await _discard_document(session, doc_id, vector_ids)
+    print(f"🧹 Removed partial document {doc_id} of a lost ingestion job")
+
+async def _requeue_stale_jobs():
+    """ running jobs without a heartbeat for too long lost their worker, run them again or give up """
+    stale_before = _now() - timedelta(seconds=INGEST_JOB_STALE_SECONDS)
+    requeued, failed = 0, 0
+    async with AsyncSessionLocal() as session:
+        # plain rows, discarding a document rolls the session back & would expire orm objects
+        stale = (await session.execute(
+            select(IngestionJob.id, IngestionJob.attempts, IngestionJob.document_id)
+            .where(IngestionJob.status == "running", IngestionJob.heartbeat_at < stale_before)
+        )).all()
+        for job in stale:
+            # take it over first: its old run (if it's only slow) stops at its next heartbeat, other pools skip it
+            taken = await session.execute(
+                update(IngestionJob)
+                .where(
+                    IngestionJob.id == job.id, IngestionJob.status == "running",
+                    IngestionJob.attempts == job.attempts, IngestionJob.heartbeat_at < stale_before
+                )
+                .values(worker=None, stage="requeueing", heartbeat_at=_now())
+            )
+            await session.commit()
+            if not taken.rowcount:
+                continue
+
+            # a crash in between leaves it stale again, the next check repeats this
+            if job.document_id is not None:
+                await _discard_partial_document(session, job.document_id)
+
+            if job.attempts >= INGEST_JOB_MAX_ATTEMPTS:
+                values = dict(status="failed", stage="failed", error="worker lost too many times", document_id=None, finished_at=_now())
+                failed += 1
+            else:
+                values = dict(status="queued", stage="queued", pages_done=0, chunks_done=0, document_id=None)
+                requeued += 1
+            await session.execute(update(IngestionJob).where(IngestionJob.id == job.id).values(**values))
+            await session.commit()
+    if requeued or failed:
+        print(f"♻️ Re-queued {requeued} stale ingestion jobs, failed {failed}")
+
+async def _heartbeat(job: IngestionJob):
+    """ keeps the job's heartbeat fresh while it runs, returns once the job was taken away from this run """
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if not await _update_job(job.id, owner=job, heartbeat_at=_now()):
+            return
+
+async def _ingest(job: IngestionJob, on_progress, stats: dict) -> tuple:
+    async with AsyncSessionLocal() as session:
+        return await ingestion_pipeline_streaming(
+            file_path=Path(job.saved_path),
+            filename=job.filename,
+            chunk_strategy=job.chunk_strategy,
+            chunk_size=job.chunk_size,
+            session=session,
+            on_progress=on_progress,
+            stats=stats,
+            replace=bool(job.replace_existing)
+        )
+
+async def run_job(job: IngestionJob):
+    print(f"⚙️ [{job.worker}] ingestion job {job.id}: {job.filename}")
+    saved_path = Path(job.saved_path)
+
+    async def on_progress(progress: dict):
+        await _update_job(
+            job.id,
+            owner=job,
+            stage="ingesting",
+            total_pages=progress["total_pages"],
+            pages_done=progress["pages_done"],
+            chunks_done=progress["chunks_done"],
+            document_id=progress["doc_id"],
+            heartbeat_at=_now()
+        )
+
+    stats = {}
+    ingestion = asyncio.create_task(_ingest(job, on_progress, stats))
+    heartbeat = asyncio.create_task(_heartbeat(job))
+    try:
+        await asyncio.wait({ingestion, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        if not ingestion.done():
+            # re-queued as stale (this loop was blocked too long), the pipeline removes what it wrote
+            ingestion.cancel()
+            await asyncio.gather(ingestion, return_exceptions=True)
+            print(f"⚠️ [{job.worker}] ingestion job {job.id} was taken over, stopped")
+            return
+
+        doc_id, _, total_chunks = ingestion.result()
+        if await _update_job(
+            job.id, owner=job, status="done", stage="done", document_id=doc_id, chunks_done=total_chunks, finished_at=_now()
+        ):
+            print(f"✅ [{job.worker}] ingestion job {job.id} done: document {doc_id}, {total_chunks} chunks ({stats['status']})")
+            # an already ingested file isn't kept, the document has its own copy
+            if stats["status"] == "duplicate":
+                saved_path.unlink(missing_ok=True)
+
+    except asyncio.CancelledError:
+        # shutting down, the pipeline removes the partial document, someone picks it up again
+        ingestion.cancel()
+        await asyncio.shield(asyncio.gather(ingestion, return_exceptions=True))
+        await asyncio.shield(_update_job(
+            job.id, owner=job, status="queued", stage="queued", worker=None, pages_done=0, chunks_done=0, document_id=None
+        ))
+        raise
+
+    except Exception as e:
+        print(f"❌ [{job.worker}] ingestion job {job.id} failed: {type(e).__name__}: {e}")
+        if await _update_job(
+            job.id, owner=job, status="failed", stage="failed", error=f"{type(e).__name__}: {e}", document_id=None, finished_at=_now()
+        ):
+            saved_path.unlink(missing_ok=True)
+
+    finally:
+        heartbeat.cancel()
+
+class IngestionWorkerPool:
+    """
+    - `workers` asyncio tasks, each runs one job at a time
+    - the heavy parts (pdf parsing, embedding) already run in the thread / process pools
+    """
+    def __init__(self, workers: int = INGEST_WORKERS, poll_interval: float = INGEST_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._last_stale_check = 0.0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(f"{self.name}/{i}")) for i in range(self.workers)]
+        print(f"Started {self.workers} ingestion workers")
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _worker(self, worker_name: str):
+        while True:
+            try:
+                if time.monotonic() - self._last_stale_check > STALE_CHECK_INTERVAL:
+                    self._last_stale_check = time.monotonic()
+                    await _requeue_stale_jobs()
+                job = await _claim_job(worker_name)
+            except Exception as e:
+                print(f"❌ [{worker_name}] job queue error: {e}")
+                job = None
+
+            if job is not None:
+                await run_job(job)
+                continue
+
+            # idle until a job is enqueued here or the next poll for jobs from other processes
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+_worker_pool: Optional[IngestionWorkerPool] = None
+
+def start_ingestion_workers(workers: int = INGEST_WORKERS) -> Optional[IngestionWorkerPool]:
+    global _worker_pool
+    if workers <= 0:
+        return None
+    _worker_pool = IngestionWorkerPool(workers)
+    _worker_pool.start()
+    return _worker_pool
+
+async def stop_ingestion_workers():
+    global _worker_pool
+    if _worker_pool is not None:
+        await _worker_pool.stop()
+        _worker_pool = None
@@ -0,0 +1,206 @@
+"""
+Near-duplicate chunk detection with MinHash-LSH, opt-in with NEAR_DUP_ENABLED.
+
+- a chunk's signature is NUM_PERM minhashes of its word 3-shingles, the share of equal minhashes of two
+  chunks estimates the jaccard similarity of their shingle sets
+- LSH: the signature is cut into BANDS bands, chunks sharing a whole band are candidates, candidates at or
+  above NEAR_DUP_THRESHOLD are near duplicates (~99% of chunks with one word changed are found)
+- only canonical chunks (rows without canonical_id) are indexed, a near duplicate gets a row pointing at
+  its canonical chunk and shares its vector, see ingestion_services._store_chunks
+- the index is the chunk_bands table (band, key, chunk_id), written in the same transaction as the chunk rows,
+  so every process sees the same index without holding it in memory & a rollback drops its entries too;
+  candidates are always checked against the chunk rows before they're used
+"""
+
+import os
+import re
+import hashlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select, text, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from app.db.models import Chunk
+
+load_dotenv()
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "false").lower() == "true"
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", 0.8))    # estimated jaccard similarity
+NEAR_DUP_MIN_WORDS = int(os.getenv("NEAR_DUP_MIN_WORDS", 8))    # shorter chunks are never collapsed
+NEAR_DUP_MAX_SOURCES = int(os.getenv("NEAR_DUP_MAX_SOURCES", 20))    # source refs kept in a vector payload
+
+# stored signatures depend on these, changing them makes existing chunks unmatchable
+SHINGLE_WORDS = 3
+NUM_PERM = 60
+BANDS = 10
+ROWS = NUM_PERM // BANDS
+
+_rng = np.random.default_rng(20240101)
+_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+BAND_TABLE = "chunk_bands"
+
+def minhash(text: str) -> Optional[bytes]:
+    """ signature as NUM_PERM uint32 bytes, None for chunks under NEAR_DUP_MIN_WORDS words """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < NEAR_DUP_MIN_WORDS:
+        return None
+
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles), dtype=np.uint64
+    )
+    # one (a * x + b) mod 2^64 permutation per column, high 32 bits, smallest over the shingles
+    permuted = (np.outer(hashes, _A) + _B) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32).tobytes()
+
+def similarity(a: bytes, b: bytes) -> float:
+    """ estimated jaccard similarity of two signatures """
+    return float((np.frombuffer(a, dtype=np.uint32) == np.frombuffer(b, dtype=np.uint32)).mean())
+
+def _bands(signature: bytes) -> List[bytes]:
+    width = ROWS * 4
+    return [signature[b * width:(b + 1) * width] for b in range(BANDS)]
+
+class MinHashIndex:
+    """ band buckets in memory, for the chunks of one batch """
+    def __init__(self):
+        self.buckets: List[Dict[bytes, Set[int]]] = [{} for _ in range(BANDS)]
+
+    def add(self, chunk_id: int, signature: bytes):
+        for buckets, band in zip(self.buckets, _bands(signature)):
+            buckets.setdefault(band, set()).add(chunk_id)
+
+    def candidates(self, signature: bytes) -> Set[int]:
+        """ chunk ids sharing at least one band, not yet checked for similarity """
+        ids = set()
+        for buckets, band in zip(self.buckets, _bands(signature)):
+            ids.update(buckets.get(band, ()))
+        return ids
+
+def ensure_band_index(connection):
+    """Create the band table on startup, and fill it from existing canonical chunks the first time"""
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (BAND_TABLE,)
+    ).first()
+    if exists:
+        return
+
+    connection.exec_driver_sql(
+        f"CREATE TABLE {BAND_TABLE} (band INTEGER NOT NULL, key BLOB NOT NULL, chunk_id INTEGER NOT NULL, "
+        f"PRIMARY KEY (band, key, chunk_id)) WITHOUT ROWID"
+    )
+    connection.exec_driver_sql(f"CREATE INDEX ix_{BAND_TABLE}_chunk_id ON {BAND_TABLE} (chunk_id)")
+
+    last_id, filled = 0, 0
+    while True:
+        rows = connection.exec_driver_sql(
+            "SELECT id, minhash FROM chunks WHERE id > ? AND minhash IS NOT NULL AND canonical_id IS NULL "
+            "ORDER BY id LIMIT 5000", (last_id,)
+        ).all()
+        if not rows:
+            break
+        connection.exec_driver_sql(
+            f"INSERT OR IGNORE INTO {BAND_TABLE} (band, key, chunk_id) VALUES (?, ?, ?)",
+            [(b, key, chunk_id) for chunk_id, signature in rows for b, key in enumerate(_bands(signature))]
+        )
+        last_id, filled = rows[-1][0], filled + len(rows)
+    print(f"Created near-dup index '{BAND_TABLE}' ({filled} chunks)")
+
+async def remember(session: AsyncSession, chunks: Iterable[Tuple[int, Optional[bytes]]]):
+    """
+    - add (chunk id, signature) of new canonical chunks, chunks without a signature are skipped
+    - call after the chunk rows are flushed, before commit, so both land in one transaction
+    """
+    rows = [
+        {"band": b, "key": key, "chunk_id": chunk_id}
+        for chunk_id, signature in chunks if signature is not None
+        for b, key in enumerate(_bands(signature))
+    ]
+    if rows:
+        await session.execute(
+            text(f"INSERT OR IGNORE INTO {BAND_TABLE} (band, key, chunk_id) VALUES (:band, :key, :chunk_id)"), rows
+        )
+
+async def forget(session: AsyncSession, chunk_ids: Iterable[int]):
+    """ ids of chunks that are deleted or no longer canonical """
+    ids = sorted(set(chunk_ids))
+    for start in range(0, len(ids), 500):
+        await session.execute(
+            text(f"DELETE FROM {BAND_TABLE} WHERE chunk_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids[start:start + 500]}
+        )
+
+async def _candidates(session: AsyncSession, signatures: List[Optional[bytes]]) -> List[Set[int]]:
+    """ stored chunk ids sharing at least one band, per signature, one query per band """
+    bands = [_bands(signature) if signature is not None else None for signature in signatures]
+    found: List[Set[int]] = [set() for _ in signatures]
+    for b in range(BANDS):
+        keys = sorted({own[b] for own in bands if own is not None})
+        ids_of: Dict[bytes, List[int]] = {}
+        for start in range(0, len(keys), 500):
+            rows = await session.execute(
+                text(f"SELECT key, chunk_id FROM {BAND_TABLE} WHERE band = :band AND key IN :keys")
+                .bindparams(bindparam("keys", expanding=True)),
+                {"band": b, "keys": keys[start:start + 500]}
+            )
+            for key, chunk_id in rows:
+                ids_of.setdefault(key, []).append(chunk_id)
+        for ids, own in zip(found, bands):
+            if own is not None:
+                ids.update(ids_of.get(own[b], ()))
+    return found
+
+async def find_near_duplicates(session: AsyncSession, signatures: List[Optional[bytes]]) -> List[Optional[dict]]:
+    """
+    - for every chunk of a batch: None when it's new, {"chunk_id", "vector_id"} of the most similar stored
+      canonical chunk, or {"position"} of an earlier chunk of the same batch
+    - candidates are compared with their signature as read from the session, entries of rows that are gone
+      or aren't canonical any more are dropped from the index
+    """
+    candidates = await _candidates(session, signatures)
+    candidate_ids = sorted(set().union(*candidates))
+    stored: Dict[int, Tuple[bytes, str]] = {}
+    for start in range(0, len(candidate_ids), 500):
+        rows = (await session.execute(
+            select(Chunk.id, Chunk.minhash, Chunk.vector_id)
+            .where(Chunk.id.in_(candidate_ids[start:start + 500]), Chunk.canonical_id.is_(None), Chunk.minhash.is_not(None))
+        )).all()
+        for chunk_id, signature, vector_id in rows:
+            stored[chunk_id] = (signature, vector_id)
+    stale = [chunk_id for chunk_id in candidate_ids if chunk_id not in stored]
+    if stale:
+        await forget(session, stale)
+
+    batch = MinHashIndex()
+    batch_signatures: Dict[int, bytes] = {}
+    matches: List[Optional[dict]] = []
+    for position, (signature, found) in enumerate(zip(signatures, candidates)):
+        match = None
+        if signature is not None:
+            scored = [(similarity(signature, stored[i][0]), i) for i in found if i in stored]
+            best = max(scored, default=None)
+            if best is not None and best[0] >= NEAR_DUP_THRESHOLD:
+                match = {"chunk_id": best[1], "vector_id": stored[best[1]][1]}
+            else:
+                earlier = max(
+                    ((similarity(signature, batch_signatures[p]), p) for p in batch.candidates(signature)), default=None
+                )
+                if earlier is not None and earlier[0] >= NEAR_DUP_THRESHOLD:
+                    match = {"position": earlier[1]}
+                else:
+                    batch.add(position, signature)
+                    batch_signatures[position] = signature
+        matches.append(match)
+    return matches
+
+async def stats(session: AsyncSession) -> dict:
+    indexed = (await session.execute(text(f"SELECT count(*) FROM {BAND_TABLE} WHERE band = 0"))).scalar()
+    return {
+        "enabled": NEAR_DUP_ENABLED,
+        "threshold": NEAR_DUP_THRESHOLD,
+        "indexed": indexed,
+    }
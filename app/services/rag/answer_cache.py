@@ -0,0 +1,216 @@
+"""
+Semantic answer cache for RAG queries, stored in Redis.
+
+An entry is reused when
+- the retrieved chunks are exactly the same set (entries are bucketed by a hash of the chunk ids), and
+- the cached query embedding has cosine similarity >= threshold with the new query embedding
+
+Redis keys:
+- answer_cache:bucket:{chunk_set_hash}  set of entry ids retrieved with that chunk set
+- answer_cache:entry:{entry_id}         hash with embedding, answer, sources, doc ids, bucket
+- answer_cache:doc:{doc_id}             set of entry ids that used the document, for invalidation
+- answer_cache:entries                  sorted set of entry ids by creation time, for size eviction
+"""
+
+import os
+import json
+import time
+import uuid
+import base64
+import hashlib
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))    # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10000))
+
+PREFIX = "answer_cache"
+
+def _chunk_set_hash(sources: List[Dict]) -> str:
+    chunk_ids = sorted(f"{s.get('doc_id')}:{s.get('chunk_index')}" for s in sources)
+    return hashlib.sha1("|".join(chunk_ids).encode("utf-8")).hexdigest()
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+def _decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+class AnswerCache:
+    def __init__(
+            self,
+            client: redis.Redis,
+            threshold: float = ANSWER_CACHE_THRESHOLD,
+            ttl: int = ANSWER_CACHE_TTL,
+            max_entries: int = ANSWER_CACHE_MAX_ENTRIES
+    ):
+        self.client = client
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # metrics (this process)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    async def lookup(self, query_embedding: np.ndarray, sources: List[Dict]) -> Optional[Tuple[str, List[Dict]]]:
+        """ Returns (answer, sources) of the closest cached entry above threshold, or None """
+        if not sources:
+            return None
+        try:
+            bucket_key = f"{PREFIX}:bucket:{_chunk_set_hash(sources)}"
+            entry_ids = list(await self.client.smembers(bucket_key))
+            if not entry_ids:
+                self.misses += 1
+                return None
+
+            pipe = self.client.pipeline(transaction=False)
+            for entry_id in entry_ids:
+                pipe.hmget(f"{PREFIX}:entry:{entry_id}", "embedding", "answer", "sources")
+            entries = await pipe.execute()
+
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+            best, best_score, expired = None, -1.0, []
+            for entry_id, (embedding, answer, cached_sources) in zip(entry_ids, entries):
+                if embedding is None:
+                    expired.append(entry_id)
+                    continue
+                vector = _decode_vector(embedding)
+                score = float(vector @ query / max(float(np.linalg.norm(vector)), 1e-12))
+                if score > best_score:
+                    best, best_score = (answer, json.loads(cached_sources)), score
+
+            if expired:
+                await self.client.srem(bucket_key, *expired)
+
+            if best is not None and best_score >= self.threshold:
+                self.hits += 1
+                print(f"  ✅ Answer cache hit (cosine {best_score:.3f})")
+                return best
+
+            self.misses += 1
+            return None
+
+        except Exception as e:
+            # cache trouble must never fail a query
+            self.errors += 1
+            print(f"❌ Answer cache lookup error: {e}")
+            return None
+
+    async def store(self, query_embedding: np.ndarray, sources: List[Dict], answer: str):
+        if not sources:
+            return
+        try:
+            entry_id = uuid.uuid4().hex
+            entry_key = f"{PREFIX}:entry:{entry_id}"
+            bucket_key = f"{PREFIX}:bucket:{_chunk_set_hash(sources)}"
+            doc_ids = sorted({s.get("doc_id") for s in sources if s.get("doc_id") is not None})
+
+            pipe = self.client.pipeline(transaction=True)
+            pipe.hset(entry_key, mapping={
+                "embedding": _encode_vector(query_embedding),
+                "answer": answer,
+                "sources": json.dumps(sources),
+                "doc_ids": json.dumps(doc_ids),
+                "bucket": bucket_key,
+            })
+            pipe.expire(entry_key, self.ttl)
+            pipe.sadd(bucket_key, entry_id)
+            pipe.expire(bucket_key, self.ttl)
+            for doc_id in doc_ids:
+                pipe.sadd(f"{PREFIX}:doc:{doc_id}", entry_id)
+                pipe.expire(f"{PREFIX}:doc:{doc_id}", self.ttl)
+            pipe.zadd(f"{PREFIX}:entries", {entry_id: time.time()})
+            await pipe.execute()
+            self.stores += 1
+
+            await self._evict()
+
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Answer cache store error: {e}")
+
+    async def _evict(self):
+        """ drop entries whose ttl ran out, then the oldest ones while over max_entries """
+        # scores are creation times so expired entries are always the oldest ones
+        expired = await self.client.zcount(f"{PREFIX}:entries", "-inf", time.time() - self.ttl)
+        total = await self.client.zcard(f"{PREFIX}:entries")
+        remove = max(expired, total - self.max_entries)
+        if remove <= 0:
+            return
+
+        entry_ids = [entry_id for entry_id, _ in await self.client.zpopmin(f"{PREFIX}:entries", remove)]
+        self.evictions += remove - expired
+        await self._delete_entries(entry_ids)
+
+    async def _delete_entries(self, entry_ids: List[str]):
+        pipe = self.client.pipeline(transaction=False)
+        for entry_id in entry_ids:
+            pipe.hmget(f"{PREFIX}:entry:{entry_id}", "bucket", "doc_ids")
+        entries = await pipe.execute()
+
+        pipe = self.client.pipeline(transaction=True)
+        for entry_id, (bucket_key, doc_ids) in zip(entry_ids, entries):
+            pipe.delete(f"{PREFIX}:entry:{entry_id}")
+            pipe.zrem(f"{PREFIX}:entries", entry_id)
+            if bucket_key:
+                pipe.srem(bucket_key, entry_id)
+            for doc_id in json.loads(doc_ids) if doc_ids else []:
+                pipe.srem(f"{PREFIX}:doc:{doc_id}", entry_id)
+        await pipe.execute()
+
+    async def invalidate_documents(self, doc_ids: List[int]):
+        """ Remove every cached answer built from these documents, call after (re-)ingesting them """
+        try:
+            doc_keys = [f"{PREFIX}:doc:{doc_id}" for doc_id in doc_ids]
+            entry_ids = await self.client.sunion(doc_keys) if doc_keys else set()
+            if entry_ids:
+                await self._delete_entries(list(entry_ids))
+            if doc_keys:
+                await self.client.delete(*doc_keys)
+            self.invalidations += len(entry_ids)
+            if entry_ids:
+                print(f"Invalidated {len(entry_ids)} cached answers for documents {doc_ids}")
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Answer cache invalidation error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+_answer_cache = None
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """ Shared cache, None unless ANSWER_CACHE_ENABLED=true """
+    global _answer_cache
+    if ANSWER_CACHE_ENABLED and _answer_cache is None:
+        client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            decode_responses=True
+        )
+        _answer_cache = AnswerCache(client)
+    return _answer_cache
@@ -5,11 +5,13 @@ from typing import Dict, Tuple, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models import Booking
-from app.services.rag.llm_services import LLMServices
+from app.services.rag.llm_services import get_llm_service
 
 class BookingService:
-    def __init__(self):
-        self.llm_service = LLMServices()
+    @property
+    def llm_service(self):
+        # shared service, looked up on every use since close_llm_service() drops it
+        return get_llm_service()
 
     async def extract_booking_info(self, user_message: str) -> Dict[str, Optional[str]]:
         """
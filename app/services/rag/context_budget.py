@@ -0,0 +1,98 @@
+"""
+Token budget for the RAG prompt.
+
+- tokens are counted with the LLM's own tokenizer (huggingface `tokenizers`), len / 4 if it can't be loaded
+- the tokenizer is loaded at startup, fit_context runs in a thread: both block
+- the most recent chat turns are kept within HISTORY_MAX_TOKENS, older turns are left for summarization
+- excerpts are added best score first until CONTEXT_MAX_TOKENS is reached, the rest are dropped
+"""
+
+import os
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+
+from app.services.shared.token_counter import TokenCounter, MESSAGE_OVERHEAD
+
+load_dotenv()
+
+# huggingface repo with a tokenizer.json matching LLM_MODEL
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "unsloth/Llama-3.3-70B-Instruct")
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 6000))    # whole prompt, without the answer
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", 1500))    # recent turns kept verbatim
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", 200))
+
+def _turns(history: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+    """ group messages into turns, a turn starts at every user message """
+    turns = []
+    for message in history:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def fit_context(
+        counter: TokenCounter,
+        fixed_messages: List[Dict[str, str]],
+        results: List[dict],
+        history: List[Dict[str, str]],
+        max_tokens: int = CONTEXT_MAX_TOKENS,
+        history_max_tokens: int = HISTORY_MAX_TOKENS
+) -> Dict:
+    """
+    - fixed_messages: system prompt, summary & question, always sent
+    - returns kept results (in rank order), kept history, and the older history messages that didn't fit
+    - the best excerpt is always kept so the model has something to answer from
+    """
+    used = counter.count_messages(fixed_messages)
+
+    # newest turns first, a turn is kept or dropped as a whole
+    turns = _turns(history)
+    history_tokens, kept_turns = 0, 0
+    for turn in reversed(turns):
+        tokens = counter.count_messages(turn)
+        if history_tokens + tokens > min(history_max_tokens, max_tokens - used):
+            break
+        history_tokens += tokens
+        kept_turns += 1
+    split = len(turns) - kept_turns
+    overflow = [m for turn in turns[:split] for m in turn]
+    kept_history = [m for turn in turns[split:] for m in turn]
+    used += history_tokens
+
+    kept = set()
+    for i in sorted(range(len(results)), key=lambda i: results[i]["score"], reverse=True):
+        tokens = counter.count(results[i]["metadata"].get("text", "")) + MESSAGE_OVERHEAD
+        if kept and used + tokens > max_tokens:
+            continue
+        kept.add(i)
+        used += tokens
+
+    return {
+        "results": [r for i, r in enumerate(results) if i in kept],
+        "history": kept_history,
+        "overflow": overflow,
+        "dropped_excerpts": len(results) - len(kept),
+    }
+
+def summary_messages(previous_summary: Optional[str], turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """ prompt that folds older turns into the rolling summary """
+    conversation = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    return [
+        {
+            "role": "system",
+            "content": f"You summarize conversations. Keep facts, names, numbers and open questions. "
+                       f"Answer with the summary only, at most {SUMMARY_MAX_WORDS} words."
+        },
+        {
+            "role": "user",
+            "content": f"Summary so far:\n{previous_summary or '(none)'}\n\nNew messages:\n{conversation}\n\nUpdated summary:"
+        },
+    ]
+
+_token_counter = None
+
+def get_token_counter() -> TokenCounter:
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter(LLM_TOKENIZER)
+    return _token_counter
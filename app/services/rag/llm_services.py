@@ -1,14 +1,115 @@
 import os
-from groq import Groq
-from typing import List, Dict
+import json
+import time
+import random
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from typing import List, Dict, AsyncIterator, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# groq exposes an openai compatible api, we talk to it directly with one shared async http client
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))    # llm calls in flight at once
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))                 # seconds, per attempt
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))      # seconds, doubled every retry
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 8))
+
+# rate limited or provider side errors are worth another try, 4xx otherwise means our request is wrong
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
 class LLMServices:
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        self.model = "llama-3.3-70b-versatile"
+    def __init__(
+            self,
+            api_key: Optional[str] = None,
+            base_url: str = LLM_BASE_URL,
+            model: str = LLM_MODEL,
+            max_concurrency: int = LLM_MAX_CONCURRENCY,
+            timeout: float = LLM_TIMEOUT,
+            max_retries: int = LLM_MAX_RETRIES
+    ):
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self.base_url = base_url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        # http client is created lazily inside the running event loop
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # metrics
+        self.in_flight = 0
+        self.waiting = 0
+        self.total_requests = 0
+        self.total_retries = 0
+        self.total_failures = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+            )
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self):
+        """ waits for a free concurrency slot, tracks queue wait & in flight count """
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        wait = time.perf_counter() - start
+        self.total_queue_wait += wait
+        self.max_queue_wait = max(self.max_queue_wait, wait)
+        self.total_requests += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        # honour Retry-After on 429 when the provider sends it, otherwise exponential backoff with full jitter
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    async def _retry_wait(self, attempt: int, reason: str, response: Optional[httpx.Response] = None):
+        delay = self._backoff(attempt, response)
+        self.total_retries += 1
+        print(f"LLM {reason}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    def _payload(self, messages: List[Dict[str, str]], temperature: float, stream: bool = False) -> dict:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 1000,
+            "stream": stream,
+        }
 
     async def generate_response(self, messages:  List[Dict[str,str]], temperature: float = 0.7) -> str:
         """
@@ -16,13 +117,102 @@ class LLMServices:
         temperature : 0 - 1 -> towards 0 means more accurate + predictable, towards 1 means more creative + varied
         """
         try:
-            response = self.client.chat.completions.create(
-                model = self.model,
-                messages = messages,
-                temperature = temperature,
-                max_tokens = 1000
-            )
-            return response.choices[0].message.content
-        
+            async with self._slot():
+                client = self._get_client()
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        response = await client.post("/chat/completions", json=self._payload(messages, temperature))
+                    except httpx.TransportError as e:
+                        if attempt == self.max_retries:
+                            raise
+                        await self._retry_wait(attempt, type(e).__name__)
+                        continue
+
+                    if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                        await self._retry_wait(attempt, f"HTTP {response.status_code}", response)
+                        continue
+
+                    response.raise_for_status()
+                    return response.json()["choices"][0]["message"]["content"]
+
+        except Exception as e:
+            self.total_failures += 1
+            raise Exception(f"LLM generation failed {str(e)}")
+
+    async def stream_response(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> AsyncIterator[str]:
+        """
+        Same as generate_response but yields the answer token by token
+        Retries only happen before the first token, a stream can't be resumed midway
+        """
+        try:
+            async with self._slot():
+                client = self._get_client()
+                yielded = False
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        async with client.stream(
+                            "POST", "/chat/completions", json=self._payload(messages, temperature, stream=True)
+                        ) as response:
+                            if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                                await response.aread()
+                                await self._retry_wait(attempt, f"HTTP {response.status_code}", response)
+                                continue
+                            if response.is_error:
+                                await response.aread()
+                                response.raise_for_status()
+
+                            # openai style sse: "data: {...}" lines, ends with "data: [DONE]"
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data: "):
+                                    continue
+                                data = line[len("data: "):].strip()
+                                if data == "[DONE]":
+                                    return
+                                chunk = json.loads(data)
+                                choices = chunk.get("choices") or []
+                                delta = choices[0].get("delta", {}).get("content") if choices else None
+                                if delta:
+                                    yielded = True
+                                    yield delta
+                            return
+                    except httpx.TransportError as e:
+                        # connect, read timeouts, dropped connections: safe to retry until a token went out
+                        if yielded or attempt == self.max_retries:
+                            raise
+                        await self._retry_wait(attempt, type(e).__name__)
+
         except Exception as e:
-            raise Exception(f"LLM generation failed {str(e)}")
\ No newline at end of file
+            self.total_failures += 1
+            raise Exception(f"LLM streaming failed {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "total_requests": self.total_requests,
+            "total_retries": self.total_retries,
+            "total_failures": self.total_failures,
+            "avg_queue_wait_ms": (self.total_queue_wait / self.total_requests * 1000) if self.total_requests else 0,
+            "max_queue_wait_ms": self.max_queue_wait * 1000,
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+_llm_service = None
+
+def get_llm_service() -> LLMServices:
+    """ One LLMServices for the whole app so rag & booking share the connection pool & concurrency limit """
+    global _llm_service
+    if _llm_service is None:
+        _llm_service = LLMServices()
+    return _llm_service
+
+async def close_llm_service():
+    global _llm_service
+    if _llm_service is not None:
+        await _llm_service.close()
+        _llm_service = None
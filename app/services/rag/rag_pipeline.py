@@ -1,28 +1,296 @@
-from typing import List, Dict, Tuple
+import os
+import time
+import asyncio
+from typing import List, Dict, Tuple, Optional, AsyncIterator
+import numpy as np
 from app.services.shared.embeddings import get_embeddings
-from app.services.shared.vector_store import QdrantStore
-from app.services.rag.llm_services import LLMServices
-from app.services.rag.redis_service import RedisService
+from app.services.shared.vector_store import get_vector_store
+from app.services.shared.keyword_index import keyword_search, reciprocal_rank_fusion
+from app.services.rag.llm_services import get_llm_service
+from app.services.rag.session_store import get_session_store
+from app.services.rag.answer_cache import get_answer_cache
+from app.services.rag.stages import StageGraph
+from app.services.rag.context_budget import get_token_counter, fit_context, summary_messages
 
 COLLECTION_NAME = 'documents'
 
+# dense = vector search only, hybrid = vector + bm25 keyword search merged with reciprocal rank fusion
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# each search in hybrid mode fetches top_k * factor candidates before fusing down to top_k
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", 3))
+
+# per stage timeouts in seconds, "stage=seconds,..." e.g. RAG_STAGE_TIMEOUTS=retrieve=10,history=3
+STAGE_TIMEOUTS = {
+    name: float(seconds)
+    for name, seconds in (
+        item.split("=") for item in os.getenv("RAG_STAGE_TIMEOUTS", "retrieve=15,history=5,answer_cache=2").split(",") if item
+    )
+}
+
+# llm calls in flight for one /query-batch run, kept under LLM_MAX_CONCURRENCY so chat traffic still gets slots
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 4))
+# keyword searches in flight for a hybrid batch, each one holds a sqlite connection
+BATCH_KEYWORD_CONCURRENCY = int(os.getenv("BATCH_KEYWORD_CONCURRENCY", 4))
+# queries per embedding call & vector search request, the numpy store scores BATCH_RETRIEVE_SIZE x all vectors at once
+BATCH_RETRIEVE_SIZE = int(os.getenv("BATCH_RETRIEVE_SIZE", 64))
+# queries accepted by one /query-batch call
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 5000))
+
+# history compaction waits until at least this many messages fell out of the budget, one summary call covers them all
+COMPACT_MIN_MESSAGES = int(os.getenv("COMPACT_MIN_MESSAGES", 4))
+
+SYSTEM_PROMPT = """You are a helpful AI assistant that answers questions based on provided document excerpts.
+
+Rules:
+- Answer based ONLY on the provided context
+- If the context doesn't contain the answer, say "I don't have enough information to answer that"
+- Be concise and clear
+- Cite which excerpt number [1], [2], etc. you used"""
+
 class RAGPipeline:
     def __init__(self):
         print("🚀 Initializing RAG Pipeline...")
         
         print("  📊 Initializing Vector Store...")
-        self.vector_store = QdrantStore(url='http://localhost:6333')
+        get_vector_store()
         
-        print("  💾 Initializing Redis Service...")
-        self.redis_service = RedisService()
+        print("  💾 Initializing Session Store...")
+        get_session_store()
         
         print("  🤖 Initializing LLM Service...")
-        self.llm_service = LLMServices()
+        get_llm_service()
+
+        # opt-in semantic answer cache, None when ANSWER_CACHE_ENABLED is off
+        self.answer_cache = get_answer_cache()
+
+        self.token_counter = get_token_counter()
+        self._compacting = set()    # session ids with a summary in progress
+        self._background = set()    # keeps compaction tasks referenced until done
+
+        self.graph = self._build_graph()
         
         print("✅ RAG Pipeline Ready")
 
-    async def query(self, user_query: str, session_id: str, top_k = 5) -> Tuple[str, List[dict]]:
-        """Complete RAG Pipeline"""
+    # the shared services are looked up on every use, not kept on the instance,
+    # the close_*() functions called on shutdown drop them & the next use creates new ones
+    @property
+    def vector_store(self):
+        return get_vector_store()
+
+    @property
+    def session_store(self):
+        return get_session_store()
+
+    @property
+    def llm_service(self):
+        return get_llm_service()
+
+    async def _dense_search(self, user_query: str, top_k: int) -> List[dict]:
+        query_embedding = await get_embeddings([user_query])
+        print(f"  ✅ Embedding shape: {query_embedding.shape}")
+        return await self.vector_store.query_vectors(
+            namespace=COLLECTION_NAME,
+            vector=query_embedding[0],
+            top_k=top_k
+        )
+
+    async def retrieve(self, user_query: str, top_k: int = 5, retrieval_mode: Optional[str] = None) -> List[dict]:
+        """
+        - dense: embed query & search the vector store
+        - hybrid: dense & keyword search run concurrently, merged with reciprocal rank fusion
+        """
+        retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+
+        if retrieval_mode == "dense":
+            return await self._dense_search(user_query, top_k)
+
+        if retrieval_mode == "hybrid":
+            candidates = top_k * HYBRID_CANDIDATE_FACTOR
+            dense, keyword = await asyncio.gather(
+                self._dense_search(user_query, candidates),
+                keyword_search(user_query, candidates)
+            )
+            print(f"  ✅ Dense: {len(dense)}, Keyword: {len(keyword)} candidates")
+            return reciprocal_rank_fusion([dense, keyword], top_k=top_k)
+
+        raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+
+    async def retrieve_batch(self, user_queries: List[str], top_k: int = 5, retrieval_mode: Optional[str] = None) -> Tuple[np.ndarray, List[List[dict]]]:
+        """
+        - queries embedded & searched BATCH_RETRIEVE_SIZE at a time, one get_embeddings call & one batched
+          vector store request each, so memory & request size don't grow with the batch
+        - hybrid adds a keyword search per query, fused the same way as retrieve
+        - returns (query embeddings, results per query)
+        """
+        retrieval_mode = retrieval_mode or RETRIEVAL_MODE
+        if retrieval_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+
+        candidates = top_k * HYBRID_CANDIDATE_FACTOR if retrieval_mode == "hybrid" else top_k
+        parts, dense = [], []
+        for start in range(0, len(user_queries), BATCH_RETRIEVE_SIZE):
+            part = await get_embeddings(user_queries[start:start + BATCH_RETRIEVE_SIZE])
+            dense.extend(await self.vector_store.query_batch(COLLECTION_NAME, part, candidates))
+            parts.append(part)
+        embeddings = np.concatenate(parts) if parts else np.empty((0, 0), dtype=np.float32)
+        if retrieval_mode == "dense":
+            return embeddings, dense
+
+        semaphore = asyncio.Semaphore(BATCH_KEYWORD_CONCURRENCY)
+        async def _keyword(user_query: str) -> List[dict]:
+            async with semaphore:
+                return await keyword_search(user_query, candidates)
+
+        keyword = await asyncio.gather(*[_keyword(q) for q in user_queries])
+        return embeddings, [reciprocal_rank_fusion([d, k], top_k=top_k) for d, k in zip(dense, keyword)]
+
+    def _build_graph(self) -> StageGraph:
+        """
+        - retrieve, history & summary run concurrently
+        - budget trims history & excerpts once they're all in
+        - prompt, sources & answer cache lookup run concurrently
+        """
+        return (
+            StageGraph()
+            .add("retrieve", self._stage_retrieve, deps=("user_query", "top_k", "retrieval_mode"),
+                 timeout=STAGE_TIMEOUTS.get("retrieve"))
+            .add("history", self._stage_history, deps=("session_id",),
+                 timeout=STAGE_TIMEOUTS.get("history"))
+            # without the summary the answer only misses older context
+            .add("summary", self._stage_summary, deps=("session_id",),
+                 timeout=STAGE_TIMEOUTS.get("history"), fallback="")
+            .add("budget", self._stage_budget, deps=("user_query", "retrieve", "history", "summary"))
+            .add("sources", self._stage_sources, deps=("budget",))
+            .add("prompt", self._stage_prompt, deps=("budget", "user_query"))
+            # a cache failure only means a miss
+            .add("answer_cache", self._stage_answer_cache, deps=("user_query", "sources", "history"),
+                 timeout=STAGE_TIMEOUTS.get("answer_cache"), fallback=(None, None))
+        )
+
+    async def _stage_retrieve(self, user_query: str, top_k: int, retrieval_mode: Optional[str]) -> List[dict]:
+        # Step 1 & 2: Embed query & search
+        print(f"Step 1-2/6: 🔍 Retrieving chunks ({retrieval_mode or RETRIEVAL_MODE}, top_k={top_k})...")
+        search_result = await self.retrieve(user_query, top_k, retrieval_mode)
+        print(f"  ✅ Found {len(search_result)} relevant chunks")
+        return search_result
+
+    async def _stage_history(self, session_id: str) -> List[Dict[str, str]]:
+        # Step 4: Get chat history
+        print(f"Step 4/6: 💾 Fetching chat history from session store...")
+        return await self.session_store.get_chat_history(session_id)
+
+    async def _stage_summary(self, session_id: str) -> str:
+        return await self.session_store.get_summary(session_id)
+
+    def _system_message(self, summary: str) -> Dict[str, str]:
+        content = SYSTEM_PROMPT
+        if summary:
+            content += f"\n\nSummary of the earlier conversation:\n{summary}"
+        return {"role": "system", "content": content}
+
+    def _user_message(self, results: List[dict], user_query: str) -> Dict[str, str]:
+        # Step 3: Build context
+        excerpts = "".join(f"[{i}] {result['metadata'].get('text', '')}\n\n" for i, result in enumerate(results, 1))
+        return {
+            "role": "user",
+            "content": f"Based on the following document excerpts:\n\n{excerpts}\n\nQuestion: {user_query}"
+        }
+
+    async def _stage_budget(self, user_query: str, retrieve: List[dict], history: List[Dict[str, str]], summary: str) -> Dict:
+        # tokenizing every excerpt is cpu bound, off the event loop
+        budget = await asyncio.to_thread(
+            fit_context,
+            self.token_counter,
+            fixed_messages=[self._system_message(summary), self._user_message([], user_query)],
+            results=retrieve,
+            history=history
+        )
+        budget["summary"] = summary
+        if budget["dropped_excerpts"] or budget["overflow"]:
+            print(f"  ✂️ Budget dropped {budget['dropped_excerpts']} excerpts, {len(budget['overflow'])} history messages")
+        return budget
+
+    async def _stage_sources(self, budget: Dict) -> List[dict]:
+        sources = []
+        for result in budget["results"]:
+            source = {
+                "doc_id": result['metadata'].get('doc_id'),
+                "chunk_index": result['metadata'].get('chunk_index'),
+                "score": result['score']
+            }
+            # near duplicate chunks collapsed into this one at ingestion (NEAR_DUP_ENABLED)
+            if result['metadata'].get('sources'):
+                source["also_in"] = result['metadata']['sources']
+            sources.append(source)
+        return sources
+
+    async def _stage_prompt(self, budget: Dict, user_query: str) -> List[Dict[str, str]]:
+        # Step 5: Build LLM prompt
+        messages = [self._system_message(budget["summary"])]
+        messages.extend(budget["history"])
+        messages.append(self._user_message(budget["results"], user_query))
+        print(f"  ✅ Prompt has {len(messages)} messages, {len(budget['results'])} excerpts")
+        return messages
+
+    async def _stage_answer_cache(self, user_query: str, sources: List[dict], history: List[Dict[str, str]]):
+        """
+        Returns (query_embedding, cached (answer, sources) or None)
+        Only first turns use the cache, a follow up question depends on the conversation before it
+        """
+        if self.answer_cache is None or history:
+            return None, None
+        # the query was just embedded for retrieval, so this is an embedding cache hit
+        query_embedding = (await get_embeddings([user_query]))[0]
+        return query_embedding, await self.answer_cache.lookup(query_embedding, sources)
+
+    async def _prepare(self, user_query: str, session_id: str, top_k: int, retrieval_mode: Optional[str]) -> Dict:
+        """Runs the stage graph shared by query and query_stream, everything up to the LLM call"""
+        results = await self.graph.run(
+            user_query=user_query,
+            session_id=session_id,
+            top_k=top_k,
+            retrieval_mode=retrieval_mode
+        )
+        timings = ", ".join(f"{name}={ms:.0f}" for name, ms in results["_timings"].items())
+        print(f"  ⏱️ Stage timings (ms): {timings}")
+        results["prompt_tokens"] = await asyncio.to_thread(self.token_counter.count_messages, results["prompt"])
+        print(f"  🔢 Prompt tokens: {results['prompt_tokens']}")
+        return results
+
+    def _schedule_compaction(self, session_id: str, budget: Dict):
+        """ summarize history that no longer fits the budget in the background, one run per session at a time """
+        overflow = budget["overflow"]
+        if len(overflow) < COMPACT_MIN_MESSAGES or session_id in self._compacting:
+            return
+        self._compacting.add(session_id)
+        task = asyncio.create_task(self._compact_history(session_id, overflow, budget["summary"]))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _compact_history(self, session_id: str, overflow: List[Dict[str, str]], previous_summary: str):
+        try:
+            summary = await self.llm_service.generate_response(
+                summary_messages(previous_summary, overflow),
+                temperature=0.2
+            )
+            await self.session_store.compact_history(session_id, overflow, summary.strip())
+        except Exception as e:
+            print(f"❌ History compaction failed for session {session_id}: {e}")
+        finally:
+            self._compacting.discard(session_id)
+
+    async def _save_turn(self, session_id: str, user_query: str, answer: str):
+        print("\n💾 Saving conversation to session store...")
+        await self.session_store.add_message(
+            session_id=session_id,
+            message=[
+                {"role": "user", "content": user_query},
+                {"role": "assistant", "content": answer},
+            ]
+        )
+
+    async def query(self, user_query: str, session_id: str, top_k = 5, retrieval_mode: Optional[str] = None) -> Tuple[str, List[dict], int]:
+        """Complete RAG Pipeline, returns answer, sources & prompt tokens (0 when answered from cache)"""
         
         print(f"\n{'='*60}")
         print(f"📝 NEW QUERY: {user_query}")
@@ -30,79 +298,148 @@ class RAGPipeline:
         print(f"{'='*60}\n")
         
         try:
-            # Step 1: Embed query
-            print("Step 1/6: 🔢 Generating embeddings...")
-            query_embedding = await get_embeddings([user_query])
-            print(f"  ✅ Embedding shape: {len(query_embedding[0])}")
-
-            # Step 2: Search Qdrant
-            print(f"\nStep 2/6: 🔍 Searching Qdrant (top_k={top_k})...")
-            search_result = await self.vector_store.query_vectors(
-                namespace=COLLECTION_NAME,
-                vector=query_embedding[0],
-                top_k=top_k
-            )
-            print(f"  ✅ Found {len(search_result)} relevant chunks")
-            
-            # Step 3: Build context
-            print("\nStep 3/6: 📚 Building context...")
-            context = "Based on the following document excerpts:\n\n"
-            sources = []
-
-            for i, result in enumerate(search_result, 1):
-                metadata = result['metadata']
-                chunk_text = metadata.get('text', '')
-                context += f"[{i}] {chunk_text}\n\n"
-                
-                sources.append({
-                    "doc_id": metadata.get('doc_id'),
-                    "chunk_index": metadata.get('chunk_index'),
-                    "score": result['score']
-                })
-            print(f"  ✅ Context built with {len(sources)} sources")
-
-            # Step 4: Get chat history
-            print(f"\nStep 4/6: 💾 Fetching chat history from Redis...")
-            chat_history = await self.redis_service.get_chat_history(session_id)
-
-            # Step 5: Build LLM prompt
-            print("\nStep 5/6: 🤖 Preparing LLM prompt...")
-            system_prompt = """You are a helpful AI assistant that answers questions based on provided document excerpts.
+            prepared = await self._prepare(user_query, session_id, top_k, retrieval_mode)
+            messages, sources = prepared["prompt"], prepared["sources"]
 
-Rules:
-- Answer based ONLY on the provided context
-- If the context doesn't contain the answer, say "I don't have enough information to answer that"
-- Be concise and clear
-- Cite which excerpt number [1], [2], etc. you used"""
+            prompt_tokens = prepared["prompt_tokens"]
 
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(chat_history)
-            messages.append({
-                "role": "user",
-                "content": f"{context}\n\nQuestion: {user_query}"
-            })
-            print(f"  ✅ Prompt has {len(messages)} messages")
-
-            # Step 6: Generate response
-            print("\nStep 6/6: 🧠 Calling LLM...")
-            answer = await self.llm_service.generate_response(messages)
-            print(f"  ✅ Got answer: {answer[:100]}...")
-
-            # Step 7: Save to Redis
-            print("\n💾 Saving conversation to Redis...")
-            await self.redis_service.add_message(
-                session_id=session_id,
-                message=[
-                    {"role": "user", "content": user_query},
-                    {"role": "assistant", "content": answer},
-                ]
-            )
+            query_embedding, cached = prepared["answer_cache"]
+            if cached is not None:
+                answer, sources = cached
+                prompt_tokens = 0
+            else:
+                # Step 6: Generate response
+                print("\nStep 6/6: 🧠 Calling LLM...")
+                answer = await self.llm_service.generate_response(messages)
+                print(f"  ✅ Got answer: {answer[:100]}...")
+
+                if query_embedding is not None:
+                    await self.answer_cache.store(query_embedding, sources, answer)
+
+            # Step 7: Save to session store
+            await self._save_turn(session_id, user_query, answer)
+            self._schedule_compaction(session_id, prepared["budget"])
 
             print(f"\n✅ QUERY COMPLETED SUCCESSFULLY\n{'='*60}\n")
-            return answer, sources
+            return answer, sources, prompt_tokens
             
         except Exception as e:
             print(f"\n❌ ERROR in RAG Pipeline: {type(e).__name__}: {e}")
             import traceback
             traceback.print_exc()
-            raise
\ No newline at end of file
+            raise
+
+    async def query_stream(self, user_query: str, session_id: str, top_k = 5, retrieval_mode: Optional[str] = None) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        - streaming RAG pipeline, yields (event, data)
+        - ("sources", ...) as soon as retrieval is done, then ("token", ...) per LLM delta, then ("done", ...)
+        - the turn is saved to the session store only when the stream finished, a dropped client saves nothing
+        """
+        print(f"\n{'='*60}")
+        print(f"📝 NEW STREAMING QUERY: {user_query}")
+        print(f"🔑 Session ID: {session_id}")
+        print(f"{'='*60}\n")
+
+        prepared = await self._prepare(user_query, session_id, top_k, retrieval_mode)
+        messages, sources = prepared["prompt"], prepared["sources"]
+
+        prompt_tokens = prepared["prompt_tokens"]
+
+        query_embedding, cached = prepared["answer_cache"]
+        if cached is not None:
+            answer, sources = cached
+            prompt_tokens = 0
+            yield "sources", {"sources": sources, "session_id": session_id}
+            yield "token", {"text": answer}
+        else:
+            yield "sources", {"sources": sources, "session_id": session_id}
+
+            print("\nStep 6/6: 🧠 Streaming LLM...")
+            parts = []
+            async for token in self.llm_service.stream_response(messages):
+                parts.append(token)
+                yield "token", {"text": token}
+
+            answer = "".join(parts)
+            print(f"  ✅ Streamed answer: {answer[:100]}...")
+
+            if query_embedding is not None:
+                await self.answer_cache.store(query_embedding, sources, answer)
+        await self._save_turn(session_id, user_query, answer)
+        self._schedule_compaction(session_id, prepared["budget"])
+
+        print(f"\n✅ STREAMING QUERY COMPLETED\n{'='*60}\n")
+        yield "done", {"session_id": session_id, "prompt_tokens": prompt_tokens}
+
+    async def _answer_batch_item(
+            self,
+            index: int,
+            user_query: str,
+            query_embedding: np.ndarray,
+            results: List[dict],
+            semaphore: asyncio.Semaphore
+    ) -> dict:
+        """ one /query-batch answer, no chat history, errors are reported per query """
+        try:
+            budget = await asyncio.to_thread(
+                fit_context,
+                self.token_counter,
+                fixed_messages=[self._system_message(""), self._user_message([], user_query)],
+                results=results,
+                history=[]
+            )
+            budget["summary"] = ""
+            sources = await self._stage_sources(budget)
+
+            cached = await self.answer_cache.lookup(query_embedding, sources) if self.answer_cache else None
+            if cached is not None:
+                answer, sources = cached
+                prompt_tokens = 0
+            else:
+                messages = [self._system_message(""), self._user_message(budget["results"], user_query)]
+                prompt_tokens = await asyncio.to_thread(self.token_counter.count_messages, messages)
+                async with semaphore:
+                    answer = await self.llm_service.generate_response(messages)
+                if self.answer_cache is not None:
+                    await self.answer_cache.store(query_embedding, sources, answer)
+
+            return {"index": index, "query": user_query, "answer": answer, "sources": sources, "prompt_tokens": prompt_tokens}
+
+        except Exception as e:
+            print(f"❌ Batch query {index} failed: {type(e).__name__}: {e}")
+            return {"index": index, "query": user_query, "error": str(e)}
+
+    async def query_batch(
+            self,
+            user_queries: List[str],
+            top_k: int = 5,
+            retrieval_mode: Optional[str] = None,
+            concurrency: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """
+        - for evaluation sets & bulk workloads, stateless (no redis history)
+        - embedding & vector search are batched, BATCH_RETRIEVE_SIZE queries at a time
+        - LLM calls run with bounded concurrency, results are yielded as each one completes (not in input order)
+        """
+        print(f"\n{'='*60}")
+        print(f"📚 BATCH QUERY: {len(user_queries)} queries")
+        print(f"{'='*60}\n")
+
+        start = time.perf_counter()
+        embeddings, results = await self.retrieve_batch(user_queries, top_k, retrieval_mode)
+        print(f"  ✅ Retrieved chunks for {len(user_queries)} queries in {time.perf_counter() - start:.2f}s")
+
+        semaphore = asyncio.Semaphore(concurrency or BATCH_LLM_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(self._answer_batch_item(i, q, embedding, r, semaphore))
+            for i, (q, embedding, r) in enumerate(zip(user_queries, embeddings, results))
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # client went away, nothing left to send the answers to
+            for task in tasks:
+                task.cancel()
+
+        print(f"\n✅ BATCH QUERY COMPLETED in {time.perf_counter() - start:.2f}s\n{'='*60}\n")
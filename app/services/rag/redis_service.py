@@ -1,13 +1,22 @@
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import os
 from dotenv import load_dotenv
+from app.services.rag.session_store import SessionStore, HISTORY_MAX_MESSAGES
 
 load_dotenv()
 
-class RedisService:
+# chat:{session_id} is a redis list, one json message per item, oldest first, LTRIMed to HISTORY_MAX_MESSAGES
+# older versions stored the whole history as one json string, those keys are migrated on first touch
+
+def _is_wrong_type(e: ResponseError) -> bool:
+    # inside a pipeline the message is prefixed with the failing command
+    return "WRONGTYPE" in str(e)
+
+class RedisService(SessionStore):
     def __init__(self):
         host=os.getenv("REDIS_HOST", "localhost")
         port=int(os.getenv("REDIS_PORT", 6379))
@@ -20,11 +29,20 @@ class RedisService:
             decode_responses=True
         )
 
-    async def get_chat_history(self, session_id: str) -> List[Dict[str, str]]:
+    async def get_chat_history(self, session_id: str, last_n: Optional[int] = None) -> List[Dict[str, str]]:
+        """ last_n: only the newest n messages, None for the whole history """
         print(f"📖 Getting history for session: {session_id}")
+        key = f"chat:{session_id}"
+        start = -last_n if last_n else 0
         try:
-            history = await self.client.get(f"chat:{session_id}")
-            result = json.loads(history) if history else []
+            try:
+                items = await self.client.lrange(key, start, -1)
+            except ResponseError as e:
+                if not _is_wrong_type(e):
+                    raise
+                await self._migrate_key(key)
+                items = await self.client.lrange(key, start, -1)
+            result = [json.loads(item) for item in items]
             print(f"✅ Retrieved {len(result)} messages")
             return result
         except Exception as e:
@@ -32,23 +50,97 @@ class RedisService:
             raise
 
     async def add_message(self, session_id: str, message: List[Dict[str, str]], ttl: int = 3600):
-        """ Add Multiple Msg to Chat History, ttl = time to live"""
+        """
+        - Add Multiple Msg to Chat History, ttl = time to live
+        - RPUSH + LTRIM + EXPIRE in one MULTI, so concurrent turns of a session never overwrite each other
+        """
         print(f"💾 Saving {len(message)} messages for session: {session_id}")  # ✅ Debug
+        if not message:
+            return
+        key = f"chat:{session_id}"
         try:
-            history = await self.get_chat_history(session_id)
-            history.extend(message)
-            await self.client.set(
-                f"chat:{session_id}",
-                json.dumps(history),
-                ex=ttl
-            )
+            try:
+                await self._append(session_id, message, ttl)
+            except ResponseError as e:
+                if not _is_wrong_type(e):
+                    raise
+                await self._migrate_key(key)
+                await self._append(session_id, message, ttl)
             print("✅ Messages saved to Redis")
         except Exception as e:
             print(f"❌ Redis add_message error: {e}")
             raise
 
+    async def _append(self, session_id: str, message: List[Dict[str, str]], ttl: int):
+        key = f"chat:{session_id}"
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, *[json.dumps(m) for m in message])
+        pipe.ltrim(key, -HISTORY_MAX_MESSAGES, -1)
+        pipe.expire(key, ttl)
+        # the summary lives as long as the history it belongs to
+        pipe.expire(f"chat_summary:{session_id}", ttl)
+        await pipe.execute()
+
+    async def _migrate_key(self, key: str) -> bool:
+        """ legacy json string -> list, keeps the remaining ttl, False if the key isn't a legacy one """
+        async def _migrate(pipe):
+            if await pipe.type(key) != "string":
+                pipe.multi()
+                return False
+            history = json.loads(await pipe.get(key) or "[]")
+            ttl_ms = await pipe.pttl(key)
+            pipe.multi()
+            pipe.delete(key)
+            if history:
+                pipe.rpush(key, *[json.dumps(m) for m in history[-HISTORY_MAX_MESSAGES:]])
+                if ttl_ms > 0:
+                    pipe.pexpire(key, ttl_ms)
+            return True
+
+        migrated = await self.client.transaction(_migrate, key, value_from_callable=True)
+        if migrated:
+            print(f"🔁 Migrated {key} to a list")
+        return migrated
+
+    async def migrate_legacy_sessions(self) -> int:
+        """ convert every legacy chat:* string key, safe to run while the app is serving """
+        migrated = 0
+        async for key in self.client.scan_iter(match="chat:*", _type="string", count=500):
+            if await self._migrate_key(key):
+                migrated += 1
+        return migrated
+
+    async def get_summary(self, session_id: str) -> str:
+        """ Rolling summary of turns already compacted out of the history """
+        return await self.client.get(f"chat_summary:{session_id}") or ""
+
+    async def compact_history(self, session_id: str, summarized: List[Dict[str, str]], summary: str, ttl: int = 3600) -> bool:
+        """
+        - replace the oldest messages with the summary that covers them
+        - runs in a WATCH transaction, skipped (False) if the history doesn't start with those messages anymore
+        """
+        key = f"chat:{session_id}"
+
+        async def _compact(pipe):
+            head = [json.loads(item) for item in await pipe.lrange(key, 0, len(summarized) - 1)]
+            if head != summarized:
+                pipe.multi()
+                return False
+            pipe.multi()
+            pipe.ltrim(key, len(summarized), -1)
+            pipe.set(f"chat_summary:{session_id}", summary, ex=ttl)
+            return True
+
+        compacted = await self.client.transaction(_compact, key, value_from_callable=True)
+        if compacted:
+            print(f"🗜️ Compacted {len(summarized)} messages into summary for session: {session_id}")
+        return compacted
+
     async def clear_session(self, session_id: str):
-        await self.client.delete(f"chat:{session_id}")
+        await self.client.delete(f"chat:{session_id}", f"chat_summary:{session_id}")
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
 
     async def close(self):
-        await self.client.aclose()
\ No newline at end of file
+        await self.client.aclose()
@@ -0,0 +1,269 @@
+"""
+Where chat histories & rolling summaries live.
+
+- redis: RedisService, shared by every process (default)
+- memory: in this process only, bounded by a byte budget with per session ttl & LRU eviction,
+  no redis needed (single process deployments, tests)
+- redis-near-cache: redis with a write-through local copy of hot sessions in front of it,
+  reads of a cached session skip the network. Assumes a session sticks to one process,
+  SESSION_NEAR_CACHE_TTL bounds how stale a copy can get when it doesn't
+"""
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SESSION_STORE = os.getenv("SESSION_STORE", "redis")    # redis / memory / redis-near-cache
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", 64 * 1024 * 1024))
+SESSION_NEAR_CACHE_TTL = int(os.getenv("SESSION_NEAR_CACHE_TTL", 60))    # seconds
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", 200))    # hard cap, the oldest messages beyond it are dropped
+
+class SessionStore:
+    async def get_chat_history(self, session_id: str, last_n: Optional[int] = None) -> List[Dict[str, str]]:
+        """ last_n: only the newest n messages, None for the whole history """
+        raise NotImplementedError()
+
+    async def add_message(self, session_id: str, message: List[Dict[str, str]], ttl: int = 3600):
+        raise NotImplementedError()
+
+    async def get_summary(self, session_id: str) -> str:
+        raise NotImplementedError()
+
+    async def compact_history(self, session_id: str, summarized: List[Dict[str, str]], summary: str, ttl: int = 3600) -> bool:
+        """ replace the oldest messages with their summary, False if the history doesn't start with them anymore """
+        raise NotImplementedError()
+
+    async def clear_session(self, session_id: str):
+        raise NotImplementedError()
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+    async def close(self):
+        pass
+
+class _Session:
+    __slots__ = ("messages", "summary", "expires_at", "size")
+
+    def __init__(self, messages: List[Dict[str, str]], summary: str, expires_at: float):
+        self.messages = messages
+        self.summary = summary
+        self.expires_at = expires_at
+        self.size = 0
+
+class InMemorySessionStore(SessionStore):
+    # rough python overhead per message dict & per session
+    MESSAGE_OVERHEAD = 250
+    SESSION_OVERHEAD = 300
+
+    def __init__(self, max_bytes: int = SESSION_STORE_MAX_BYTES, max_messages: int = HISTORY_MAX_MESSAGES):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _session_size(self, session: _Session) -> int:
+        return (
+            self.SESSION_OVERHEAD + len(session.summary)
+            + sum(len(m["content"]) + len(m["role"]) + self.MESSAGE_OVERHEAD for m in session.messages)
+        )
+
+    def _resize(self, session: _Session):
+        size = self._session_size(session)
+        self._bytes += size - session.size
+        session.size = size
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def _live(self, session_id: str) -> Optional[_Session]:
+        """ the session if present & not expired, marked as most recently used """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.expires_at <= time.monotonic():
+            self._drop(session_id)
+            self.expirations += 1
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _evict(self, keep: str):
+        # expired sessions first (from the LRU end, where they collect), then least recently used
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.expires_at > now:
+                break
+            self._drop(session_id)
+            self.expirations += 1
+
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                self._sessions.move_to_end(keep)
+                continue
+            self._drop(session_id)
+            self.evictions += 1
+
+    def put(self, session_id: str, messages: List[Dict[str, str]], summary: str, ttl: int):
+        """ replace a whole session, used by the near cache to fill a miss """
+        self._drop(session_id)
+        session = _Session(list(messages[-self.max_messages:]), summary, time.monotonic() + ttl)
+        self._sessions[session_id] = session
+        self._resize(session)
+        self._evict(keep=session_id)
+
+    def contains(self, session_id: str) -> bool:
+        return self._live(session_id) is not None
+
+    async def get_chat_history(self, session_id, last_n=None):
+        session = self._live(session_id)
+        if session is None:
+            self.misses += 1
+            return []
+        self.hits += 1
+        messages = session.messages[-last_n:] if last_n else session.messages
+        return list(messages)
+
+    async def add_message(self, session_id, message, ttl=3600):
+        session = self._live(session_id)
+        if session is None:
+            session = _Session([], "", 0)
+            self._sessions[session_id] = session
+        session.messages.extend(message)
+        del session.messages[:-self.max_messages]
+        session.expires_at = time.monotonic() + ttl
+        self._resize(session)
+        self._evict(keep=session_id)
+
+    async def get_summary(self, session_id):
+        session = self._live(session_id)
+        return session.summary if session is not None else ""
+
+    async def compact_history(self, session_id, summarized, summary, ttl=3600):
+        session = self._live(session_id)
+        if session is None or session.messages[:len(summarized)] != summarized:
+            return False
+        del session.messages[:len(summarized)]
+        session.summary = summary
+        session.expires_at = time.monotonic() + ttl
+        self._resize(session)
+        return True
+
+    async def clear_session(self, session_id):
+        self._drop(session_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+class NearCacheSessionStore(SessionStore):
+    """
+    - reads: local copy if the session is cached, otherwise redis, then kept locally
+    - writes: redis first, then the same change applied to the local copy (write-through)
+    """
+    def __init__(self, remote: SessionStore, local: InMemorySessionStore, local_ttl: int = SESSION_NEAR_CACHE_TTL):
+        self.remote = remote
+        self.local = local
+        self.local_ttl = local_ttl
+        # history & summary are read concurrently, both wait on one fill per session
+        self._filling: Dict[str, asyncio.Future] = {}
+
+    async def _fill(self, session_id: str):
+        messages, summary = await asyncio.gather(
+            self.remote.get_chat_history(session_id),
+            self.remote.get_summary(session_id)
+        )
+        self.local.put(session_id, messages, summary, self.local_ttl)
+
+    async def _ensure_local(self, session_id: str):
+        if self.local.contains(session_id):
+            return
+        fill = self._filling.get(session_id)
+        if fill is None:
+            fill = asyncio.ensure_future(self._fill(session_id))
+            self._filling[session_id] = fill
+            fill.add_done_callback(lambda _: self._filling.pop(session_id, None))
+        await asyncio.shield(fill)
+
+    async def get_chat_history(self, session_id, last_n=None):
+        await self._ensure_local(session_id)
+        return await self.local.get_chat_history(session_id, last_n)
+
+    async def add_message(self, session_id, message, ttl=3600):
+        await self.remote.add_message(session_id, message, ttl)
+        fill = self._filling.get(session_id)
+        if fill is not None:
+            # the fill may have read redis before this write, don't keep what it loaded
+            await asyncio.gather(fill, return_exceptions=True)
+            await self.local.clear_session(session_id)
+        elif self.local.contains(session_id):
+            await self.local.add_message(session_id, message, min(ttl, self.local_ttl))
+
+    async def get_summary(self, session_id):
+        await self._ensure_local(session_id)
+        return await self.local.get_summary(session_id)
+
+    async def compact_history(self, session_id, summarized, summary, ttl=3600):
+        compacted = await self.remote.compact_history(session_id, summarized, summary, ttl)
+        if not compacted or not await self.local.compact_history(session_id, summarized, summary, min(ttl, self.local_ttl)):
+            # local copy disagrees with redis, reload it on the next read
+            await self.local.clear_session(session_id)
+        return compacted
+
+    async def clear_session(self, session_id):
+        await self.remote.clear_session(session_id)
+        await self.local.clear_session(session_id)
+
+    def stats(self) -> dict:
+        return {**self.local.stats(), "backend": "redis-near-cache", "local_ttl": self.local_ttl}
+
+    async def close(self):
+        await self.remote.close()
+
+_session_store = None
+
+def get_session_store() -> SessionStore:
+    """ Shared session store, picked with SESSION_STORE env """
+    global _session_store
+    if _session_store is None:
+        from app.services.rag.redis_service import RedisService
+        if SESSION_STORE == "redis":
+            _session_store = RedisService()
+        elif SESSION_STORE == "memory":
+            _session_store = InMemorySessionStore()
+        elif SESSION_STORE == "redis-near-cache":
+            _session_store = NearCacheSessionStore(RedisService(), InMemorySessionStore())
+        else:
+            raise ValueError(f"Unknown session store: {SESSION_STORE}")
+    return _session_store
+
+async def close_session_store():
+    global _session_store
+    if _session_store is not None:
+        await _session_store.close()
+        _session_store = None
@@ -0,0 +1,97 @@
+"""
+Tiny async stage graph.
+
+Every stage names the stages (or run inputs) it depends on and gets their results as keyword
+arguments. A stage starts as soon as its own dependencies are done, so independent stages
+overlap, e.g. redis history fetch runs while the query is embedded & searched.
+"""
+
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+_NO_FALLBACK = object()
+
+class StageTimeout(Exception):
+    pass
+
+class _Stage:
+    def __init__(self, name: str, fn: Callable[..., Awaitable[Any]], deps: Iterable[str], timeout: Optional[float], fallback: Any):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+class StageGraph:
+    def __init__(self):
+        self.stages: Dict[str, _Stage] = {}
+
+    def add(
+            self,
+            name: str,
+            fn: Callable[..., Awaitable[Any]],
+            deps: Iterable[str] = (),
+            timeout: Optional[float] = None,
+            fallback: Any = _NO_FALLBACK
+    ) -> "StageGraph":
+        """
+        - timeout: seconds, the stage fails with StageTimeout after that
+        - fallback: value used instead when the stage fails or times out, the run continues
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' already exists")
+        self.stages[name] = _Stage(name, fn, deps, timeout, fallback)
+        return self
+
+    async def run(self, **inputs) -> Dict[str, Any]:
+        """ Runs every stage, returns inputs + stage results keyed by name and timings under '_timings' """
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages and dep not in inputs:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown '{dep}'")
+
+        results: Dict[str, Any] = dict(inputs)
+        timings: Dict[str, float] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def _run(stage: _Stage):
+            await asyncio.gather(*[tasks[dep] for dep in stage.deps if dep in tasks])
+            start = time.perf_counter()
+            try:
+                coro = stage.fn(**{dep: results[dep] for dep in stage.deps})
+                if stage.timeout is not None:
+                    try:
+                        results[stage.name] = await asyncio.wait_for(coro, stage.timeout)
+                    except asyncio.TimeoutError:
+                        raise StageTimeout(f"Stage '{stage.name}' timed out after {stage.timeout}s")
+                else:
+                    results[stage.name] = await coro
+            except Exception as e:
+                if stage.fallback is _NO_FALLBACK:
+                    raise
+                print(f"  ⚠️ Stage '{stage.name}' failed ({type(e).__name__}: {e}), using fallback")
+                results[stage.name] = stage.fallback
+            finally:
+                timings[stage.name] = (time.perf_counter() - start) * 1000
+
+        # create tasks in dependency order so every dep task exists before its dependents
+        pending = dict(self.stages)
+        while pending:
+            ready = [s for s in pending.values() if all(d in tasks or d in inputs for d in s.deps)]
+            if not ready:
+                raise ValueError(f"Stage graph has a cycle between {list(pending)}")
+            for stage in ready:
+                tasks[stage.name] = asyncio.create_task(_run(stage))
+                del pending[stage.name]
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        results["_timings"] = timings
+        return results
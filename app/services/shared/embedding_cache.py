@@ -0,0 +1,216 @@
+"""
+Content addressed cache for embeddings.
+Key is sha256 of (model name, normalized text) so the same string is only embedded once.
+
+- tier 1: in-memory LRU bounded by a byte budget
+- tier 2: local sqlite file so hits survive restarts, bounded by its own byte budget,
+  the least recently used rows are deleted first (last_used is refreshed at most once per TOUCH_INTERVAL)
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_whitespace = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """same text with different unicode form / spacing maps to same key"""
+    return _whitespace.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    # rough python overhead per entry (OrderedDict slot, key str, ndarray header)
+    ENTRY_OVERHEAD = 200
+    # rough sqlite overhead per row (record header, rowid, primary key & last_used index entries)
+    DISK_ROW_OVERHEAD = 120
+    # a disk hit only rewrites last_used when it's older than this, reads stay reads
+    TOUCH_INTERVAL = 3600
+    # rows put between two exact counts, other processes share the file
+    RECOUNT_ROWS = 10_000
+
+    def __init__(
+            self,
+            max_bytes: int = 64 * 1024 * 1024,
+            path: Optional[str] = "embedding_cache.db",
+            max_disk_bytes: int = 1024 * 1024 * 1024
+    ):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes    # 0 = unbounded
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._disk_rows = 0    # estimate, exact after every count
+        self._rows_since_count = 0
+
+        # metrics
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    def _entry_size(self, key: str, vector: np.ndarray) -> int:
+        return vector.nbytes + len(key) + self.ENTRY_OVERHEAD
+
+    # memory tier
+    def _memory_get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+        return vector
+
+    def _memory_put(self, key: str, vector: np.ndarray):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        size = self._entry_size(key, vector)
+        if size > self.max_bytes:
+            return
+        self._memory[key] = vector
+        self._memory_bytes += size
+
+        # evict least recently used until we are back under budget
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_vector = self._memory.popitem(last=False)
+            self._memory_bytes -= self._entry_size(old_key, old_vector)
+            self.evictions += 1
+
+    # disk tier
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL DEFAULT 0)"
+            )
+            # files written before the disk budget have no last_used, their rows count as oldest
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "last_used" not in columns:
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_rows = self._count_rows()
+        return self._db
+
+    def _count_rows(self) -> int:
+        # counted on the small last_used index, not the table with its blobs
+        self._rows_since_count = 0
+        return self._db.execute("SELECT count(*) FROM embeddings INDEXED BY ix_embeddings_last_used").fetchone()[0]
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self._db_lock:
+            db = self._connect()
+            # sqlite has a limit on bound variables, so look up in slices
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                now = int(time.time())
+                hits = list(found)
+                for i in range(0, len(hits), 500):
+                    part = hits[i:i + 500]
+                    db.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(part))}) AND last_used < ?",
+                        [now, *part, now - self.TOUCH_INTERVAL]
+                    )
+                db.commit()
+        return found
+
+    def _disk_put(self, items: Dict[str, np.ndarray]):
+        now = int(time.time())
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+        with self._db_lock:
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            db.commit()
+            if self.max_disk_bytes:
+                self._prune_disk(len(rows[0][0]) + len(rows[0][1]) + self.DISK_ROW_OVERHEAD, len(rows))
+
+    def _prune_disk(self, row_bytes: int, added: int):
+        """ deletes the least recently used rows down to 90% of max_disk_bytes once it's passed, under _db_lock """
+        self._disk_rows += added
+        self._rows_since_count += added
+        max_rows = max(1, self.max_disk_bytes // row_bytes)
+        if self._disk_rows <= max_rows and self._rows_since_count < self.RECOUNT_ROWS:
+            return
+        self._disk_rows = self._count_rows()
+        if self._disk_rows <= max_rows:
+            return
+
+        excess = self._disk_rows - int(max_rows * 0.9)
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._db.commit()
+        self._disk_rows -= excess
+        self.disk_evictions += excess
+
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Returns only the keys that were found, misses are left out"""
+        found = {}
+        missing = []
+        for key in keys:
+            vector = self._memory_get(key)
+            if vector is not None:
+                found[key] = vector
+                self.memory_hits += 1
+            else:
+                missing.append(key)
+
+        if missing and self.path:
+            loop = asyncio.get_running_loop()
+            from_disk = await loop.run_in_executor(None, self._disk_get, missing)
+            for key, vector in from_disk.items():
+                self._memory_put(key, vector)
+                found[key] = vector
+            self.disk_hits += len(from_disk)
+            self.misses += len(missing) - len(from_disk)
+        else:
+            self.misses += len(missing)
+
+        return found
+
+    async def put_many(self, items: Dict[str, np.ndarray]):
+        for key, vector in items.items():
+            self._memory_put(key, vector)
+
+        if items and self.path:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._disk_put, items)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_max_bytes": self.max_disk_bytes,
+            "disk_evictions": self.disk_evictions,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+        }
@@ -0,0 +1,80 @@
+"""
+Process pool backend for embeddings.
+
+Every worker process loads its own copy of the model so encoding doesn't fight
+the api process for the GIL. Results are written straight into a shared memory
+float32 buffer owned by the parent, so only (name, offsets) are pickled, never the arrays.
+"""
+
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List
+
+import numpy as np
+
+def _init_worker(threads: int):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    # load the model once per process, not per batch
+    from app.services.shared.embeddings import _get_model
+    _get_model()
+
+def _encode_into(shm_name: str, shape: tuple, start: int, texts: List[str]) -> int:
+    """Encode texts and write them into rows [start, start + len(texts)) of the shared buffer"""
+    from app.services.shared.embeddings import _encode
+
+    # spawned workers share the parent's resource tracker, the parent unlinks the segment
+    shm = SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        out[start:start + len(texts)] = _encode(texts)
+        del out
+    finally:
+        shm.close()
+    return len(texts)
+
+class ProcessEmbeddingPool:
+    def __init__(self, workers: int, dim: int, threads_per_worker: int = 0, min_slice: int = 16):
+        self.workers = workers
+        self.dim = dim
+        self.min_slice = min_slice
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+        # spawn so workers don't inherit torch / event loop state from the api process
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads,)
+        )
+
+    def _slices(self, n: int) -> List[tuple]:
+        per_worker = max(self.min_slice, -(-n // self.workers))
+        return [(start, min(start + per_worker, n)) for start in range(0, n, per_worker)]
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        n = len(texts)
+        shape = (n, self.dim)
+        shm = SharedMemory(create=True, size=max(n * self.dim * 4, 1))
+        try:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[
+                loop.run_in_executor(self.executor, _encode_into, shm.name, shape, start, texts[start:end])
+                for start, end in self._slices(n)
+            ])
+            # copy out so the segment can be released right away
+            result = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
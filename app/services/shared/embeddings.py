@@ -1,6 +1,187 @@
-from typing import List
+from typing import List, Dict
+import os
+import time
 import asyncio
-from sentence_transformers import SentenceTransformer
+import threading
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from dotenv import load_dotenv
+
+from app.services.shared.embedding_cache import EmbeddingCache, cache_key
+from app.services.shared.embedding_workers import ProcessEmbeddingPool
+
+try:
+    import fcntl
+except ImportError:    # windows, exports still land atomically but aren't serialized
+    fcntl = None
+
+load_dotenv()
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384    # all-MiniLM-L6-v2 produces 384-dim vectors
+MAX_SEQ_LENGTH = 256
+
+# inference runtime: torch (default), onnx or onnx-int8 (dynamic int8 quantized)
+EMBED_RUNTIME = os.getenv("EMBED_RUNTIME", "torch")
+EMBED_ONNX_DIR = Path(os.getenv("EMBED_ONNX_DIR", "onnx_models")) / MODEL_NAME
+RUNTIMES = ("torch", "onnx", "onnx-int8")
+
+# micro-batching knobs
+# texts from concurrent callers are queued and encoded together in one forward pass
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", 64))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", 5))
+
+# embedding cache, only misses are sent to the model
+# set EMBED_CACHE_PATH to empty to keep the cache in memory only
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embedding_cache.db")
+EMBED_CACHE_DISK_MAX_BYTES = int(os.getenv("EMBED_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))    # 0 = unbounded
+
+# 0 = encode in the default thread pool, N = encode in N worker processes each with its own model
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", 0))
+EMBED_WORKER_THREADS = int(os.getenv("EMBED_WORKER_THREADS", 0))    # 0 = cpu count / workers
+
+@contextmanager
+def _export_lock(model_dir: Path):
+    # one exporting process at a time, the others wait & then find the finished files
+    model_dir.mkdir(parents=True, exist_ok=True)
+    with open(model_dir / ".export.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield    # closing the file releases the lock
+
+@contextmanager
+def _atomic_path(path: Path):
+    # write to a temp file & rename it into place, a crash never leaves a truncated model behind
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def export_onnx(model_dir: Path = EMBED_ONNX_DIR, quantized: bool = False) -> Path:
+    """
+    - export the pytorch model once to onnx (mean pooling + normalize baked into the graph)
+    - optionally write a dynamic int8 quantized copy next to it
+    - serialized with a file lock & written via temp file + rename, safe with several processes starting at once
+    """
+    fp32_path = model_dir / "model.onnx"
+    int8_path = model_dir / "model-int8.onnx"
+    path = int8_path if quantized else fp32_path
+    if path.exists():
+        return path
+
+    with _export_lock(model_dir):
+        _export(model_dir, fp32_path, int8_path, quantized)
+    return path
+
+def _export(model_dir: Path, fp32_path: Path, int8_path: Path, quantized: bool):
+    if not fp32_path.exists():
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        model_dir.mkdir(parents=True, exist_ok=True)
+        st_model = SentenceTransformer(MODEL_NAME, device="cpu")
+        transformer = st_model[0].auto_model
+        st_model.tokenizer.save_pretrained(str(model_dir))
+
+        class _Pooled(torch.nn.Module):
+            # same as sentence transformer's Transformer -> Pooling(mean) -> Normalize
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                token_embeddings = self.model(
+                    input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+                )[0]
+                mask = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+                pooled = (token_embeddings * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+                return torch.nn.functional.normalize(pooled, p=2, dim=1)
+
+        dummy = st_model.tokenizer(["hello world"], return_tensors="pt")
+        print(f"Exporting {MODEL_NAME} to {fp32_path}")
+        # the tokenizer files are written above, model.onnx last, so its presence means a complete export
+        with _atomic_path(fp32_path) as tmp_path:
+            torch.onnx.export(
+                _Pooled(transformer).eval(),
+                (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+                str(tmp_path),
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["sentence_embedding"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "token_type_ids": {0: "batch", 1: "sequence"},
+                    "sentence_embedding": {0: "batch"},
+                },
+                opset_version=14,
+            )
+
+    if quantized and not int8_path.exists():
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"Quantizing {fp32_path} to {int8_path}")
+        with _atomic_path(int8_path) as tmp_path:
+            quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+
+class OnnxEncoder:
+    """
+    Drop-in for SentenceTransformer.encode running the exported model on onnxruntime (cpu)
+    """
+
+    def __init__(self, quantized: bool = False, model_dir: Path = EMBED_ONNX_DIR, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_dir, quantized)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        out = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        # sort by length so each batch pads to a similar size
+        order = np.argsort([len(t) for t in texts], kind="stable")
+
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            tokens = self.tokenizer(
+                [texts[i] for i in idx],
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+            feeds = {
+                "input_ids": tokens["input_ids"].astype(np.int64),
+                "attention_mask": tokens["attention_mask"].astype(np.int64),
+                "token_type_ids": tokens["token_type_ids"].astype(np.int64),
+            }
+            out[idx] = self.session.run(None, feeds)[0]
+        return out
+
+def _load_model(runtime: str = EMBED_RUNTIME):
+    if runtime == "torch":
+        # imported here: processes that only chunk text (load_tokenizer) don't need torch
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(MODEL_NAME)
+    if runtime == "onnx":
+        return OnnxEncoder(quantized=False)
+    if runtime == "onnx-int8":
+        return OnnxEncoder(quantized=True)
+    raise ValueError(f"Unknown embedding runtime: {runtime}, expected one of {RUNTIMES}")
+
+def _model_id(runtime: str = EMBED_RUNTIME) -> str:
+    # vectors from different runtimes differ slightly, so they must not share cache entries
+    return MODEL_NAME if runtime == "torch" else f"{MODEL_NAME}:{runtime}"
 
 # loading the model globally once
 _model = None
@@ -8,29 +189,271 @@ _model = None
 def _get_model():
     global _model
     if _model is None:
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
+        _model = _load_model(EMBED_RUNTIME)
     return _model
 
-async def get_embeddings(texts: List[str]) -> List[List[float]]:
+def load_tokenizer():
+    """
+    The embedding model's tokenizer as a huggingface `tokenizers.Tokenizer`, for token aware chunking
+    - a copy of the loaded model's own tokenizer if this process has one (encode calls change its settings)
+    - else the tokenizer.json saved with the onnx export, else the model's hub repo (in the hf cache once the model was loaded)
+    """
+    from tokenizers import Tokenizer
+    if _model is not None:
+        return Tokenizer.from_str(_model.tokenizer.backend_tokenizer.to_str())
+    saved = EMBED_ONNX_DIR / "tokenizer.json"
+    # model.onnx is written after the tokenizer files, without it an export may still be writing them
+    if saved.exists() and (EMBED_ONNX_DIR / "model.onnx").exists():
+        return Tokenizer.from_file(str(saved))
+    return Tokenizer.from_pretrained(f"sentence-transformers/{MODEL_NAME}")
+
+def _encode(texts: List[str]) -> np.ndarray:
+    # keep vectors as one contiguous float32 matrix, a python list would box every float
+    embeddings = _get_model().encode(texts, convert_to_numpy=True)
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool() -> ProcessEmbeddingPool:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # export once here so the spawned workers only load the finished onnx file
+            if EMBED_RUNTIME in ("onnx", "onnx-int8"):
+                export_onnx(quantized=EMBED_RUNTIME == "onnx-int8")
+            _process_pool = ProcessEmbeddingPool(EMBED_WORKERS, EMBEDDING_DIM, threads_per_worker=EMBED_WORKER_THREADS)
+    return _process_pool
+
+def shutdown_embedding_workers():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+
+async def _encode_async(texts: List[str]) -> np.ndarray:
+    if EMBED_WORKERS > 0:
+        # the first call may export the onnx model, keep that off the event loop
+        pool = _process_pool or await asyncio.to_thread(_get_process_pool)
+        return await pool.encode(texts)
+
+    # model.encode is cpu heavy and can block event loop
+    # run_in_executor runs the heavy one in another thread so it wont block fastapi
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _encode, texts)
+
+class _Request:
+    def __init__(self, texts: List[str], future: asyncio.Future):
+        self.texts = texts
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        self.next = 0    # first text not handed to a batch yet
+        self.done = 0    # texts encoded so far
+        self.out = None    # filled slice by slice when the request is split over several batches
+
+class EmbeddingBatcher:
+    """
+    - collects texts from concurrent get_embeddings calls
+    - flushes one model.encode when max_batch_size texts are queued or max_wait_ms has passed
+    - a request over max_batch_size is encoded in slices that take turns with the other pending requests,
+      so short queries don't wait behind a bulk one
+    - hands every caller back only its own slice of the batch
+    """
+
+    def __init__(self, max_batch_size: int = EMBED_MAX_BATCH_SIZE, max_wait_ms: float = EMBED_MAX_WAIT_MS, max_inflight: int = 1):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_inflight = max_inflight
+        self._queue = None
+        self._pending = deque()    # requests with texts left to hand out, in turn
+        self._worker = None
+        self._loop = None
+        self._inflight = None
+        self._flushing = set()
+
+        # metrics
+        self.queued_texts = 0
+        self.total_batches = 0
+        self.total_requests = 0
+        self.total_texts = 0
+        self.max_seen_batch = 0
+        self.last_batch_size = 0
+        self.total_wait = 0.0
+
+    def _ensure_worker(self):
+        # queue & worker are bound to the running loop, recreate them if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending = deque()
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._worker = loop.create_task(self._run())
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait(_Request(texts, future))
+        self.queued_texts += len(texts)
+        return await future
+
+    async def _collect(self) -> List[tuple]:
+        """ (request, start, end) slices of up to max_batch_size texts in total """
+        batch = []
+        size = 0
+        deadline = None
+
+        while size < self.max_batch_size:
+            while not self._queue.empty():
+                self._pending.append(self._queue.get_nowait())
+
+            if self._pending:
+                request = self._pending.popleft()
+                if request.future.done():
+                    # failed or cancelled caller, its remaining slices are dropped
+                    self.queued_texts -= len(request.texts) - request.next
+                    continue
+                take = min(self.max_batch_size - size, len(request.texts) - request.next)
+                batch.append((request, request.next, request.next + take))
+                request.next += take
+                size += take
+                if request.next < len(request.texts):
+                    self._pending.append(request)    # the rest goes behind the requests pending now
+                if deadline is None:
+                    deadline = self._loop.time() + self.max_wait
+                continue
+
+            if not batch:
+                self._pending.append(await self._queue.get())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                self._pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            # with worker processes several batches can be encoded at once
+            await self._inflight.acquire()
+            batch = await self._collect()
+            task = self._loop.create_task(self._flush(batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: List[tuple]):
+        try:
+            texts = [t for request, start, end in batch for t in request.texts[start:end]]
+            self.queued_texts -= len(texts)
+
+            now = time.perf_counter()
+            first_slices = [request for request, start, _ in batch if start == 0]
+            self.total_batches += 1
+            self.total_requests += len(first_slices)
+            self.total_texts += len(texts)
+            self.last_batch_size = len(texts)
+            self.max_seen_batch = max(self.max_seen_batch, len(texts))
+            self.total_wait += sum(now - request.enqueued_at for request in first_slices)
+
+            try:
+                embeddings = await _encode_async(texts)
+            except Exception as e:
+                for request, _, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                return
+
+            offset = 0
+            for request, start, end in batch:
+                vectors = embeddings[offset:offset + end - start]
+                offset += end - start
+                if request.future.done():
+                    continue
+                if start == 0 and end == len(request.texts):
+                    request.future.set_result(vectors)
+                    continue
+                if request.out is None:
+                    request.out = np.empty((len(request.texts), EMBEDDING_DIM), dtype=np.float32)
+                request.out[start:end] = vectors
+                request.done += end - start
+                if request.done == len(request.texts):
+                    request.future.set_result(request.out)
+        finally:
+            self._inflight.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "workers": EMBED_WORKERS,
+            "batches_in_flight": len(self._flushing),
+            "queue_depth": self.queued_texts,
+            "total_batches": self.total_batches,
+            "total_texts": self.total_texts,
+            "avg_batch_size": self.total_texts / self.total_batches if self.total_batches else 0,
+            "max_batch_size_seen": self.max_seen_batch,
+            "last_batch_size": self.last_batch_size,
+            "avg_queue_wait_ms": (self.total_wait / self.total_requests * 1000) if self.total_requests else 0,
+        }
+
+batcher = EmbeddingBatcher(max_inflight=max(1, EMBED_WORKERS))
+cache = EmbeddingCache(
+    max_bytes=EMBED_CACHE_MAX_BYTES, path=EMBED_CACHE_PATH or None, max_disk_bytes=EMBED_CACHE_DISK_MAX_BYTES
+) if EMBED_CACHE_ENABLED else None
+
+async def _cached_embed(texts: List[str]) -> np.ndarray:
+    keys = [cache_key(_model_id(), t) for t in texts]
+    found = await cache.get_many(keys)
+
+    # embed each missing text once, even if it repeats in the input
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+
+    if missing:
+        vectors = await batcher.embed(list(missing.values()))
+        # copy rows so cached entries don't keep the whole batch matrix alive
+        fresh = {key: vector.copy() for key, vector in zip(missing.keys(), vectors)}
+        await cache.put_many(fresh)
+        found.update(fresh)
+
+    embeddings = np.empty((len(keys), EMBEDDING_DIM), dtype=np.float32)
+    for i, key in enumerate(keys):
+        embeddings[i] = found[key]
+    return embeddings
+
+async def get_embeddings(texts: List[str]) -> np.ndarray:
     """
     Generate embedding using sentence transformer
+    Returns contiguous float32 array of shape (len(texts), EMBEDDING_DIM)
     """
     if not isinstance(texts, list):
         raise ValueError(f"Input must be a list of strings, got {type(texts)}")
-    
+
     clean_texts = [str(t) for t in texts if t is not None]
 
     if len(clean_texts) == 0:
-        return []
-    
-    model = _get_model()
-    loop = asyncio.get_running_loop()
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
 
-    def _encode():
-        embeddings = model.encode(clean_texts)
-        return [embed.tolist() for embed in embeddings]
-    
-    # model.encode is cpu heavy and can block event loop
-    # run_in_executor runs the heavy one in another thread so it wont block fastapi
-    return await loop.run_in_executor(None, _encode)
+    if cache is not None:
+        return await _cached_embed(clean_texts)
+    return await batcher.embed(clean_texts)
 
+def check_parity(texts: List[str], runtime: str, batch_size: int = 32) -> Dict[str, float]:
+    """
+    Cosine similarity between the pytorch vectors and another runtime's vectors for the same texts
+    Both are L2 normalized so the row-wise dot product is the cosine
+    """
+    reference = np.asarray(_load_model("torch").encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    candidate = np.asarray(_load_model(runtime).encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+    cosine = (reference * candidate).sum(axis=1)
+    return {
+        "runtime": runtime,
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+    }
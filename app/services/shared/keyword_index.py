@@ -0,0 +1,140 @@
+"""
+Keyword (BM25) index over the chunks table with sqlite FTS5.
+
+chunks_fts is an external content table, it only stores the inverted index
+and reads the text back from chunks, so the text isn't stored twice.
+Ingestion has to call index_chunks for every new document to keep it in sync.
+Near duplicate chunks (canonical_id set) aren't indexed, their canonical chunk stands for them.
+"""
+
+import re
+from typing import List, Dict, Optional
+
+from sqlalchemy import text, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import AsyncSessionLocal
+
+FTS_TABLE = "chunks_fts"
+
+def ensure_fts_index(connection):
+    """Create the fts table on startup, and fill it from existing chunks the first time"""
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).first()
+    if exists:
+        return
+
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"text, content='chunks', content_rowid='id', tokenize='unicode61')"
+    )
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    print(f"Created keyword index '{FTS_TABLE}'")
+
+async def index_chunks(session: AsyncSession, doc_id: Optional[int], from_chunk_index: int = 0, chunk_ids: Optional[List[int]] = None):
+    """
+    - add a document's chunks to the keyword index
+    - call after the chunk rows are flushed, before commit, so both land in one transaction
+    - from_chunk_index: only chunks from there on, for documents written batch by batch
+    - chunk_ids: only these rows (doc_id isn't used then), for chunks added to an existing document or several documents
+    """
+    if chunk_ids is not None:
+        for part in _id_batches(chunk_ids):
+            await session.execute(
+                text(f"INSERT INTO {FTS_TABLE}(rowid, text) SELECT id, text FROM chunks "
+                     f"WHERE id IN :ids AND canonical_id IS NULL")
+                .bindparams(bindparam("ids", expanding=True)),
+                {"ids": part}
+            )
+        return
+
+    await session.execute(
+        text(
+            f"INSERT INTO {FTS_TABLE}(rowid, text) SELECT id, text FROM chunks "
+            f"WHERE doc_id = :doc_id AND chunk_index >= :from_chunk_index AND canonical_id IS NULL"
+        ),
+        {"doc_id": doc_id, "from_chunk_index": from_chunk_index}
+    )
+
+async def unindex_chunks(session: AsyncSession, doc_id: int, chunk_ids: Optional[List[int]] = None):
+    """
+    - remove a document's chunks (or only the chunk_ids rows) from the keyword index, call before deleting the chunk rows
+    - external content tables need the old text to delete, hence the special 'delete' insert,
+      only for rows that are in the index, deleting one that isn't corrupts it
+    """
+    if chunk_ids is not None:
+        for part in _id_batches(chunk_ids):
+            await session.execute(
+                text(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+                    f"SELECT 'delete', id, text FROM chunks WHERE id IN :ids AND canonical_id IS NULL"
+                ).bindparams(bindparam("ids", expanding=True)),
+                {"ids": part}
+            )
+        return
+
+    await session.execute(
+        text(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) "
+            f"SELECT 'delete', id, text FROM chunks WHERE doc_id = :doc_id AND canonical_id IS NULL"
+        ),
+        {"doc_id": doc_id}
+    )
+
+def _id_batches(ids: List[int], size: int = 500):
+    # stay well below sqlite's limit of bound parameters per statement
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def _match_expression(query: str) -> str:
+    # quote every word so user input can't be read as fts syntax (AND, NEAR, column:, *)
+    terms = list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+    return " OR ".join(f'"{term}"' for term in terms)
+
+async def keyword_search(query: str, top_k: int = 5) -> List[Dict]:
+    """
+    BM25 ranked chunks, same result shape as VectorStore.query_vectors
+    bm25() is lower = better, so the score is negated
+    """
+    match = _match_expression(query)
+    if not match:
+        return []
+
+    async with AsyncSessionLocal() as session:
+        rows = await session.execute(
+            text(
+                f"SELECT c.doc_id, c.chunk_index, c.text, c.vector_id, bm25({FTS_TABLE}) AS rank "
+                f"FROM {FTS_TABLE} JOIN chunks c ON c.id = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH :match ORDER BY rank LIMIT :top_k"
+            ),
+            {"match": match, "top_k": top_k}
+        )
+
+    return [
+        {
+            "id": row.vector_id,
+            "score": -row.rank,
+            "metadata": {
+                "doc_id": row.doc_id,
+                "chunk_index": row.chunk_index,
+                "text": row.text[:500]    # preview, same as the vector payload
+            }
+        }
+        for row in rows
+    ]
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], top_k: int, k: int = 60) -> List[Dict]:
+    """
+    Merge ranked lists, every list adds 1 / (k + rank) for each chunk it returned
+    Chunks are matched on (doc_id, chunk_index) since vector & keyword ids differ
+    """
+    fused: Dict[tuple, Dict] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            metadata = result["metadata"]
+            key = (metadata.get("doc_id"), metadata.get("chunk_index"))
+            entry = fused.setdefault(key, {"id": result["id"], "score": 0.0, "metadata": metadata})
+            entry["score"] += 1.0 / (k + rank)
+
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:top_k]
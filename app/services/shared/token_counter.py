@@ -0,0 +1,70 @@
+"""
+Token counting with a huggingface `tokenizers` tokenizer, shared by chunking and the RAG prompt budget.
+
+- len / 4 estimate when the tokenizer can't be loaded
+- loading is blocking (hub download & parse), counting is cheap once loaded
+"""
+
+import threading
+from typing import Callable, List, Dict, Optional
+
+# chat templates add role markers around every message
+MESSAGE_OVERHEAD = 4
+
+class TokenCounter:
+    def __init__(self, tokenizer_name: str, loader: Optional[Callable] = None):
+        """ loader: returns a `tokenizers.Tokenizer`, instead of loading tokenizer_name from the hub """
+        self.tokenizer_name = tokenizer_name
+        self.loader = loader
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        - blocking (hub download & parse): call it at startup or through asyncio.to_thread, not on the event loop
+        - concurrent callers wait for the first load instead of getting the chars / 4 estimate meanwhile
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        if self.loader is not None:
+                            tokenizer = self.loader()
+                        else:
+                            from tokenizers import Tokenizer
+                            tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+                        tokenizer.no_truncation()
+                        tokenizer.no_padding()
+                        self._tokenizer = tokenizer
+                        print(f"Loaded tokenizer {self.tokenizer_name}")
+                    except Exception as e:
+                        print(f"⚠️ Tokenizer {self.tokenizer_name} unavailable ({e}), estimating tokens as chars / 4")
+                    self._loaded = True
+        return self._tokenizer
+
+    def _get_tokenizer(self):
+        return self.load()
+
+    @property
+    def estimated(self) -> bool:
+        """ True when counts are the chars / 4 estimate """
+        return self.load() is None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return (len(text) + 3) // 4
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """ one encode_batch call for many texts, the rust tokenizer spreads it over threads """
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return [(len(text) + 3) // 4 for text in texts]
+        return [len(encoding.ids) for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(m["content"]) + MESSAGE_OVERHEAD for m in messages)
@@ -3,28 +3,131 @@ Qdrant is a vector db used to store embedding as points.
 Each point is 384vectors which are in VectorParams
 With Cosine Distance the Qdrant can decide which points are similar
 
+NumpyStore is the embedded alternative, same interface, no server needed
 """
 
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+import os
+import json
+import uuid
+import threading
+import httpx
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import Distance, VectorParams, PointStruct, QueryRequest, PointIdsList, SetPayloadOperation, SetPayload
 import asyncio
-from typing import List
+import numpy as np
+from functools import partial
+from pathlib import Path
+from typing import List, Dict, Callable, Awaitable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# which implementation get_vector_store() hands out:
+# qdrant (sync client in executor), qdrant-async or numpy (embedded, no server)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "qdrant-async")
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", "vector_data")
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", 10))    # seconds
+QDRANT_MAX_CONNECTIONS = int(os.getenv("QDRANT_MAX_CONNECTIONS", 20))
+QDRANT_UPSERT_BATCH_SIZE = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", 256))
+QDRANT_UPSERT_PARALLEL = int(os.getenv("QDRANT_UPSERT_PARALLEL", 4))
+
+# fixed namespace so point ids are the same in every process and after restarts
+# (python's hash() of a str is salted per process)
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2a7e-3b9d-5e4f-8a21-0c7d9b3e5f10")
+
+def point_id(vector_id: str) -> str:
+    """Stable qdrant point id (uuid5) for our string vector_id like doc1_chunk0"""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, vector_id))
+
+def _to_points(ids: List[str], vectors: np.ndarray, metadatas: List[dict]) -> List[PointStruct]:
+    # qdrant client wants plain lists, convert row by row only here at the boundary
+    return [
+        PointStruct(id=point_id(id_str), vector=v.tolist(), payload=m)
+        for id_str, v, m in zip(ids, vectors, metadatas)
+    ]
+
+def _batch_requests(vectors: np.ndarray, top_k: int) -> List[QueryRequest]:
+    return [
+        QueryRequest(query=vector.tolist(), limit=top_k, with_payload=True)
+        for vector in np.asarray(vectors, dtype=np.float32)
+    ]
+
+def _payload_operations(ids: List[str], payloads: List[dict]) -> List[SetPayloadOperation]:
+    return [
+        SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[point_id(id_str)]))
+        for id_str, payload in zip(ids, payloads)
+    ]
+
+def _to_results(points) -> List[dict]:
+    return [{"id": point.id, "score": point.score, "metadata": point.payload} for point in points]
+
+async def _upsert_in_batches(
+        send: Callable[[List[PointStruct], bool], Awaitable],
+        ids: List[str],
+        vectors: np.ndarray,
+        metadatas: List[dict],
+        batch_size: int,
+        parallel: int
+) -> int:
+    """
+    - split points into batches and send up to `parallel` of them at once with wait=False
+    - the last batch goes with wait=True, qdrant applies updates in order so once it returns everything is applied
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    bounds = [(start, min(start + batch_size, len(ids))) for start in range(0, len(ids), batch_size)]
+    if not bounds:
+        return 0
+
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def _send(start: int, end: int, wait: bool):
+        async with semaphore:
+            await send(_to_points(ids[start:end], vectors[start:end], metadatas[start:end]), wait)
+
+    await asyncio.gather(*[_send(start, end, False) for start, end in bounds[:-1]])
+    await _send(*bounds[-1], True)
+    return len(bounds)
 
 # abstract base
+# vectors are float32 ndarrays, (n, dim) for upsert and (dim,) for query
 class VectorStore:
     async def ensure_collection(self, collection_name: str, vector_size: int):
         raise NotImplementedError() # means not implemented yet and to make it overriden later
     
-    async def upsert_vectors(self, namespace: str, ids: List[str], vectors: List[List[float]], metadatas: List[dict]):
+    async def upsert_vectors(self, namespace: str, ids: List[str], vectors: np.ndarray, metadatas: List[dict]):
         raise NotImplementedError()
     
-    async def query_vectors(self, namespace: str, vector: List[float], top_k: int = 5) -> List[dict]:
+    async def query_vectors(self, namespace: str, vector: np.ndarray, top_k: int = 5) -> List[dict]:
         raise NotImplementedError()
 
+    async def query_batch(self, namespace: str, vectors: np.ndarray, top_k: int = 5) -> List[List[dict]]:
+        """ one result list per query vector, stores override this with a single batched search """
+        return list(await asyncio.gather(*[self.query_vectors(namespace, vector, top_k) for vector in vectors]))
+
+    async def delete_vectors(self, namespace: str, ids: List[str]):
+        raise NotImplementedError()
+
+    async def set_payloads(self, namespace: str, ids: List[str], payloads: List[dict]):
+        """ merge each payload into the existing one of its point, the vector stays as it is """
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
 # implementation
 class QdrantStore(VectorStore):
-    def __init__(self, url: str='http://localhost:6333'):
+    def __init__(
+            self,
+            url: str='http://localhost:6333',
+            upsert_batch_size: int = 256,
+            upsert_parallel: int = 4
+    ):
         self.client = QdrantClient(url= url)   # local qdrant
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_parallel = upsert_parallel
 
     async def ensure_collection(self, collection_name: str, vector_size: int):
         """Create collection if doesn't exist"""
@@ -48,15 +151,14 @@ class QdrantStore(VectorStore):
          - safely handles in case of re-ingestion
         """
         loop = asyncio.get_running_loop()
-        def _sync():
-            from qdrant_client.models import PointStruct
-            points = [
-                PointStruct(id=hash(id_str) % (2**63), vector=v, payload=m)  
-                for id_str, v, m in zip(ids, vectors, metadatas)
-            ]
-            self.client.upsert(collection_name=namespace, points=points)
-            print(f"Upserted {len(points)} vectors to '{namespace}'")
-        await loop.run_in_executor(None, _sync)
+        def _send(points, wait):
+            return loop.run_in_executor(
+                None, partial(self.client.upsert, collection_name=namespace, points=points, wait=wait)
+            )
+        batches = await _upsert_in_batches(
+            _send, ids, vectors, metadatas, self.upsert_batch_size, self.upsert_parallel
+        )
+        print(f"Upserted {len(ids)} vectors to '{namespace}' in {batches} batches")
 
     async def query_vectors(self, namespace, vector, top_k=5):
         """
@@ -67,11 +169,397 @@ class QdrantStore(VectorStore):
             from qdrant_client.models import NamedVector
             resp = self.client.query_points(
                 collection_name=namespace,
-                query=vector,
+                query=np.asarray(vector, dtype=np.float32).tolist(),
                 limit=top_k
             )
             return [
                 {"id": point.id, "score": point.score, "metadata": point.payload} 
                 for point in resp.points
             ]
-        return await loop.run_in_executor(None, _sync)
\ No newline at end of file
+        return await loop.run_in_executor(None, _sync)
+
+    async def query_batch(self, namespace, vectors, top_k=5):
+        """ all queries in one query_batch_points request """
+        loop = asyncio.get_running_loop()
+        def _sync():
+            resp = self.client.query_batch_points(
+                collection_name=namespace,
+                requests=_batch_requests(vectors, top_k)
+            )
+            return [_to_results(r.points) for r in resp]
+        return await loop.run_in_executor(None, _sync)
+
+    async def delete_vectors(self, namespace, ids):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(
+            self.client.delete,
+            collection_name=namespace,
+            points_selector=PointIdsList(points=[point_id(i) for i in ids])
+        ))
+        print(f"Deleted {len(ids)} vectors from '{namespace}'")
+
+    async def set_payloads(self, namespace, ids, payloads):
+        """ one batch_update_points request for all points """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(
+            self.client.batch_update_points,
+            collection_name=namespace,
+            update_operations=_payload_operations(ids, payloads)
+        ))
+
+class AsyncQdrantStore(VectorStore):
+    """
+    - same interface as QdrantStore but on AsyncQdrantClient, nothing goes through the thread pool
+    - keeps a pool of keep-alive http connections (or a grpc channel with prefer_grpc)
+    """
+    def __init__(
+            self,
+            url: str = 'http://localhost:6333',
+            prefer_grpc: bool = False,
+            grpc_port: int = 6334,
+            timeout: int = 10,
+            max_connections: int = 20,
+            upsert_batch_size: int = 256,
+            upsert_parallel: int = 4
+    ):
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_parallel = upsert_parallel
+        self.client = AsyncQdrantClient(
+            url=url,
+            prefer_grpc=prefer_grpc,
+            grpc_port=grpc_port,
+            timeout=timeout,
+            # without limits the client turns keep-alive off for localhost / 127.0.0.1 (a new connection per call)
+            # and uses httpx defaults elsewhere, explicit limits keep connections alive & size the pool everywhere
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def ensure_collection(self, collection_name: str, vector_size: int):
+        """Create collection if doesn't exist"""
+        if await self.client.collection_exists(collection_name):
+            print(f"Collection '{collection_name}' already exists")
+            return
+        try:
+            await self.client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE)
+            )
+            print(f"Created collection '{collection_name}' with vector size {vector_size}")
+        except Exception:
+            # another request may have created it in between
+            if not await self.client.collection_exists(collection_name):
+                raise
+
+    async def upsert_vectors(self, namespace, ids, vectors, metadatas):
+        """
+         - for insert or update
+         - safely handles in case of re-ingestion
+        """
+        def _send(points, wait):
+            return self.client.upsert(collection_name=namespace, points=points, wait=wait)
+        batches = await _upsert_in_batches(
+            _send, ids, vectors, metadatas, self.upsert_batch_size, self.upsert_parallel
+        )
+        print(f"Upserted {len(ids)} vectors to '{namespace}' in {batches} batches")
+
+    async def query_vectors(self, namespace, vector, top_k=5):
+        """
+            for RAG chat
+        """
+        resp = await self.client.query_points(
+            collection_name=namespace,
+            query=np.asarray(vector, dtype=np.float32).tolist(),
+            limit=top_k
+        )
+        return _to_results(resp.points)
+
+    async def query_batch(self, namespace, vectors, top_k=5):
+        """ all queries in one query_batch_points request """
+        resp = await self.client.query_batch_points(
+            collection_name=namespace,
+            requests=_batch_requests(vectors, top_k)
+        )
+        return [_to_results(r.points) for r in resp]
+
+    async def delete_vectors(self, namespace, ids):
+        await self.client.delete(
+            collection_name=namespace,
+            points_selector=PointIdsList(points=[point_id(i) for i in ids])
+        )
+        print(f"Deleted {len(ids)} vectors from '{namespace}'")
+
+    async def set_payloads(self, namespace, ids, payloads):
+        """ one batch_update_points request for all points """
+        await self.client.batch_update_points(
+            collection_name=namespace,
+            update_operations=_payload_operations(ids, payloads)
+        )
+
+    async def close(self):
+        await self.client.close()
+
+class _NumpyCollection:
+    """
+    One namespace on disk:
+    - vectors.f32     memory mapped float32 matrix (capacity, dim), rows are L2 normalized
+    - payloads.jsonl  append-only sidecar, one {"row", "id", "payload"} line per write, last line wins,
+                      id null marks a deleted row, deleted rows are reused by later upserts
+    - meta.json       dim / count / capacity, written last so a crash mid-write leaves the old count
+    """
+    def __init__(self, path: Path, dim: int, initial_capacity: int = 1024):
+        self.path = path
+        self.lock = threading.Lock()
+        path.mkdir(parents=True, exist_ok=True)
+
+        meta_path = path / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            self.dim, self.count, self.capacity = meta["dim"], meta["count"], meta["capacity"]
+        else:
+            self.dim, self.count, self.capacity = dim, 0, initial_capacity
+            self._resize_file(self.capacity)
+            self._write_meta()
+
+        self.matrix = self._open()
+        self.ids: List[str] = [None] * self.count
+        self.payloads: List[dict] = [None] * self.count
+        self.rows: Dict[str, int] = {}
+
+        payload_path = path / "payloads.jsonl"
+        if payload_path.exists():
+            with payload_path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    row = entry["row"]
+                    if row < self.count:
+                        old_id = self.ids[row]
+                        if old_id is not None and self.rows.get(old_id) == row:
+                            del self.rows[old_id]
+                        self.ids[row] = entry["id"]
+                        self.payloads[row] = entry["payload"]
+                        if entry["id"] is not None:
+                            self.rows[entry["id"]] = row
+
+        # rows below count without an id were deleted, they are skipped by queries & reused by upserts
+        self.free: List[int] = [row for row, id_str in enumerate(self.ids) if id_str is None]
+
+    def _open(self) -> np.memmap:
+        return np.memmap(self.path / "vectors.f32", dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+
+    def _resize_file(self, capacity: int):
+        with open(self.path / "vectors.f32", "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+
+    def _write_meta(self):
+        tmp = self.path / "meta.json.tmp"
+        tmp.write_text(json.dumps({"dim": self.dim, "count": self.count, "capacity": self.capacity}))
+        os.replace(tmp, self.path / "meta.json")
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.matrix.flush()
+        del self.matrix
+        self._resize_file(capacity)
+        self.capacity = capacity
+        self.matrix = self._open()
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, metadatas: List[dict]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        with self.lock:
+            # existing ids are overwritten in place, new ones appended after count
+            rows = []
+            next_row = self.count
+            for id_str in ids:
+                row = self.rows.get(id_str)
+                if row is None:
+                    if self.free:
+                        row = self.free.pop()
+                    else:
+                        row = next_row
+                        next_row += 1
+                    # same id twice in one call lands on one row
+                    self.rows[id_str] = row
+                rows.append(row)
+
+            if next_row > self.capacity:
+                self._grow(next_row)
+
+            rows = np.asarray(rows)
+            self.matrix[rows] = vectors
+            self.matrix.flush()
+
+            with (self.path / "payloads.jsonl").open("a", encoding="utf-8") as f:
+                for id_str, row, payload in zip(ids, rows.tolist(), metadatas):
+                    f.write(json.dumps({"row": row, "id": id_str, "payload": payload}) + "\n")
+
+            added = next_row - self.count
+            self.ids.extend([None] * added)
+            self.payloads.extend([None] * added)
+            for id_str, row, payload in zip(ids, rows.tolist(), metadatas):
+                self.ids[row] = id_str
+                self.payloads[row] = payload
+                self.rows[id_str] = row
+
+            self.count = next_row
+            self._write_meta()
+
+    def delete(self, ids: List[str]) -> int:
+        with self.lock:
+            rows = [self.rows.pop(id_str) for id_str in ids if id_str in self.rows]
+            if not rows:
+                return 0
+            self.matrix[np.asarray(rows)] = 0
+            self.matrix.flush()
+            with (self.path / "payloads.jsonl").open("a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"row": row, "id": None, "payload": None}) + "\n")
+            for row in rows:
+                self.ids[row] = None
+                self.payloads[row] = None
+            self.free.extend(rows)
+            return len(rows)
+
+    def set_payloads(self, ids: List[str], payloads: List[dict]) -> int:
+        with self.lock:
+            updates = []
+            for id_str, payload in zip(ids, payloads):
+                row = self.rows.get(id_str)
+                if row is not None:
+                    self.payloads[row] = {**self.payloads[row], **payload}
+                    updates.append((row, id_str))
+            with (self.path / "payloads.jsonl").open("a", encoding="utf-8") as f:
+                for row, id_str in updates:
+                    f.write(json.dumps({"row": row, "id": id_str, "payload": self.payloads[row]}) + "\n")
+            return len(updates)
+
+    def query(self, vector: np.ndarray, top_k: int) -> List[dict]:
+        return self.query_batch(np.asarray(vector, dtype=np.float32)[None, :], top_k)[0]
+
+    def query_batch(self, vectors: np.ndarray, top_k: int) -> List[List[dict]]:
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        with self.lock:
+            count = self.count
+            matrix = self.matrix
+            free = np.asarray(self.free, dtype=np.int64)
+
+        if count == 0:
+            return [[] for _ in range(len(queries))]
+
+        # cosine == dot product since rows are normalized, one matrix product scores every query
+        scores = queries @ matrix[:count].T
+        scores[:, free] = -np.inf
+        if top_k < count:
+            top = np.argpartition(-scores, top_k, axis=1)[:, :top_k]
+        else:
+            top = np.broadcast_to(np.arange(count), (len(queries), count))
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+        return [
+            [
+                {"id": self.ids[row], "score": float(row_scores[row]), "metadata": self.payloads[row]}
+                for row in rows.tolist()
+                if row_scores[row] != -np.inf
+            ]
+            for rows, row_scores in zip(top, scores)
+        ]
+
+class NumpyStore(VectorStore):
+    """
+    - embedded vector store, no qdrant container needed (single node / tests / load rigs)
+    - exact brute force top-k with one matrix-vector product, vectors live in a memory mapped file
+    """
+    def __init__(self, path: str = "vector_data"):
+        self.path = Path(path)
+        self._collections: Dict[str, _NumpyCollection] = {}
+
+    def _collection(self, namespace: str) -> _NumpyCollection:
+        collection = self._collections.get(namespace)
+        if collection is None:
+            raise ValueError(f"Collection '{namespace}' doesn't exist, call ensure_collection first")
+        return collection
+
+    async def ensure_collection(self, collection_name: str, vector_size: int):
+        """Create collection if doesn't exist, or load it from disk"""
+        if collection_name in self._collections:
+            return
+        loop = asyncio.get_running_loop()
+        collection = await loop.run_in_executor(
+            None, _NumpyCollection, self.path / collection_name, vector_size
+        )
+        self._collections.setdefault(collection_name, collection)
+        print(f"Collection '{collection_name}' ready with {collection.count} vectors")
+
+    async def upsert_vectors(self, namespace, ids, vectors, metadatas):
+        await self.ensure_collection(namespace, np.asarray(vectors).shape[1])
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._collection(namespace).upsert, ids, vectors, metadatas)
+        print(f"Upserted {len(ids)} vectors to '{namespace}'")
+
+    async def query_vectors(self, namespace, vector, top_k=5):
+        if namespace not in self._collections:
+            await self.ensure_collection(namespace, len(vector))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._collection(namespace).query, vector, top_k)
+
+    async def query_batch(self, namespace, vectors, top_k=5):
+        if namespace not in self._collections:
+            await self.ensure_collection(namespace, np.asarray(vectors).shape[1])
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._collection(namespace).query_batch, vectors, top_k)
+
+    async def delete_vectors(self, namespace, ids):
+        if namespace not in self._collections:
+            return
+        loop = asyncio.get_running_loop()
+        deleted = await loop.run_in_executor(None, self._collection(namespace).delete, ids)
+        print(f"Deleted {deleted} vectors from '{namespace}'")
+
+    async def set_payloads(self, namespace, ids, payloads):
+        if namespace not in self._collections:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._collection(namespace).set_payloads, ids, payloads)
+
+_vector_store = None
+
+def get_vector_store() -> VectorStore:
+    """
+    Shared vector store for ingestion & rag so they use one connection pool
+    Picked with VECTOR_STORE env
+    """
+    global _vector_store
+    if _vector_store is None:
+        if VECTOR_STORE == "qdrant":
+            _vector_store = QdrantStore(
+                url=QDRANT_URL,
+                upsert_batch_size=QDRANT_UPSERT_BATCH_SIZE,
+                upsert_parallel=QDRANT_UPSERT_PARALLEL
+            )
+        elif VECTOR_STORE == "qdrant-async":
+            _vector_store = AsyncQdrantStore(
+                url=QDRANT_URL,
+                prefer_grpc=QDRANT_PREFER_GRPC,
+                grpc_port=QDRANT_GRPC_PORT,
+                timeout=QDRANT_TIMEOUT,
+                max_connections=QDRANT_MAX_CONNECTIONS,
+                upsert_batch_size=QDRANT_UPSERT_BATCH_SIZE,
+                upsert_parallel=QDRANT_UPSERT_PARALLEL
+            )
+        elif VECTOR_STORE == "numpy":
+            _vector_store = NumpyStore(path=NUMPY_STORE_PATH)
+        else:
+            raise ValueError(f"Unknown vector store: {VECTOR_STORE}")
+    return _vector_store
+
+async def close_vector_store():
+    global _vector_store
+    if _vector_store is not None:
+        await _vector_store.close()
+        _vector_store = None
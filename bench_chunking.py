@@ -0,0 +1,85 @@
+"""
+Speed of the chunkers (app/helper.py) on multi-MB texts, and how many chunks the embedding model truncates.
+
+- chunk_fixed & chunk_semantic count characters, chunk_token counts tokens of the embedding tokenizer
+- "over window" is the share of chunks longer than the CHUNK_MAX_TOKENS the model reads, their ends are lost
+- iter_chunks_token is also run on 64KB pieces, the way streaming ingestion feeds it
+- without --file a synthetic text of paragraphs & sentences is generated per size
+- tokens are counted with the embedding model's tokenizer (pip install tokenizers), chars / 4 if it can't be loaded
+
+usage: python bench_chunking.py --sizes 1 4 16 --chunk-size 500 --chunk-tokens 254
+       python bench_chunking.py --file big.txt
+"""
+
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import Callable, List
+
+from app.helper import (
+    chunk_fixed, chunk_semantic, chunk_token, iter_chunks_token, _embedding_tokens, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+)
+
+WORDS = (
+    "the quick brown fox jumps over the lazy dog while retrieval augmented generation answers questions "
+    "about documents embeddings vectors tokenizer sentences paragraphs chunking overlap internationalization"
+).split()
+PIECE_SIZE = 64 * 1024
+
+def make_text(size_mb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    paragraphs, length = [], 0
+    while length < target:
+        sentences = [
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 40))).capitalize() + rng.choice(".!?")
+            for _ in range(rng.randint(1, 8))
+        ]
+        paragraphs.append(" ".join(sentences))
+        length += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+def _run(name: str, chunker: Callable[[str], List[str]], text: str) -> List[str]:
+    start = time.perf_counter()
+    chunks = chunker(text)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    tokens = _embedding_tokens.count_batch(chunks)
+    over = sum(1 for t in tokens if t > CHUNK_MAX_TOKENS)
+    print(
+        f"{name:<16}{len(text) / 1e6:>8.1f}{elapsed:>10.3f}{len(text) / elapsed / 1e6:>9.2f}{len(chunks):>9}"
+        f"{sum(tokens) / max(len(chunks), 1):>12.1f}{max(tokens, default=0):>12}{over / max(len(chunks), 1) * 100:>13.1f}%"
+    )
+    return chunks
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=Path, help="a text file instead of synthetic text")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="synthetic text sizes in MB")
+    parser.add_argument("--chunk-size", type=int, default=500, help="characters, fixed & semantic")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_MAX_TOKENS, help="tokens, token")
+    parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+
+    texts = [args.file.read_text(encoding="utf-8")] if args.file else [make_text(size) for size in args.sizes]
+    _embedding_tokens.count_batch(["load the tokenizer before timing"])
+
+    print(f"{'chunker':<16}{'MB':>8}{'seconds':>10}{'MB/s':>9}{'chunks':>9}{'avg tokens':>12}{'max tokens':>12}{'over window':>14}")
+    for text in texts:
+        _run("fixed", lambda t: chunk_fixed(t, args.chunk_size), text)
+        _run("semantic", lambda t: chunk_semantic(t, args.chunk_size), text)
+        whole = _run("token", lambda t: chunk_token(t, args.chunk_tokens, args.overlap_tokens), text)
+        streamed = _run(
+            "token streamed",
+            lambda t: list(iter_chunks_token(
+                (t[i:i + PIECE_SIZE] for i in range(0, len(t), PIECE_SIZE)), args.chunk_tokens, args.overlap_tokens
+            )),
+            text
+        )
+        if streamed != whole:
+            print("⚠️ streamed token chunks differ from the whole text ones")
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compare embedding runtimes (torch / onnx / onnx-int8) on this machine.
+
+- sentences/sec for every runtime and batch size
+- cosine parity against the pytorch vectors
+
+usage: python bench_embeddings.py --sentences 2000 --batch-sizes 1 8 32 128
+"""
+
+import time
+import random
+import argparse
+
+from app.services.shared.embeddings import RUNTIMES, _load_model, check_parity
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog document interview booking vector search "
+    "embedding chunk retrieval answer question context model python server request "
+    "latency throughput memory page section policy candidate schedule email phone"
+).split()
+
+def make_sentences(n: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(6, 60))) for _ in range(n)]
+
+def bench(model, sentences: list, batch_size: int) -> float:
+    # warm up so lazy init / graph optimization isn't measured
+    model.encode(sentences[:batch_size], batch_size=batch_size, convert_to_numpy=True)
+
+    start = time.perf_counter()
+    model.encode(sentences, batch_size=batch_size, convert_to_numpy=True)
+    return len(sentences) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--runtimes", nargs="+", default=list(RUNTIMES))
+    args = parser.parse_args()
+
+    sentences = make_sentences(args.sentences)
+
+    print(f"\n📏 {len(sentences)} sentences, batch sizes {args.batch_sizes}\n")
+    print(f"{'runtime':<12}{'batch':>8}{'sent/sec':>12}")
+
+    for runtime in args.runtimes:
+        model = _load_model(runtime)
+        for batch_size in args.batch_sizes:
+            rate = bench(model, sentences, batch_size)
+            print(f"{runtime:<12}{batch_size:>8}{rate:>12.1f}")
+
+    print(f"\n🎯 Parity vs torch (cosine)")
+    for runtime in args.runtimes:
+        if runtime == "torch":
+            continue
+        result = check_parity(sentences, runtime)
+        print(f"  {runtime:<12} min={result['min_cosine']:.5f} mean={result['mean_cosine']:.5f}")
+
+if __name__ == "__main__":
+    main()
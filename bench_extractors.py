@@ -0,0 +1,158 @@
+"""
+Speed & memory of the text extraction backends (app/services/ingestion/extractors.py).
+
+- every installed backend runs over the same files in its own fresh process, so peak RSS is its own
+- without --corpus a synthetic corpus is generated in --out: text pdfs, txt, md, html & docx
+- pdf backends that aren't installed are skipped & listed at the end: pip install pypdfium2 pymupdf
+- non paged formats (txt, md, html, docx) count one page per file
+
+usage: python bench_extractors.py --docs 20 --pages 50
+       python bench_extractors.py --corpus ./my_pdfs
+"""
+
+import time
+import zipfile
+import argparse
+import resource
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from app.services.ingestion.extractors import get_backend, backends_for, supported_suffixes, PDF_BACKENDS
+
+WORDS = "the quick brown fox jumps over the lazy dog while retrieval augmented generation answers questions".split()
+
+def _line(i: int, n: int = 12) -> str:
+    return " ".join(WORDS[(i + k) % len(WORDS)] for k in range(n))
+
+# Synthetic corpus
+
+def make_pdf(path: Path, pages: int, lines_per_page: int = 50):
+    """ a plain text pdf (Helvetica, one content stream per page), written by hand so no pdf library is needed """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        lines = " ".join(f"({_line(p * lines_per_page + i)}) Tj T*" for i in range(lines_per_page))
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {lines} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+def _paragraphs(n: int) -> List[str]:
+    return [" ".join(_line(p * 5 + i) for i in range(5)) for p in range(n)]
+
+def make_docx(path: Path, paragraphs: List[str]):
+    w = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    body = "".join(f"<w:p><w:r><w:t>{p}</w:t></w:r></w:p>" for p in paragraphs)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'
+        ))
+        docx.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>'
+        ))
+        docx.writestr("word/document.xml", f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{w}"><w:body>{body}</w:body></w:document>')
+
+def make_corpus(out: Path, docs: int, pages: int) -> List[Path]:
+    out.mkdir(parents=True, exist_ok=True)
+    paragraphs = _paragraphs(pages * 10)    # about as much text as a pdf of `pages` pages
+    files = []
+    for d in range(docs):
+        files.append(out / f"doc{d}.pdf")
+        make_pdf(files[-1], pages)
+    text = "\n\n".join(paragraphs)
+    (out / "doc.txt").write_text(text, encoding="utf-8")
+    (out / "doc.md").write_text("\n\n".join(f"## Section {i}\n\n{p}" for i, p in enumerate(paragraphs)), encoding="utf-8")
+    (out / "doc.html").write_text(
+        "<html><head><style>p {}</style></head><body>" + "".join(f"<div><p>{p}</p></div>\n" for p in paragraphs) + "</body></html>",
+        encoding="utf-8"
+    )
+    make_docx(out / "doc.docx", paragraphs)
+    return files + [out / name for name in ("doc.txt", "doc.md", "doc.html", "doc.docx")]
+
+# Benchmark
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024    # linux reports KB
+
+def _run_backend(backend: str, files: List[str]) -> dict:
+    extractor = get_backend(backend)
+    paths = [Path(f) for f in files]
+
+    # import the library & touch one file first, so the baseline only excludes the parsing itself
+    if extractor.paged:
+        extractor.page_count(paths[0])
+    base = _rss_mb()
+
+    pages = chars = 0
+    start = time.perf_counter()
+    for path in paths:
+        if extractor.paged:
+            for page in extractor.iter_pages(path):
+                pages += 1
+                chars += len(page)
+        else:
+            chars += sum(len(piece) for piece in extractor.iter_pieces(path))
+            pages += 1
+    elapsed = time.perf_counter() - start
+    return {"pages": pages, "chars": chars, "seconds": elapsed, "peak_rss_mb": _rss_mb() - base}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", type=Path, help="directory of real files, otherwise a synthetic corpus is generated")
+    parser.add_argument("--out", type=Path, default=Path("bench_corpus"), help="where the synthetic corpus goes")
+    parser.add_argument("--docs", type=int, default=10, help="synthetic pdfs")
+    parser.add_argument("--pages", type=int, default=50, help="pages per synthetic pdf")
+    args = parser.parse_args()
+
+    if args.corpus:
+        files = [p for p in sorted(args.corpus.rglob("*")) if p.is_file() and p.suffix.lower() in supported_suffixes()]
+    else:
+        files = make_corpus(args.out, args.docs, args.pages)
+    print(f"{len(files)} files")
+
+    by_suffix = {}
+    for path in files:
+        by_suffix.setdefault(path.suffix.lower(), []).append(str(path))
+
+    print(f"\n{'type':<7}{'backend':<12}{'files':>6}{'pages':>8}{'seconds':>10}{'pages/s':>10}{'MB text/s':>11}{'peak rss MB':>13}")
+    for suffix, group in sorted(by_suffix.items()):
+        for extractor in backends_for(suffix):
+            # a fresh process per backend, ru_maxrss never goes down
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                result = pool.submit(_run_backend, extractor.name, group).result()
+            seconds = max(result["seconds"], 1e-9)
+            print(
+                f"{suffix:<7}{extractor.name:<12}{len(group):>6}{result['pages']:>8}{seconds:>10.3f}"
+                f"{result['pages'] / seconds:>10.1f}{result['chars'] / seconds / 1e6:>11.2f}{result['peak_rss_mb']:>13.1f}"
+            )
+
+    installed = {e.name for e in backends_for(".pdf")}
+    missing = [name for name in PDF_BACKENDS if name not in installed]
+    if missing:
+        print(f"\nnot installed: {', '.join(missing)}")
+
+if __name__ == "__main__":
+    main()
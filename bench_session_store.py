@@ -0,0 +1,70 @@
+"""
+Chat history read / write latency of the session store backends.
+
+- every turn does what RAGPipeline does: read history + summary, then append a user/assistant pair
+- redis & redis-near-cache need a running redis (REDIS_HOST / REDIS_PORT) unless --skip-redis
+- keys are written under a bench_ session prefix and cleared afterwards
+
+usage: python bench_session_store.py --sessions 200 --turns 20
+"""
+
+import io
+import time
+import asyncio
+import argparse
+import contextlib
+
+import numpy as np
+from app.services.rag.session_store import InMemorySessionStore, NearCacheSessionStore
+from app.services.rag.redis_service import RedisService
+
+def make_turn(i: int, size: int) -> list:
+    return [
+        {"role": "user", "content": f"question {i} " + "x" * size},
+        {"role": "assistant", "content": f"answer {i} " + "y" * size},
+    ]
+
+async def run(name: str, store, args):
+    reads, writes = [], []
+    session_ids = [f"bench_{name}_{i}" for i in range(args.sessions)]
+
+    # RedisService logs every call, keep that out of the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        for turn in range(args.turns):
+            for session_id in session_ids:
+                start = time.perf_counter()
+                await asyncio.gather(store.get_chat_history(session_id), store.get_summary(session_id))
+                reads.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                await store.add_message(session_id, make_turn(turn, args.message_size))
+                writes.append((time.perf_counter() - start) * 1000)
+
+        for session_id in session_ids:
+            await store.clear_session(session_id)
+
+    reads, writes = np.asarray(reads), np.asarray(writes)
+    print(
+        f"{name:<18}{np.percentile(reads, 50):>10.3f}{np.percentile(reads, 99):>10.3f}"
+        f"{np.percentile(writes, 50):>10.3f}{np.percentile(writes, 99):>10.3f}"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--message-size", type=int, default=300, help="characters per message")
+    parser.add_argument("--skip-redis", action="store_true")
+    args = parser.parse_args()
+
+    print(f"\n{'backend':<18}{'read p50':>10}{'read p99':>10}{'write p50':>10}{'write p99':>10}   (ms)")
+    await run("memory", InMemorySessionStore(), args)
+
+    if not args.skip_redis:
+        redis_store = RedisService()
+        await run("redis", redis_store, args)
+        await run("redis-near-cache", NearCacheSessionStore(redis_store, InMemorySessionStore()), args)
+        await redis_store.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
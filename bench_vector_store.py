@@ -0,0 +1,104 @@
+"""
+Latency & recall of NumpyStore vs Qdrant at different collection sizes.
+
+- random 384-dim vectors around a few hundred centers (closer to real embeddings than pure noise)
+- recall@k is measured against exact brute force, so NumpyStore is always 1.0
+- needs a running qdrant (QDRANT_URL) unless --skip-qdrant
+
+usage: python bench_vector_store.py --sizes 10000 100000 1000000 --queries 200
+"""
+
+import time
+import asyncio
+import argparse
+import tempfile
+
+import numpy as np
+from app.services.shared.vector_store import NumpyStore, AsyncQdrantStore, QDRANT_URL
+
+DIM = 384
+INSERT_BATCH = 10_000
+
+def make_vectors(n: int, rng: np.random.Generator, centers: np.ndarray) -> np.ndarray:
+    picks = centers[rng.integers(0, len(centers), size=n)]
+    vectors = picks + 0.3 * rng.standard_normal((n, DIM), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+async def load(store, namespace: str, n: int, rng: np.random.Generator, centers: np.ndarray) -> np.ndarray:
+    await store.ensure_collection(namespace, DIM)
+    # keep every vector for the exact ground truth
+    all_vectors = np.empty((n, DIM), dtype=np.float32)
+    for start in range(0, n, INSERT_BATCH):
+        end = min(start + INSERT_BATCH, n)
+        vectors = make_vectors(end - start, rng, centers)
+        all_vectors[start:end] = vectors
+        await store.upsert_vectors(
+            namespace,
+            [f"bench_{i}" for i in range(start, end)],
+            vectors,
+            [{"i": i} for i in range(start, end)]
+        )
+    return all_vectors
+
+async def measure(store, namespace: str, queries: np.ndarray, truth: list, top_k: int) -> dict:
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = await store.query_vectors(namespace, query, top_k=top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {r["metadata"]["i"] for r in results}
+        hits += len(found & expected)
+
+    latencies = np.asarray(latencies)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "recall": hits / (len(queries) * top_k),
+    }
+
+async def run(size: int, args):
+    rng = np.random.default_rng(size)
+    centers = rng.standard_normal((256, DIM), dtype=np.float32)
+    namespace = f"bench_{size}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        numpy_store = NumpyStore(path=tmp)
+        load_start = time.perf_counter()
+        vectors = await load(numpy_store, namespace, size, np.random.default_rng(size + 1), centers)
+        numpy_load = time.perf_counter() - load_start
+
+        queries = make_vectors(args.queries, rng, centers)
+        scores = queries @ vectors.T
+        truth = [set(np.argpartition(-row, args.top_k)[:args.top_k].tolist()) for row in scores]
+        del scores
+
+        results = {"numpy": await measure(numpy_store, namespace, queries, truth, args.top_k)}
+        results["numpy"]["load_s"] = numpy_load
+
+    if not args.skip_qdrant:
+        qdrant_store = AsyncQdrantStore(url=QDRANT_URL)
+        load_start = time.perf_counter()
+        await load(qdrant_store, namespace, size, np.random.default_rng(size + 1), centers)
+        qdrant_load = time.perf_counter() - load_start
+        results["qdrant"] = await measure(qdrant_store, namespace, queries, truth, args.top_k)
+        results["qdrant"]["load_s"] = qdrant_load
+        await qdrant_store.client.delete_collection(namespace)
+        await qdrant_store.close()
+
+    for name, r in results.items():
+        print(f"{size:>10}  {name:<8}{r['load_s']:>9.1f}s{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['recall']:>9.3f}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--skip-qdrant", action="store_true")
+    args = parser.parse_args()
+
+    print(f"\n{'chunks':>10}  {'store':<8}{'load':>10}{'p50 ms':>10}{'p99 ms':>10}{'recall':>9}")
+    for size in args.sizes:
+        await run(size, args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
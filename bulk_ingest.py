@@ -0,0 +1,54 @@
+"""
+Ingest every supported document under a directory (recursive) in one bulk run,
+see app/services/ingestion/bulk.py. Prints the run report with docs/min at the end.
+
+usage: python bulk_ingest.py ./corpus --chunk-strategy semantic --chunk-size 500 --workers 8
+"""
+
+import json
+import asyncio
+import argparse
+from pathlib import Path
+from app.db.database import engine, Base, AsyncSessionLocal
+from app.db.migrations import add_missing_columns
+from app.services.shared.keyword_index import ensure_fts_index
+from app.services.ingestion.near_dup import ensure_band_index
+from app.services.shared.embeddings import shutdown_embedding_workers
+from app.services.shared.vector_store import close_vector_store
+from app.services.ingestion.bulk import bulk_ingest, collect_directory, BULK_EXTRACT_WORKERS, BULK_EMBED_BATCH_SIZE
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--chunk-strategy", choices=["fixed", "semantic", "token"], default="fixed")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=BULK_EXTRACT_WORKERS, help="extraction processes, 0 = cpu count")
+    parser.add_argument("--batch-size", type=int, default=BULK_EMBED_BATCH_SIZE, help="chunks per embed / store batch")
+    parser.add_argument("--replace", action="store_true", help="update stored documents with the same filename in place")
+    args = parser.parse_args()
+
+    files = collect_directory(args.directory)
+    if not files:
+        print(f"No supported documents under {args.directory}")
+        return
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(ensure_fts_index)
+        await conn.run_sync(ensure_band_index)
+
+    try:
+        async with AsyncSessionLocal() as session:
+            report = await bulk_ingest(
+                files, args.chunk_strategy, args.chunk_size, session,
+                workers=args.workers, batch_size=args.batch_size, replace=args.replace
+            )
+    finally:
+        shutdown_embedding_workers()
+        await close_vector_store()
+
+    print(json.dumps({k: v for k, v in report.items() if k != "results"}, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""
+Runs ingestion workers in their own process, next to (or instead of) the API's in-process ones.
+Jobs are shared through the ingestion_jobs table, so start as many of these as the machine has room for.
+Set INGEST_WORKERS=0 for the API to leave all the work to them.
+
+usage: python ingest_worker.py --workers 2
+"""
+
+import asyncio
+import argparse
+from app.db.database import engine, Base
+from app.db.models import IngestionJob
+from app.db.migrations import add_missing_columns
+from app.services.shared.keyword_index import ensure_fts_index
+from app.services.ingestion.near_dup import ensure_band_index
+from app.services.shared.embeddings import shutdown_embedding_workers
+from app.services.shared.vector_store import close_vector_store
+from app.services.ingestion.jobs import IngestionWorkerPool, INGEST_POLL_INTERVAL
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--poll-interval", type=float, default=INGEST_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(ensure_fts_index)
+        await conn.run_sync(ensure_band_index)
+
+    pool = IngestionWorkerPool(args.workers, args.poll_interval)
+    pool.start()
+    try:
+        await asyncio.Event().wait()    # until ctrl+c
+    finally:
+        print("🔻 Stopping ingestion workers...")
+        await pool.stop()
+        shutdown_embedding_workers()
+        await close_vector_store()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
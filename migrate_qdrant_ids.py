@@ -0,0 +1,62 @@
+"""
+Re-keys qdrant points stored by older versions under hash(vector_id) integer ids
+to the stable uuid5 ids of point_id(), so deletes and payload updates find them again.
+
+Old points kept their vector and payload (doc_id, chunk_index), the vector_id comes from the
+chunks table, so nothing is re-embedded. Points without a stored chunk are leftovers and deleted.
+Stop the API and ingestion workers while it runs.
+
+usage: python migrate_qdrant_ids.py --collection documents
+"""
+
+import asyncio
+import argparse
+from sqlalchemy import select
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct, PointIdsList
+from app.db.database import AsyncSessionLocal
+from app.db.models import Chunk
+from app.services.shared.vector_store import QDRANT_URL, point_id
+
+async def migrate(collection: str, batch_size: int):
+    client = QdrantClient(url=QDRANT_URL)
+
+    # (doc_id, chunk_index) -> vector_id of the chunk that owns the vector
+    async with AsyncSessionLocal() as session:
+        rows = await session.execute(
+            select(Chunk.doc_id, Chunk.chunk_index, Chunk.vector_id).where(Chunk.canonical_id.is_(None))
+        )
+        vector_ids = {(doc_id, chunk_index): vector_id for doc_id, chunk_index, vector_id in rows}
+
+    moved = dropped = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        legacy = [point for point in points if isinstance(point.id, int)]
+        if legacy:
+            keep = []
+            for point in legacy:
+                vector_id = vector_ids.get(((point.payload or {}).get("doc_id"), (point.payload or {}).get("chunk_index")))
+                if vector_id is not None:
+                    keep.append(PointStruct(id=point_id(vector_id), vector=point.vector, payload=point.payload))
+            if keep:
+                client.upsert(collection_name=collection, points=keep, wait=True)
+            client.delete(
+                collection_name=collection, points_selector=PointIdsList(points=[point.id for point in legacy]), wait=True
+            )
+            moved += len(keep)
+            dropped += len(legacy) - len(keep)
+        if offset is None:
+            break
+
+    client.close()
+    print(f"\n✅ Re-keyed {moved} points, deleted {dropped} points without a stored chunk")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--collection", default="documents")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.collection, args.batch_size))
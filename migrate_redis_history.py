@@ -0,0 +1,22 @@
+"""
+Converts chat histories stored as json strings (chat:{session_id}) to redis lists.
+
+Not required, RedisService migrates a legacy key the first time it's read or written,
+this just does all of them at once. Safe to run while the app is serving.
+
+usage: python migrate_redis_history.py
+"""
+
+import asyncio
+from app.services.rag.redis_service import RedisService
+
+async def migrate():
+    redis_service = RedisService()
+    try:
+        migrated = await redis_service.migrate_legacy_sessions()
+        print(f"\n✅ Migrated {migrated} chat histories")
+    finally:
+        await redis_service.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -22,7 +22,7 @@ if choice == "📄 Document Ingestion":
 
     col1, col2 = st.columns(2)
     with col1:
-        chunk_strategy = st.selectbox("Chunk Strategy", ["fixed", "semantic"])
+        chunk_strategy = st.selectbox("Chunk Strategy", ["fixed", "semantic", "token"])
     with col2:
         chunk_size = st.number_input("Chunk Size", value=500, min_value=100, max_value=2000)
 
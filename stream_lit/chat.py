@@ -1,9 +1,29 @@
 # chat.py
+import json
 import requests
 import streamlit as st
 
 API_BASE = "http://127.0.0.1:8000"
 
+def _stream_answer(query: str, session_id: str):
+    """ yields answer tokens from the /rag/query-stream SSE endpoint """
+    with requests.post(
+        f"{API_BASE}/rag/query-stream",
+        json={"query": query, "session_id": session_id, "top_k": 5},
+        stream=True
+    ) as resp:
+        resp.raise_for_status()
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "token":
+                    yield data["text"]
+                elif event == "error":
+                    raise RuntimeError(data["detail"])
+
 def rag_chat():
     st.header("💬 Chat with Your Documents")
     
@@ -23,15 +43,10 @@ def rag_chat():
             st.markdown(query)
         
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    resp = requests.post(
-                        f"{API_BASE}/rag/query",
-                        json={"query": query, "session_id": session_id, "top_k": 5}
-                    ).json()
-                    
-                    st.markdown(resp["answer"])
-                    st.session_state.messages.append({"role": "assistant", "content": resp["answer"]})
-                    
-                except Exception as e:
-                    st.error(f"Error: {e}")
\ No newline at end of file
+            try:
+                # tokens show up as they arrive instead of after the whole answer
+                answer = st.write_stream(_stream_answer(query, session_id))
+                st.session_state.messages.append({"role": "assistant", "content": answer})
+                
+            except Exception as e:
+                st.error(f"Error: {e}")